@@ -0,0 +1,114 @@
+# File: bench_db.py
+# مقایسه سرعت عملیات پرتکرار دیتابیس با اتصال ماندگار هر ترد (فعلی)
+# و باز کردن اتصال جدید در هر فراخوانی (روش قبلی).
+# اجرا: python bench_db.py [تعداد_تکرار]
+import sys
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from bot.database import Database
+from bot.db.base import logger
+
+# قفل سراسری پیاده‌سازی قبلی _conn
+_legacy_lock = threading.RLock()
+
+
+class LegacyDatabase(Database):
+    """
+    همان Database با پیاده‌سازی قبلی _conn: اتصال و PRAGMA جدید زیر قفل سراسری در هر فراخوانی.
+    فراخوانی تودرتو (مثل refresh_daily_usage داخل add_usage_snapshot) از همان اتصال بیرونی استفاده می‌کند.
+    """
+
+    @contextmanager
+    def _conn(self):
+        outer = getattr(self._local, 'legacy_conn', None)
+        if outer is not None:
+            yield outer
+            return
+        with _legacy_lock:
+            try:
+                conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, timeout=10)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA foreign_keys = ON;")
+                conn.row_factory = sqlite3.Row
+                self._local.legacy_conn = conn
+                try:
+                    yield conn
+                finally:
+                    self._local.legacy_conn = None
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Database error: {e}")
+                if 'conn' in locals():
+                    conn.rollback()
+                raise
+            finally:
+                if 'conn' in locals():
+                    conn.close()
+
+
+def _prepare(db) -> int:
+    db.add_or_update_user(1000, "bench", "Bench", None)
+    with db._conn() as c:
+        c.execute("INSERT INTO user_uuids (user_id, uuid, name) VALUES (?, ?, ?)", (1000, "bench-uuid", "bench"))
+        return c.execute("SELECT id FROM user_uuids WHERE uuid = ?", ("bench-uuid",)).fetchone()['id']
+
+
+def _ops_per_sec(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return iterations / (time.perf_counter() - start)
+
+
+def _threaded_ops_per_sec(func, iterations: int, threads: int = 4) -> float:
+    workers = [threading.Thread(target=lambda: [func() for _ in range(iterations)]) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return iterations * threads / (time.perf_counter() - start)
+
+
+def run_benchmark(db_class, iterations: int) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="vpanel-bench-")
+    try:
+        db = db_class(os.path.join(work_dir, "bench.db"))
+        uuid_id = _prepare(db)
+
+        def read_user():
+            # کش کاربر پاک می‌شود تا هر بار واقعاً از دیتابیس خوانده شود
+            db._user_cache.clear()
+            db.user(1000)
+
+        return {
+            "db.user()": _ops_per_sec(read_user, iterations),
+            "db.uuids()": _ops_per_sec(lambda: db.uuids(1000), iterations),
+            "add_usage_snapshot": _ops_per_sec(lambda: db.add_usage_snapshot(uuid_id, 1.0, 2.0), iterations),
+            "db.uuids() x4 threads": _threaded_ops_per_sec(lambda: db.uuids(1000), iterations),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    before = run_benchmark(LegacyDatabase, iterations)
+    after = run_benchmark(Database, iterations)
+
+    print(f"{'operation':<24}{'before (ops/s)':>16}{'after (ops/s)':>16}{'speedup':>10}")
+    print("-" * 66)
+    for name in before:
+        print(f"{name:<24}{before[name]:>16,.0f}{after[name]:>16,.0f}{after[name] / before[name]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# File: bench_user_agents.py
+# بنچمارک تشخیص کلاینت از روی User-Agent روی مجموعه‌ای از رشته‌های واقعی کلاینت‌ها.
+# دو حالت اندازه‌گیری می‌شود:
+#   1. بدون حافظه موقت (هر رشته از نو با الگوهای کامپایل‌شده بررسی می‌شود)
+#   2. parse_user_agent با حافظه LRU (حالت عادی؛ مثل لیست دستگاه‌ها که رشته‌های تکراری زیادی دارد)
+# اجرا: python bench_user_agents.py [تعداد_تکرار]
+import sys
+import os
+import logging
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from bot.utils import parse_user_agent, _classify_user_agent
+
+CORPUS = [
+    "Happ/1.9.5/ios",
+    "Happ/2.0.1/android",
+    "NekoBox/android/1.3.4 (Prefer ClashMeta Format)",
+    "v2box/8.19",
+    "V2Box/7.6.3 (Android 13)",
+    "V2Box 8.14;IOS 17.5.1",
+    "Shadowrocket/2070 CFNetwork/1494.0.7 Darwin/23.4.0 iPhone14,5",
+    "Stash/2.7.1 Clash/1.11.0 CFNetwork/1496.0.7 Darwin/23.5.0",
+    "Streisand/92 CFNetwork/1568.100.1 Darwin/24.0.0",
+    "FoXray/3.12 CFNetwork/1410.1 Darwin/22.6.0 (iPad; iPadOS 16.6)",
+    "Loon/3.2.1 CFNetwork/1498.700.2 Darwin/23.6.0",
+    "HiddifyNext/2.5.7 (android) like ClashMeta v2ray sing-box",
+    "HiddifyNextX/2.0.5 (windows) like ClashMeta v2ray sing-box",
+    "HiddifyNext/2.5.7 (ios) like ClashMeta v2ray sing-box",
+    "v2rayNG/1.8.19",
+    "v2rayNG/1.9.16",
+    "v2rayN/6.45",
+    "v2rayN/7.2.1",
+    "nekoray/3.26",
+    "Throne/1.0.2 (windows; amd64)",
+    "NapsternetV/64 (android)",
+    "NapsternetV/80 CFNetwork/1474 Darwin/23.0.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.6422.165 Mobile Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Safari/605.1.15",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0",
+    "ClashMetaForAndroid/2.10.1.Meta",
+    "clash-verge/v1.7.5",
+    "sing-box 1.9.3",
+    "okhttp/4.12.0",
+]
+
+
+def _ops_per_sec(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for user_agent in CORPUS:
+            func(user_agent)
+    return iterations * len(CORPUS) / (time.perf_counter() - start)
+
+
+def _uncached(user_agent: str):
+    _classify_user_agent.cache_clear()
+    return parse_user_agent(user_agent)
+
+
+def main():
+    # پیام‌های DEBUG_USER_AGENT برای رشته‌های ناشناخته خروجی بنچمارک را شلوغ می‌کنند
+    logging.disable(logging.INFO)
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    print(f"{'UA string':<60} -> parsed")
+    print("-" * 100)
+    for user_agent in CORPUS:
+        parsed = parse_user_agent(user_agent)
+        print(f"{user_agent[:58]:<60} -> {parsed['client']} | {parsed['os']} | {parsed['version']}")
+    print()
+
+    uncached = _ops_per_sec(_uncached, iterations)
+    _classify_user_agent.cache_clear()
+    cached = _ops_per_sec(parse_user_agent, iterations)
+
+    print(f"{'compiled patterns, no memo':<32}{uncached:>14,.0f} parses/s")
+    print(f"{'compiled patterns + LRU memo':<32}{cached:>14,.0f} parses/s  ({cached / uncached:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
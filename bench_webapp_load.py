@@ -0,0 +1,113 @@
+# File: bench_webapp_load.py
+# تست بار وب‌اپ در حال اجرا (مثلاً gunicorn -c gunicorn.conf.py wsgi:app).
+# دو مسیر پرترافیک به صورت همزمان فراخوانی می‌شوند:
+#   1. /user/sub/<uuid>  (لینک اشتراک؛ UUIDها از دیتابیس محلی یا آرگومان --uuids خوانده می‌شوند)
+#   2. /admin/dashboard   (با ورود ادمین؛ رمز از ADMIN_SECRET_KEY در .env)
+# برای هر مسیر تعداد درخواست، خطاها، درخواست در ثانیه و صدک‌های زمان پاسخ چاپ می‌شود.
+# اجرا: python bench_webapp_load.py [--url http://127.0.0.1:8001] [--requests 2000] [--concurrency 32]
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from bot.config import ADMIN_SECRET_KEY
+
+_CSRF_RE = re.compile(r'name="csrf_token" value="([^"]+)"')
+_local = threading.local()
+
+
+def _session() -> requests.Session:
+    # هر ترد سشن (و اتصال keep-alive) خودش را دارد
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def _admin_cookies(base_url: str) -> dict:
+    session = requests.Session()
+    page = session.get(f"{base_url}/login", timeout=30)
+    match = _CSRF_RE.search(page.text)
+    response = session.post(f"{base_url}/login", timeout=30, allow_redirects=False, data={
+        'login_type': 'admin', 'password': ADMIN_SECRET_KEY or '', 'csrf_token': match.group(1) if match else '',
+    })
+    if response.status_code not in (301, 302) or 'dashboard' not in response.headers.get('Location', ''):
+        raise SystemExit("Admin login failed; check ADMIN_SECRET_KEY in .env")
+    return session.cookies.get_dict()
+
+
+def _load_uuids(limit: int) -> list[str]:
+    from bot.database import db
+    return [row['uuid'] for row in db.all_active_uuids()][:limit]
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _run(label: str, urls: list[str], total: int, concurrency: int, cookies: dict | None = None):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def _hit(i: int):
+        nonlocal errors
+        url = urls[i % len(urls)]
+        start = time.perf_counter()
+        try:
+            response = _session().get(url, cookies=cookies, timeout=120, allow_redirects=False)
+            ok = response.status_code in (200, 304)
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(_hit, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"{label:<18}{total:>8} req {errors:>6} err {total / wall:>10.1f} req/s   "
+          f"p50 {_percentile(latencies, 50) * 1000:>8.1f} ms   p95 {_percentile(latencies, 95) * 1000:>8.1f} ms   "
+          f"p99 {_percentile(latencies, 99) * 1000:>8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the subscription and admin dashboard endpoints.")
+    parser.add_argument('--url', default='http://127.0.0.1:8001')
+    parser.add_argument('--requests', type=int, default=2000, help="requests per endpoint")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--uuids', nargs='*', help="subscription UUIDs (default: active UUIDs from the local DB)")
+    parser.add_argument('--max-uuids', type=int, default=500)
+    parser.add_argument('--skip-dashboard', action='store_true')
+    args = parser.parse_args()
+    base_url = args.url.rstrip('/')
+
+    uuids = args.uuids or _load_uuids(args.max_uuids)
+    if not uuids:
+        raise SystemExit("No UUIDs to test; pass --uuids or run next to bot_data.db")
+
+    print(f"Target: {base_url} | {len(uuids)} UUID(s) | {args.requests} requests/endpoint | concurrency {args.concurrency}")
+    print("-" * 110)
+    _run("/user/sub/<uuid>", [f"{base_url}/user/sub/{u}" for u in uuids], args.requests, args.concurrency)
+    if not args.skip_dashboard:
+        cookies = _admin_cookies(base_url)
+        # داشبورد سنگین‌تر است؛ یک دهم تعداد درخواست‌ها
+        _run("/admin/dashboard", [f"{base_url}/admin/dashboard"], max(1, args.requests // 10), args.concurrency, cookies)
+
+
+if __name__ == "__main__":
+    main()
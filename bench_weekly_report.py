@@ -0,0 +1,119 @@
+# File: bench_weekly_report.py
+# بنچمارک گزارش هفتگی پرمصرف‌ها روی یک دیتابیس مصنوعی (پیش‌فرض ۵۰۰۰ کاربر و ۸ روز اسنپ‌شات ساعتی).
+# سه حالت مقایسه می‌شود:
+#   1. روش قبلی: دو جستجو به ازای هر UUID در هر روز
+#   2. ساخت جدول daily_usage با یک بار خواندن اسنپ‌شات‌ها (rebuild_daily_usage)
+#   3. گزارش هفتگی از روی daily_usage
+# اجرا: python bench_weekly_report.py [تعداد_کاربر] [تعداد_روز]
+import sys
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from bot.database import Database
+
+
+def build_synthetic_db(path: str, users: int, days: int) -> Database:
+    db = Database(path)
+    now = datetime.now(pytz.utc).replace(minute=0, second=0, microsecond=0)
+    rnd = random.Random(42)
+    with db._conn() as c:
+        c.executemany(
+            "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
+            ((i, f"user{i}", f"User {i}") for i in range(1, users + 1))
+        )
+        c.executemany(
+            "INSERT INTO user_uuids (id, user_id, uuid, name) VALUES (?, ?, ?, ?)",
+            ((i, i, f"uuid-{i}", f"config-{i}") for i in range(1, users + 1))
+        )
+
+        def snapshots():
+            for uuid_id in range(1, users + 1):
+                h_usage, m_usage = rnd.random() * 20, rnd.random() * 5
+                for hour in range(days * 24, 0, -1):
+                    if rnd.random() < 0.01:
+                        h_usage = 0.0  # ریست شدن حجم
+                    h_usage += rnd.random() * 0.2
+                    m_usage += rnd.random() * 0.05
+                    yield (uuid_id, h_usage, m_usage, now - timedelta(hours=hour, minutes=rnd.randint(0, 10)))
+
+        c.executemany(
+            "INSERT INTO usage_snapshots (uuid_id, hiddify_usage_gb, marzban_usage_gb, taken_at) VALUES (?, ?, ?, ?)",
+            snapshots()
+        )
+    return db
+
+
+def legacy_weekly_totals(db: Database) -> dict:
+    """هسته محاسبه نسخه قبلی گزارش هفتگی: دو جستجوی LIMIT 1 به ازای هر UUID و هر روز."""
+    tehran_tz = pytz.timezone("Asia/Tehran")
+    with db._conn() as c:
+        last_taken = c.execute("SELECT MAX(taken_at) AS last_taken FROM usage_snapshots").fetchone()['last_taken']
+        base_date = datetime.fromisoformat(str(last_taken)).astimezone(tehran_tz).date()
+        uuids = [dict(r) for r in c.execute("SELECT id, user_id FROM user_uuids WHERE is_active = 1")]
+        totals = {}
+        for day_offset in range(7):
+            target_date = base_date - timedelta(days=day_offset)
+            day_start = tehran_tz.localize(datetime(target_date.year, target_date.month, target_date.day))
+            day_start_utc, day_end_utc = day_start.astimezone(pytz.utc), (day_start + timedelta(days=1)).astimezone(pytz.utc)
+            for u in uuids:
+                baseline = c.execute(
+                    "SELECT hiddify_usage_gb, marzban_usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at < ? ORDER BY taken_at DESC LIMIT 1",
+                    (u['id'], day_start_utc)
+                ).fetchone()
+                end = c.execute(
+                    "SELECT hiddify_usage_gb, marzban_usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at < ? ORDER BY taken_at DESC LIMIT 1",
+                    (u['id'], day_end_utc)
+                ).fetchone()
+                if not end:
+                    continue
+                h_start, m_start = (baseline['hiddify_usage_gb'], baseline['marzban_usage_gb']) if baseline else (0.0, 0.0)
+                h_end, m_end = end['hiddify_usage_gb'], end['marzban_usage_gb']
+                h_usage = h_end - h_start if h_end >= h_start else h_end
+                m_usage = m_end - m_start if m_end >= m_start else m_end
+                total = max(0.0, h_usage) + max(0.0, m_usage)
+                if total > 0.001:
+                    totals[u['user_id']] = totals.get(u['user_id'], 0.0) + total
+    return totals
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    work_dir = tempfile.mkdtemp(prefix="vpanel-bench-")
+    try:
+        print(f"Building synthetic DB: {users} users x {days} days of hourly snapshots...")
+        db, build_time = timed(lambda: build_synthetic_db(os.path.join(work_dir, "bench.db"), users, days))
+        print(f"  built in {build_time:.1f}s")
+
+        legacy, legacy_time = timed(lambda: legacy_weekly_totals(db))
+        rows, rebuild_time = timed(db.rebuild_daily_usage)
+        report, report_time = timed(db.get_weekly_top_consumers_report)
+
+        legacy_top = sorted(legacy.values(), reverse=True)[:20]
+        new_top = [c['total_usage'] for c in report['top_20_overall']]
+        matches = len(legacy_top) == len(new_top) and all(abs(a - b) < 1e-6 for a, b in zip(legacy_top, new_top))
+
+        print(f"{'legacy per-UUID/day lookups':<36}{legacy_time:>8.2f}s")
+        print(f"{'rebuild daily_usage (one pass)':<36}{rebuild_time:>8.2f}s  ({rows} rows)")
+        print(f"{'weekly report from daily_usage':<36}{report_time:>8.2f}s")
+        print(f"top-20 totals identical to legacy: {matches}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ from .config import EMOJIS, PAGE_SIZE, ACHIEVEMENTS
 from .database import db
 from .utils import (
     format_daily_usage, escape_markdown,
-    format_relative_time , to_shamsi, days_until_next_birthday, create_progress_bar, parse_user_agent
+    format_relative_time , to_shamsi, days_until_next_birthday, create_progress_bar, user_agent_details
 )
 
 logger = logging.getLogger(__name__)
@@ -127,7 +127,7 @@ def fmt_admin_user_summary(info: dict, db_user: Optional[dict] = None) -> str:
                 report_lines.append(separator)
                 report_lines.append("📱 *دستگاه‌های متصل:*")
                 for agent in user_agents[:5]:
-                    parsed = parse_user_agent(agent['user_agent'])
+                    parsed = user_agent_details(agent)
                     if parsed:
                         os_name_lower = (parsed.get('os') or '').lower()
                         icon = "❓"
@@ -896,7 +896,7 @@ def fmt_connected_devices_list(devices: list, page: int) -> str:
     # --- 1. Group devices by user ---
     users_devices = {}
     for device in devices:
-        parsed = parse_user_agent(device['user_agent'])
+        parsed = user_agent_details(device)
         if not parsed:
             continue
             
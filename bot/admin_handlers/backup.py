@@ -7,9 +7,8 @@ from datetime import datetime
 from telebot import types
 
 # --- START: MODIFIED IMPORTS ---
-# هندلرهای API را به صورت کلاس وارد می‌کنیم، نه نمونه‌های آماده
-from ..hiddify_api_handler import HiddifyAPIHandler
-from ..marzban_api_handler import MarzbanAPIHandler
+# هندلرهای API از رجیستری combined_handler گرفته می‌شوند تا سشن‌ها بازاستفاده شوند
+from .. import combined_handler
 from ..database import db # دیتابیس برای خواندن پنل‌ها
 # --- END: MODIFIED IMPORTS ---
 
@@ -96,11 +95,7 @@ def _handle_panel_backup_request(call, panel_type_to_backup: str):
 
         # ۳. برای هر پنل، یک handler بساز و کاربرانش را بگیر
         for panel_config in target_panels:
-            handler = None
-            if panel_type_to_backup == 'hiddify':
-                handler = HiddifyAPIHandler(panel_config)
-            elif panel_type_to_backup == 'marzban':
-                handler = MarzbanAPIHandler(panel_config)
+            handler = combined_handler._get_handler_for_panel(panel_config)
 
             if handler:
                 users = handler.get_all_users()
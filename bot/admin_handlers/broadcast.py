@@ -1,15 +1,12 @@
 import logging
-import time
 from telebot import types
 import pytz
 from datetime import datetime, timedelta
-import re
 
 from ..database import db
-from .. import combined_handler
+from .. import combined_handler, broadcast_engine
 from ..menu import menu
 from ..utils import _safe_edit, escape_markdown 
-from telebot.apihelper import ApiTelegramException
 
 logger = logging.getLogger(__name__)
 bot, admin_conversations = None, None
@@ -127,38 +124,8 @@ def _send_broadcast(message: types.Message):
         except Exception: pass
         return
     
+    # ارسال در پس‌زمینه انجام می‌شود تا ترد polling آزاد بماند؛ پیام منبع تا پایان ارسال حذف نمی‌شود
+    broadcast_id = db.create_broadcast(admin_id, message.message_id, original_msg_id, target_group, list(unique_targets))
     if original_msg_id:
         _safe_edit(admin_id, original_msg_id, f"⏳ شروع ارسال پیام برای {len(unique_targets)} کاربر\\.\\.\\.", parse_mode="MarkdownV2", reply_markup=None)
-
-    success_count, fail_count = 0, 0
-    for user_id in unique_targets:
-        try:
-            bot.copy_message(chat_id=user_id, from_chat_id=admin_id, message_id=message.message_id)
-            success_count += 1
-            time.sleep(0.1) 
-        except ApiTelegramException as e:
-            if 'flood control' in e.description.lower():
-                try:
-                    retry_after = int(re.search(r'retry after (\d+)', e.description).group(1))
-                    time.sleep(retry_after)
-                    bot.copy_message(chat_id=user_id, from_chat_id=admin_id, message_id=message.message_id)
-                    success_count += 1
-                except Exception as retry_e:
-                    fail_count += 1
-            else:
-                fail_count += 1
-        except Exception as e:
-            fail_count += 1
-            
-    try: bot.delete_message(chat_id=admin_id, message_id=message.message_id)
-    except Exception as e: logger.warning(f"Could not delete broadcast source message for admin {admin_id}: {e}")
-
-    final_report_text = (
-        f"✅ *ارسال همگانی به پایان رسید\\.*\n\n"
-        f"🔹 *موفقیت‌آمیز :* {success_count}\n"
-        f"🔸 *ناموفق :* {fail_count}"
-    )
-    if original_msg_id:
-        _safe_edit(admin_id, original_msg_id, final_report_text, reply_markup=back_to_broadcast_menu)
-    else:
-        bot.send_message(admin_id, final_report_text, parse_mode='MarkdownV2', reply_markup=back_to_broadcast_menu)
\ No newline at end of file
+    broadcast_engine.start_broadcast(bot, broadcast_id)
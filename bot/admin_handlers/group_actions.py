@@ -1,14 +1,20 @@
 import logging
+import time
 from telebot import types
 from datetime import datetime, timedelta
 from ..menu import menu
-from ..utils import _safe_edit, load_service_plans, parse_volume_string, escape_markdown
+from ..utils import _safe_edit, escape_markdown
+from ..catalog import get_plan_catalog
 from .. import combined_handler
+from ..config import BROADCAST_PROGRESS_INTERVAL
 import pytz
 
 logger = logging.getLogger(__name__)
 bot, admin_conversations = None, None
 
+# حداکثر تعداد کاربران ناموفقی که نامشان در گزارش پایانی دستور گروهی نمایش داده می‌شود
+_FAILED_USERS_PREVIEW = 15
+
 def initialize_group_actions_handlers(b, conv_dict):
     global bot, admin_conversations
     bot = b
@@ -22,10 +28,10 @@ def handle_select_plan_for_action(call, params):
     _safe_edit(uid, msg_id, "⏳ در حال محاسبه تعداد کاربران هر پلن\\.\\.\\.", reply_markup=None)
 
     try:
-        all_plans = load_service_plans()
+        plan_catalog = get_plan_catalog()
         all_users = combined_handler.get_all_users_combined()
         
-        plan_counts = {i: 0 for i in range(len(all_plans))}
+        plan_counts = {i: 0 for i in range(len(plan_catalog))}
 
         for user in all_users:
             h_info = user.get('breakdown', {}).get('hiddify', {})
@@ -35,17 +41,14 @@ def handle_select_plan_for_action(call, params):
             user_vol_de = h_info.get('usage_limit_GB', 0.0)
             user_vol_fr = m_info.get('usage_limit_GB', 0.0)
 
-            for i, plan in enumerate(all_plans):
-                plan_vol_de = float(parse_volume_string(plan.get('volume_de', '0')))
-                plan_vol_fr = float(parse_volume_string(plan.get('volume_fr', '0')))
-                
-                if user_vol_de == plan_vol_de and user_vol_fr == plan_vol_fr:
-                    plan_counts[i] += 1
-                    break 
+            # اولین پلن با همین حجم‌ها (ایندکس از پیش ساخته شده کاتالوگ پلن‌ها)
+            plan = plan_catalog.by_panel_volumes.get((user_vol_de, user_vol_fr))
+            if plan:
+                plan_counts[plan.index] += 1
 
         # ساخت منوی داینامیک با تعداد کاربران
         kb = types.InlineKeyboardMarkup(row_width=1)
-        for i, plan in enumerate(all_plans):
+        for i, plan in enumerate(plan_catalog.as_list()):
             plan_name = escape_markdown(plan.get('name', f'پلن {i+1}'))
             count = plan_counts.get(i, 0)
             button_text = f"{plan_name} ({count} کاربر)"
@@ -71,11 +74,9 @@ def handle_ask_action_value(call, params):
     
     elif context_type == 'plan':
         plan_index = int(context_value)
-        all_plans = load_service_plans()
-        selected_plan = all_plans[plan_index]
+        selected_plan = get_plan_catalog().plans[plan_index]
 
-        plan_vol_de = float(parse_volume_string(selected_plan.get('volume_de', '0')))
-        plan_vol_fr = float(parse_volume_string(selected_plan.get('volume_fr', '0')))
+        plan_vol_de, plan_vol_fr = selected_plan.panel_volumes
         all_users = combined_handler.get_all_users_combined()
         
         target_users = []
@@ -86,7 +87,7 @@ def handle_ask_action_value(call, params):
             user_vol_fr = m_info.get('usage_limit_GB', -1.0)
             if user_vol_de == plan_vol_de and user_vol_fr == plan_vol_fr:
                 target_users.append(user)
-        plan_or_filter_name = f"پلن «{escape_markdown(selected_plan.get('name', ''))}»"
+        plan_or_filter_name = f"پلن «{escape_markdown(selected_plan.name or '')}»"
 
     else:
         _safe_edit(uid, msg_id, "❌ خطای داخلی: اطلاعات زمینه یافت نشد\\.", reply_markup=menu.admin_group_actions_menu())
@@ -139,17 +140,31 @@ def _apply_group_action(message: types.Message):
     add_gb = value if action_type == 'add_gb' else 0
     add_days = int(value) if action_type == 'add_days' else 0
 
-    success_count, fail_count = 0, 0
-    for user in target_users:
-        identifier = user.get('uuid') or user.get('username')
-        if combined_handler.modify_user_on_all_panels(identifier, add_gb=add_gb, add_days=add_days):
-            success_count += 1
-        else:
-            fail_count += 1
+    last_progress_edit = [time.monotonic()]
+
+    def _report_progress(done: int, total: int):
+        now = time.monotonic()
+        # پیام پایانی جداگانه ارسال می‌شود؛ ویرایش‌های میانی به فاصله BROADCAST_PROGRESS_INTERVAL محدودند
+        if done >= total or now - last_progress_edit[0] < BROADCAST_PROGRESS_INTERVAL:
+            return
+        last_progress_edit[0] = now
+        _safe_edit(uid, msg_id, f"⏳ در حال اجرای دستور\\.\\.\\. *{done}* از *{total}* کاربر انجام شد\\.")
+
+    report = combined_handler.bulk_modify_users(target_users, add_gb=add_gb, add_days=add_days,
+                                                progress_callback=_report_progress)
+    success_count, partial_count, fail_count = len(report['succeeded']), len(report['partial']), len(report['failed'])
 
     final_text = (f"✅ عملیات گروهی با موفقیت انجام شد\\.\n\n"
                   f"🔹 به *{success_count}* کاربر اعمال شد\\.\n"
+                  f"🔸 عملیات برای *{partial_count}* کاربر فقط روی بخشی از پنل‌ها اعمال شد\\.\n"
                   f"🔸 عملیات برای *{fail_count}* کاربر ناموفق بود\\.")
+    for title, items in (("کاربران با اعمال ناقص", report['partial']), ("کاربران ناموفق", report['failed'])):
+        if not items:
+            continue
+        names = [f"• {escape_markdown(item['name'] or str(item['identifier']))}" for item in items[:_FAILED_USERS_PREVIEW]]
+        final_text += f"\n\n*{title}:*\n" + "\n".join(names)
+        if len(items) > _FAILED_USERS_PREVIEW:
+            final_text += f"\n\\.\\.\\. و *{len(items) - _FAILED_USERS_PREVIEW}* کاربر دیگر"
     # --- اصلاح: بازگشت به منوی دستورات گروهی ---
     _safe_edit(uid, msg_id, final_text, reply_markup=menu.admin_group_actions_menu())
 
@@ -157,9 +172,8 @@ def handle_select_action_type(call, params):
     plan_index = int(params[0])
     uid, msg_id = call.from_user.id, call.message.message_id
     
-    all_plans = load_service_plans()
-    selected_plan = all_plans[plan_index]
-    plan_name_escaped = escape_markdown(selected_plan.get('name', ''))
+    selected_plan = get_plan_catalog().plans[plan_index]
+    plan_name_escaped = escape_markdown(selected_plan.name or '')
 
     prompt = f"شما پلن *{plan_name_escaped}* را انتخاب کردید\\.\n\nلطفاً نوع دستور مورد نظر را انتخاب کنید:"
     _safe_edit(uid, msg_id, prompt, reply_markup=menu.admin_select_action_type_menu(plan_index, 'plan'))
@@ -1,13 +1,16 @@
 import logging
+import threading
+import time
 from datetime import datetime, timedelta
 import pytz
 import jdatetime
 from telebot import types
 from .. import combined_handler
 from ..database import db
-from ..utils import to_shamsi, _safe_edit, escape_markdown, to_shamsi, escape_markdown, load_service_plans, parse_volume_string
+from ..utils import to_shamsi, _safe_edit, escape_markdown, to_shamsi, escape_markdown
+from ..catalog import get_plan_catalog
 from ..menu import menu
-from ..config import PAGE_SIZE, WELCOME_MESSAGE_DELAY_HOURS
+from ..config import PAGE_SIZE, WELCOME_MESSAGE_DELAY_HOURS, LIST_VIEW_CACHE_TTL
 from ..admin_formatters import (
     fmt_users_list, fmt_panel_users_list, fmt_online_users_list,
     fmt_bot_users_list, fmt_birthdays_list,
@@ -16,13 +19,17 @@ from ..admin_formatters import (
     fmt_financial_report, fmt_monthly_transactions_report
 )
 from ..user_formatters import fmt_user_report, fmt_user_weekly_report
-from ..hiddify_api_handler import HiddifyAPIHandler
-from ..marzban_api_handler import MarzbanAPIHandler
 from webapp.services import get_schedule_info_service
 
 logger = logging.getLogger(__name__)
 bot = None
 
+# لیست‌های گزارش که از اسنپ‌شات ترکیبی پنل‌ها ساخته می‌شوند و بین صفحات کش می‌شوند
+_PANEL_LIST_TYPES = {"panel_users", "online_users", "active_users", "inactive_users", "never_connected", "top_consumers"}
+# کش لیست‌ها و آمار داشبورد: {(نوع لیست, نوع پنل یا پلن): (زمان ساخت, داده)}
+_list_view_cache = {}
+_list_view_lock = threading.Lock()
+
 def initialize_reporting_handlers(b):
     global bot
     bot = b
@@ -48,7 +55,7 @@ def handle_health_check(call, params):
             _safe_edit(uid, msg_id, escape_markdown("❌ هیچ پنل Hiddify فعالی یافت نشد."), reply_markup=back_to_status_menu)
             return
 
-        handler = HiddifyAPIHandler(active_hiddify_panel)
+        handler = combined_handler._get_handler_for_panel(active_hiddify_panel)
         info = handler.get_panel_info()
         
         if info:
@@ -76,7 +83,7 @@ def handle_marzban_system_stats(call, params):
             _safe_edit(uid, msg_id, escape_markdown("❌ هیچ پنل Marzban فعالی یافت نشد."), reply_markup=back_to_status_menu)
             return
 
-        handler = MarzbanAPIHandler(active_marzban_panel)
+        handler = combined_handler._get_handler_for_panel(active_marzban_panel)
         info = handler.get_system_stats()
         
         if info:
@@ -90,31 +97,59 @@ def handle_marzban_system_stats(call, params):
         logger.error(f"Error in handle_marzban_system_stats: {e}", exc_info=True)
         _safe_edit(uid, msg_id, escape_markdown("خطایی در هنگام دریافت آمار رخ داد."), reply_markup=back_to_status_menu)
 
-def handle_paginated_list(call, params):
+def _get_list_view(key: tuple, build, refresh: bool = False):
     """
-    (نسخه نهایی و کامل) گزارش‌های صفحه‌بندی شده را برای ادمین مدیریت می‌کند.
-    این نسخه شامل صفحه‌بندی برای تمام لیست‌ها و اصلاح منطق کاربران آنلاین است.
+    لیست فیلتر و مرتب‌شده (یا آمار) یک گزارش را از کش برمی‌گرداند یا با build(fresh) می‌سازد.
+    ورق زدن صفحات یک لیست، فیلتر، مرتب‌سازی و درخواست به پنل‌ها را تکرار نمی‌کند؛
+    دکمه بروزرسانی (refresh) کش همان لیست و اسنپ‌شات ترکیبی را نادیده می‌گیرد.
     """
-    from ..admin_formatters import fmt_top_consumers
-    list_type, page = params[0], int(params[-1])
-    panel_type = params[1] if len(params) > 2 else None
-    _safe_edit(call.from_user.id, call.message.message_id, escape_markdown("⏳ در حال دریافت و پردازش اطلاعات..."), reply_markup=None)
+    now = time.monotonic()
+    with _list_view_lock:
+        entry = _list_view_cache.get(key)
+        if entry and not refresh and now - entry[0] <= LIST_VIEW_CACHE_TTL:
+            return entry[1]
+
+    rows = build(refresh)
+    with _list_view_lock:
+        now = time.monotonic()
+        for stale_key in [k for k, (built_at, _) in _list_view_cache.items() if now - built_at > LIST_VIEW_CACHE_TTL]:
+            del _list_view_cache[stale_key]
+        _list_view_cache[key] = (now, rows)
+    return rows
+
+
+def _refresh_callback(base_cb: str) -> str:
+    """callback دکمه بروزرسانی برای یک لیست صفحه‌بندی شده (همیشه به صفحه اول برمی‌گردد)."""
+    return f"admin:refresh_list:{base_cb[len('admin:'):]}:0"
+
+
+def handle_refresh_list_view(call, params):
+    """دکمه بروزرسانی لیست‌ها: لیست بدون استفاده از کش از نو ساخته و صفحه اول آن نمایش داده می‌شود."""
+    handlers = {
+        "list": handle_paginated_list,
+        "list_by_plan": handle_list_users_by_plan,
+        "list_no_plan": handle_list_users_no_plan,
+    }
+    handler = handlers.get(params[0]) if params else None
+    if handler:
+        handler(call, params[1:], refresh=True)
 
-    all_users_combined = combined_handler.get_all_users_combined()
-    
-    users_to_process = []
+
+def _build_panel_user_list(list_type: str, panel_type: str, fresh: bool = False) -> list:
+    """لیست‌هایی که از اسنپ‌شات ترکیبی پنل‌ها ساخته می‌شوند را فیلتر و مرتب می‌کند."""
+    all_users_combined = combined_handler.get_all_users_combined(fresh=fresh)
     now_utc = datetime.now(pytz.utc)
-    users = []
 
     if list_type == "online_users":
         deadline = now_utc - timedelta(minutes=3)
         online_users_hiddify, online_users_marzban = [], []
         
         online_users_raw = [u for u in all_users_combined if u.get('is_active') and u.get('last_online') and isinstance(u.get('last_online'), datetime) and u['last_online'].astimezone(pytz.utc) >= deadline]
+        daily_usage_map = db.get_all_daily_usage_since_midnight() if online_users_raw else {}
 
         for user in online_users_raw:
             if user.get('uuid'):
-                user['daily_usage_GB'] = sum(db.get_usage_since_midnight_by_uuid(user['uuid']).values())
+                user['daily_usage_GB'] = sum(daily_usage_map.get(user['uuid'], {}).values())
 
             breakdown = user.get('breakdown', {})
             h_online = next((p['data'].get('last_online') for p in breakdown.values() if p.get('type') == 'hiddify'), None)
@@ -125,45 +160,61 @@ def handle_paginated_list(call, params):
             elif m_online:
                 online_users_marzban.append(user)
         
-        users = online_users_hiddify if panel_type == 'hiddify' else online_users_marzban
+        return online_users_hiddify if panel_type == 'hiddify' else online_users_marzban
+
+    users_to_process = []
+    if panel_type:
+        all_panels_map = {p['name']: p['panel_type'] for p in db.get_all_panels()}
+        for user in all_users_combined:
+            for panel_name in user.get('breakdown', {}).keys():
+                if all_panels_map.get(panel_name) == panel_type:
+                    users_to_process.append(user)
+                    break 
+    else:
+        users_to_process = all_users_combined
+
+    if list_type == "panel_users": 
+        return users_to_process
+    elif list_type == "active_users":
+        deadline = now_utc - timedelta(days=1)
+        return [u for u in users_to_process if u.get('last_online') and isinstance(u.get('last_online'), datetime) and u['last_online'].astimezone(pytz.utc) >= deadline]
+    elif list_type == "inactive_users":
+        return [u for u in users_to_process if u.get('last_online') and isinstance(u.get('last_online'), datetime) and 1 <= (now_utc - u['last_online'].astimezone(pytz.utc)).days < 7]
+    elif list_type == "never_connected": 
+        return [u for u in users_to_process if not u.get('last_online')]
+    elif list_type == "top_consumers":
+        sorted_users = sorted(users_to_process, key=lambda u: u.get('current_usage_GB', 0), reverse=True)
+        return sorted_users[:100]
+    return []
+
+
+def handle_paginated_list(call, params, refresh: bool = False):
+    """
+    (نسخه نهایی و کامل) گزارش‌های صفحه‌بندی شده را برای ادمین مدیریت می‌کند.
+    این نسخه شامل صفحه‌بندی برای تمام لیست‌ها و اصلاح منطق کاربران آنلاین است.
+    لیست‌های مبتنی بر پنل‌ها بین صفحات کش می‌شوند و دکمه بروزرسانی دارند.
+    """
+    from ..admin_formatters import fmt_top_consumers
+    list_type, page = params[0], int(params[-1])
+    panel_type = params[1] if len(params) > 2 else None
+    _safe_edit(call.from_user.id, call.message.message_id, escape_markdown("⏳ در حال دریافت و پردازش اطلاعات..."), reply_markup=None)
+
+    users = []
 
+    if list_type in _PANEL_LIST_TYPES:
+        users = _get_list_view((list_type, panel_type), lambda fresh: _build_panel_user_list(list_type, panel_type, fresh), refresh)
     elif list_type == "leaderboard":
         users = db.get_all_users_by_points()
-
     elif list_type == "feedback":
         return show_feedback_list(call, page)
-
-    else:
-        if panel_type:
-            all_panels_map = {p['name']: p['panel_type'] for p in db.get_all_panels()}
-            for user in all_users_combined:
-                for panel_name in user.get('breakdown', {}).keys():
-                    if all_panels_map.get(panel_name) == panel_type:
-                        users_to_process.append(user)
-                        break 
-        else:
-            users_to_process = all_users_combined
-
-        if list_type == "panel_users": 
-            users = users_to_process
-        elif list_type == "active_users":
-            deadline = now_utc - timedelta(days=1)
-            users = [u for u in users_to_process if u.get('last_online') and isinstance(u.get('last_online'), datetime) and u['last_online'].astimezone(pytz.utc) >= deadline]
-        elif list_type == "inactive_users":
-            users = [u for u in users_to_process if u.get('last_online') and isinstance(u.get('last_online'), datetime) and 1 <= (now_utc - u['last_online'].astimezone(pytz.utc)).days < 7]
-        elif list_type == "never_connected": 
-            users = [u for u in users_to_process if not u.get('last_online')]
-        elif list_type == "top_consumers":
-            sorted_users = sorted(users_to_process, key=lambda u: u.get('current_usage_GB', 0), reverse=True)
-            users = sorted_users[:100]
-        elif list_type == "bot_users": 
-            users = db.get_all_bot_users()
-        elif list_type == "balances":
-            users = db.get_all_users_with_balance()
-        elif list_type == "birthdays": 
-            users = list(db.get_users_with_birthdays())
-        elif list_type == "payments":
-            users = list(db.get_all_payments_with_user_info())
+    elif list_type == "bot_users": 
+        users = db.get_all_bot_users()
+    elif list_type == "balances":
+        users = db.get_all_users_with_balance()
+    elif list_type == "birthdays": 
+        users = list(db.get_users_with_birthdays())
+    elif list_type == "payments":
+        users = list(db.get_all_payments_with_user_info())
 
     list_configs = {
         "panel_users": {"format": lambda u, pg, p_type: fmt_panel_users_list(u, "Hiddify" if p_type == "hiddify" else "Marzban", pg), "back": "panel_reports"},
@@ -196,7 +247,8 @@ def handle_paginated_list(call, params):
     else:
         back_cb = f"admin:{config['back']}"
 
-    kb = menu.create_pagination_menu(base_cb, page, len(users), back_cb)
+    refresh_cb = _refresh_callback(base_cb) if list_type in _PANEL_LIST_TYPES else None
+    kb = menu.create_pagination_menu(base_cb, page, len(users), back_cb, refresh_callback=refresh_cb)
     _safe_edit(call.from_user.id, call.message.message_id, text, reply_markup=kb)
 
 
@@ -224,7 +276,14 @@ def _find_users_matching_plan_specs(all_users, plan_specs_set, invert_match=Fals
             filtered_users.append(user)
     return filtered_users
 
-def handle_list_users_by_plan(call, params):
+def _panel_volumes(user: dict) -> tuple:
+    """حجم (آلمان، فرانسه) یک کاربر بر اساس پنل‌های Hiddify و Marzban؛ -1 یعنی کاربر در آن پنل نیست."""
+    h_info = next((p.get('data', {}) for p in user.get('breakdown', {}).values() if p.get('type') == 'hiddify'), {})
+    m_info = next((p.get('data', {}) for p in user.get('breakdown', {}).values() if p.get('type') == 'marzban'), {})
+    return h_info.get('usage_limit_GB', -1.0), m_info.get('usage_limit_GB', -1.0)
+
+
+def handle_list_users_by_plan(call, params, refresh: bool = False):
     """
     Finds and lists users whose service specifications match a selected plan.
     """
@@ -235,43 +294,35 @@ def handle_list_users_by_plan(call, params):
     _safe_edit(uid, msg_id, escape_markdown("⏳ در حال یافتن کاربران منطبق با پلن..."))
 
     try:
-        all_plans = load_service_plans()
-        if not (0 <= plan_index < len(all_plans)):
+        plan_catalog = get_plan_catalog()
+        if not (0 <= plan_index < len(plan_catalog)):
             bot.answer_callback_query(call.id, "❌ پلن نامعتبر است.", show_alert=True)
             return
 
-        selected_plan = all_plans[plan_index]
-        plan_name = selected_plan.get('name', 'N/A')
+        selected_plan = plan_catalog.plans[plan_index]
+        plan_name = selected_plan.name or 'N/A'
         
-        plan_vol_de = float(parse_volume_string(selected_plan.get('volume_de', '0')))
-        plan_vol_fr = float(parse_volume_string(selected_plan.get('volume_fr', '0')))
-
-        all_users = combined_handler.get_all_users_combined()
-        matching_users = []
+        plan_vol_de, plan_vol_fr = selected_plan.panel_volumes
 
-        for user in all_users:
-            h_info = next((p.get('data', {}) for p in user.get('breakdown', {}).values() if p.get('type') == 'hiddify'), {})
-            m_info = next((p.get('data', {}) for p in user.get('breakdown', {}).values() if p.get('type') == 'marzban'), {})
-            
-            user_vol_de = h_info.get('usage_limit_GB', -1.0)
-            user_vol_fr = m_info.get('usage_limit_GB', -1.0)
-            
-            if user_vol_de == plan_vol_de and user_vol_fr == plan_vol_fr:
-                matching_users.append(user)
+        matching_users = _get_list_view(
+            ("list_by_plan", (plan_vol_de, plan_vol_fr)),
+            lambda fresh: [u for u in combined_handler.get_all_users_combined(fresh=fresh) if _panel_volumes(u) == (plan_vol_de, plan_vol_fr)],
+            refresh
+        )
         
         text = fmt_users_by_plan_list(matching_users, plan_name, page)
         
         base_cb = f"admin:list_by_plan:{plan_index}"
         back_cb = "admin:user_analysis_menu"
         
-        kb = menu.create_pagination_menu(base_cb, page, len(matching_users), back_cb)
+        kb = menu.create_pagination_menu(base_cb, page, len(matching_users), back_cb, refresh_callback=_refresh_callback(base_cb))
         _safe_edit(uid, msg_id, text, reply_markup=kb)
 
     except Exception as e:
         logger.error(f"Error in handle_list_users_by_plan: {e}", exc_info=True)
         _safe_edit(uid, msg_id, escape_markdown("❌ خطایی در پردازش گزارش رخ داد."), reply_markup=menu.admin_reports_menu())
 
-def handle_list_users_no_plan(call, params):
+def handle_list_users_no_plan(call, params, refresh: bool = False):
     """
     Finds and lists users whose service specifications do not match any defined plan.
     """
@@ -281,32 +332,20 @@ def handle_list_users_no_plan(call, params):
     _safe_edit(uid, msg_id, escape_markdown("⏳ در حال یافتن کاربران بدون پلن..."))
 
     try:
-        all_plans = load_service_plans()
-        plan_specs_set = set()
-        for plan in all_plans:
-            vol_de = float(parse_volume_string(plan.get('volume_de', '0')))
-            vol_fr = float(parse_volume_string(plan.get('volume_fr', '0')))
-            plan_specs_set.add((vol_de, vol_fr))
-
-        all_users = combined_handler.get_all_users_combined()
-        no_plan_users = []
-
-        for user in all_users:
-            h_info = next((p.get('data', {}) for p in user.get('breakdown', {}).values() if p.get('type') == 'hiddify'), {})
-            m_info = next((p.get('data', {}) for p in user.get('breakdown', {}).values() if p.get('type') == 'marzban'), {})
-
-            user_vol_de = h_info.get('usage_limit_GB', -1.0)
-            user_vol_fr = m_info.get('usage_limit_GB', -1.0)
-            
-            if (user_vol_de, user_vol_fr) not in plan_specs_set:
-                no_plan_users.append(user)
+        plan_specs_set = set(get_plan_catalog().by_panel_volumes)
+
+        no_plan_users = _get_list_view(
+            ("list_no_plan", frozenset(plan_specs_set)),
+            lambda fresh: [u for u in combined_handler.get_all_users_combined(fresh=fresh) if _panel_volumes(u) not in plan_specs_set],
+            refresh
+        )
 
         text = fmt_users_by_plan_list(no_plan_users, "کاربران بدون پلن", page)
         
         base_cb = "admin:list_no_plan"
         back_cb = "admin:user_analysis_menu"
         
-        kb = menu.create_pagination_menu(base_cb, page, len(no_plan_users), back_cb)
+        kb = menu.create_pagination_menu(base_cb, page, len(no_plan_users), back_cb, refresh_callback=_refresh_callback(base_cb))
         _safe_edit(uid, msg_id, text, reply_markup=kb)
 
     except Exception as e:
@@ -314,45 +353,50 @@ def handle_list_users_no_plan(call, params):
         _safe_edit(uid, msg_id, escape_markdown("❌ خطایی در پردازش گزارش رخ داد."), reply_markup=menu.admin_reports_menu())
 
 
+def _build_quick_dashboard_stats(fresh: bool = False) -> dict:
+    all_users_data = combined_handler.get_all_users_combined(fresh=fresh)
+    daily_usage_map = db.get_all_daily_usage_since_midnight()
+    created_at_map = {row['uuid']: row['created_at'] for row in db.all_active_uuids()}
+    
+    stats = {
+        "total_users": len(all_users_data), "active_users": 0, "online_users": 0,
+        "expiring_soon_count": 0, "total_usage_today_gb": 0, "new_users_last_24h_count": 0
+    }
+    now_utc = datetime.now(pytz.utc)
+    
+    for user in all_users_data:
+        if user.get('uuid'):
+            stats['total_usage_today_gb'] += sum(daily_usage_map.get(user['uuid'], {}).values())
+            
+            created_at_dt = created_at_map.get(user['uuid'])
+            if created_at_dt and (now_utc - created_at_dt.astimezone(pytz.utc)).days < 1:
+                stats['new_users_last_24h_count'] += 1
+
+        if user.get('is_active'):
+            stats['active_users'] += 1
+        
+        last_online = user.get('last_online')
+        if last_online and isinstance(last_online, datetime) and (now_utc - last_online.astimezone(pytz.utc)).total_seconds() < 180:
+            stats['online_users'] += 1
+
+        expire_days = user.get('expire')
+        if expire_days is not None and 0 <= expire_days <= 7:
+            stats['expiring_soon_count'] += 1
+    
+    stats['total_usage_today'] = f"{stats['total_usage_today_gb']:.2f} GB"
+    return stats
+
+
 def handle_quick_dashboard(call, params):
     uid, msg_id = call.from_user.id, call.message.message_id
+    refresh = bool(params) and params[0] == "refresh"
     _safe_edit(uid, msg_id, escape_markdown("⏳ در حال محاسبه آمار داشبورد..."))
 
     try:
-        all_users_data = combined_handler.get_all_users_combined()
-        
-        stats = {
-            "total_users": len(all_users_data), "active_users": 0, "online_users": 0,
-            "expiring_soon_count": 0, "total_usage_today_gb": 0, "new_users_last_24h_count": 0
-        }
-        now_utc = datetime.now(pytz.utc)
-        
-        for user in all_users_data:
-            if user.get('uuid'):
-                daily_usage = db.get_usage_since_midnight_by_uuid(user['uuid'])
-                stats['total_usage_today_gb'] += sum(daily_usage.values())
-                
-                db_user = db.get_user_uuid_record(user['uuid'])
-                if db_user and db_user.get('created_at'):
-                    created_at_dt = db_user['created_at']
-                    if (now_utc - created_at_dt.astimezone(pytz.utc)).days < 1:
-                        stats['new_users_last_24h_count'] += 1
-
-            if user.get('is_active'):
-                stats['active_users'] += 1
-            
-            last_online = user.get('last_online')
-            if last_online and isinstance(last_online, datetime) and (now_utc - last_online.astimezone(pytz.utc)).total_seconds() < 180:
-                stats['online_users'] += 1
-
-            expire_days = user.get('expire')
-            if expire_days is not None and 0 <= expire_days <= 7:
-                stats['expiring_soon_count'] += 1
-        
-        stats['total_usage_today'] = f"{stats['total_usage_today_gb']:.2f} GB"
+        stats = _get_list_view(("quick_dashboard", None), _build_quick_dashboard_stats, refresh)
         
         text = fmt_admin_quick_dashboard(stats)
-        kb = types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("🔄 بروزرسانی", callback_data="admin:quick_dashboard"), types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin:panel"))
+        kb = types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("🔄 بروزرسانی", callback_data="admin:quick_dashboard:refresh"), types.InlineKeyboardButton("🔙 بازگشت", callback_data="admin:panel"))
         _safe_edit(uid, msg_id, text, reply_markup=kb)
 
     except Exception as e:
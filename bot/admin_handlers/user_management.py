@@ -147,6 +147,7 @@ def handle_ask_edit_value(call, params):
     bot.register_next_step_handler_by_chat_id(uid, apply_user_edit)
 
 
+@combined_handler.scoped_lookups
 def apply_user_edit(msg: types.Message):
     """
     مقدار وارد شده توسط ادمین را دریافت کرده و با API پنل، کاربر را ویرایش می‌کند.
@@ -258,6 +259,8 @@ def handle_toggle_status_action(call, params):
                 marzban_status = 'active' if new_status else 'disabled'
                 if not handler.modify_user(panel_data['username'], data={'status': marzban_status}):
                     success = False
+
+    combined_handler.invalidate_combined_users_cache()
     
     if success:
         bot.answer_callback_query(call.id, "✅ وضعیت با موفقیت تغییر کرد.")
@@ -334,6 +337,8 @@ def handle_reset_usage_action(call, params):
     if panel_to_reset in ['marzban', 'both'] and 'marzban' in info.get('breakdown', {}):
         m_success = combined_handler.marzban_handler.reset_user_usage(info['name'])
 
+    combined_handler.invalidate_combined_users_cache()
+
     if h_success and m_success:
         if uuid_id_in_db:
             db.delete_user_snapshots(uuid_id_in_db)
@@ -401,6 +406,7 @@ def handle_global_search_convo(call, params):
     bot.register_next_step_handler_by_chat_id(uid, _handle_global_search_response)
 
 
+@combined_handler.scoped_lookups
 def _handle_global_search_response(message: types.Message):
     """
     Handles the admin's response to the global search prompt.
@@ -645,6 +651,7 @@ def handle_search_by_telegram_id_convo(call, params):
     bot.register_next_step_handler_by_chat_id(uid, _find_user_by_telegram_id)
 
 
+@combined_handler.scoped_lookups
 def _find_user_by_telegram_id(message: types.Message):
     """
     کاربر را بر اساس شناسه تلگرام جستجو کرده و در صورت یافتن، اطلاعات او را نمایش می‌دهد.
@@ -909,7 +916,7 @@ def handle_reset_all_daily_usage_action(call, params):
 
     try:
         # این بخش، همان پروسه نیمه‌شب را به صورت دستی اجرا می‌کند
-        all_users_info = combined_handler.get_all_users_combined()
+        all_users_info = combined_handler.get_all_users_combined(fresh=True)
         user_info_map = {user['uuid']: user for user in all_users_info if user.get('uuid')}
         # این تابع در دیتابیس شما به درستی از user_uuids استفاده می‌کند
         all_uuids_from_db = list(db.all_active_uuids())
@@ -946,7 +953,7 @@ def handle_force_snapshot(call, params):
     _safe_edit(uid, msg_id, escape_markdown("⏳ در حال دریافت اطلاعات از پنل‌ها و به‌روزرسانی آمار مصرف... لطفاً چند لحظه صبر کنید."), reply_markup=None)
 
     try:
-        all_users_info = combined_handler.get_all_users_combined()
+        all_users_info = combined_handler.get_all_users_combined(fresh=True)
         if not all_users_info:
             bot.answer_callback_query(call.id, "هیچ کاربری در پنل‌ها یافت نشد.", show_alert=True)
             _safe_edit(uid, msg_id, escape_markdown("هیچ کاربری برای به‌روزرسانی یافت نشد."), reply_markup=menu.admin_system_tools_menu())
@@ -955,7 +962,7 @@ def handle_force_snapshot(call, params):
         user_info_map = {user['uuid']: user for user in all_users_info if user.get('uuid')}
         all_uuids_from_db = list(db.all_active_uuids())
         
-        updated_count = 0
+        snapshot_rows = []
         for u_row in all_uuids_from_db:
             try:
                 uuid_str = u_row['uuid']
@@ -972,11 +979,13 @@ def handle_force_snapshot(call, params):
                         elif panel_type == 'marzban':
                             m_usage += panel_data.get('current_usage_GB', 0.0)
                     
-                    db.add_usage_snapshot(u_row['id'], h_usage, m_usage)
-                    updated_count += 1
+                    snapshot_rows.append((u_row['id'], h_usage, m_usage))
             except Exception as e:
                 logger.error(f"ADMIN_FORCE_SNAPSHOT: Failed to process for uuid_id {u_row['id']}: {e}")
 
+        db.add_usage_snapshots_bulk(snapshot_rows)
+        updated_count = len(snapshot_rows)
+
         success_msg = f"✅ عملیات با موفقیت انجام شد.\n\nآمار مصرف برای {updated_count} کاربر فعال به‌روزرسانی گردید."
         bot.answer_callback_query(call.id, "✅ آمار با موفقیت به‌روز شد.", show_alert=True)
         _safe_edit(uid, msg_id, escape_markdown(success_msg), reply_markup=menu.admin_system_tools_menu())
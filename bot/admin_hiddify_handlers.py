@@ -7,7 +7,7 @@ import pytz
 
 # --- START: MODIFIED IMPORTS ---
 from .menu import menu
-from .hiddify_api_handler import HiddifyAPIHandler # Import the Class, not the instance
+from . import combined_handler
 from .database import db # Import db to get panel configs
 from .utils import _safe_edit, escape_markdown
 from .admin_formatters import fmt_admin_user_summary
@@ -110,10 +110,12 @@ def _finish_user_creation(uid, user_data):
     _safe_edit(uid, msg_id, f"⏳ در حال ساخت کاربر در پنل: {escape_markdown(target_panel_config['name'])}...")
 
     # ۲. ساخت یک handler مخصوص برای این پنل
-    handler = HiddifyAPIHandler(target_panel_config)
+    handler = combined_handler._get_handler_for_panel(target_panel_config)
     
     # ۳. استفاده از handler جدید برای افزودن کاربر
     new_user_info = handler.add_user(user_data)
+    if new_user_info:
+        combined_handler.invalidate_combined_users_cache()
     # --- END: NEW DYNAMIC LOGIC ---
     
     admin_conversations.pop(uid, None)
@@ -6,7 +6,7 @@ from datetime import datetime
 
 # --- START: MODIFIED IMPORTS ---
 from .menu import menu
-from .marzban_api_handler import MarzbanAPIHandler # Import the Class
+from . import combined_handler
 from .database import db # Import db
 from .utils import _safe_edit, escape_markdown
 from .admin_formatters import fmt_admin_user_summary
@@ -103,8 +103,10 @@ def _finish_marzban_user_creation(uid, user_data):
     target_panel_config = active_marzban_panels[0]
     _safe_edit(uid, msg_id, f"⏳ در حال ساخت کاربر در پنل: {escape_markdown(target_panel_config['name'])}...")
 
-    handler = MarzbanAPIHandler(target_panel_config)
+    handler = combined_handler._get_handler_for_panel(target_panel_config)
     new_user_info = handler.add_user(user_data)
+    if new_user_info:
+        combined_handler.invalidate_combined_users_cache()
     # --- END: NEW DYNAMIC LOGIC ---
 
     admin_conversations.pop(uid, None)
@@ -288,6 +288,7 @@ ADMIN_CALLBACK_HANDLERS = {
     "health_check": reporting.handle_health_check,
     "marzban_stats": reporting.handle_marzban_system_stats,
     "list": reporting.handle_paginated_list,
+    "refresh_list": reporting.handle_refresh_list_view,
     "financial_report": reporting.handle_financial_report,
     "financial_details": reporting.handle_financial_details,
     "confirm_delete_trans": reporting.handle_confirm_delete_transaction,
@@ -0,0 +1,217 @@
+# bot/broadcast_engine.py
+"""
+موتور ارسال پیام همگانی در پس‌زمینه.
+گیرندگان و وضعیتشان در جدول broadcast_recipients ذخیره می‌شوند؛ هر پیام همگانی در یک ترد جداگانه
+و با چند ترد ارسال‌کننده پیش می‌رود و پس از ری‌استارت ربات از همان نقطه ادامه می‌یابد.
+گزارش‌های زمان‌بندی‌شده هم از طریق send_paced با همین محدودکننده نرخ ارسال می‌شوند.
+"""
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple
+
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+
+from .config import (BROADCAST_GLOBAL_RATE, BROADCAST_WORKERS, BROADCAST_BATCH_SIZE,
+                     BROADCAST_PROGRESS_INTERVAL, BROADCAST_MAX_ATTEMPTS)
+from .database import db
+from .utils import _safe_edit, create_progress_bar
+
+logger = logging.getLogger(__name__)
+
+# خطاهایی که با تلاش مجدد برطرف نمی‌شوند (کاربر ربات را بلاک کرده، حساب حذف شده و ...)
+_PERMANENT_ERROR_CODES = {400, 403}
+
+
+class TokenBucket:
+    """
+    محدودکننده نرخ سراسری ارسال. هر ترد پیش از هر درخواست یک توکن برمی‌دارد.
+    با دریافت خطای flood control کل سطل برای مدت retry_after متوقف می‌شود.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+# سقف تلگرام برای کل ربات است، پس تمام پیام‌های همگانی در حال اجرا یک سطل مشترک دارند.
+# هر گیرنده فقط یک پیام می‌گیرد و پیام پیشرفت ادمین هر BROADCAST_PROGRESS_INTERVAL ثانیه ویرایش می‌شود،
+# بنابراین سقف یک پیام در ثانیه برای هر چت هم رعایت می‌شود.
+_bucket = TokenBucket(BROADCAST_GLOBAL_RATE)
+_active_broadcasts = set()
+_active_lock = threading.Lock()
+
+
+def _retry_after(e: ApiTelegramException) -> Optional[int]:
+    if e.error_code != 429:
+        return None
+    try:
+        return int(e.result_json['parameters']['retry_after'])
+    except (KeyError, TypeError, ValueError):
+        match = re.search(r'retry after (\d+)', str(e.description), re.IGNORECASE)
+        return int(match.group(1)) if match else 5
+
+
+def _send_with_retries(send, label: str) -> Tuple[Any, Optional[Exception]]:
+    """
+    یک درخواست ارسال را با رعایت سطل سراسری و تلاش مجدد اجرا می‌کند و (نتیجه، خطا) را برمی‌گرداند.
+    با خطای flood control همه ارسال‌کننده‌ها متوقف می‌شوند و خطاهای دائمی دوباره تلاش نمی‌شوند.
+    """
+    error = None
+    for attempt in range(1, BROADCAST_MAX_ATTEMPTS + 1):
+        _bucket.acquire()
+        try:
+            return send(), None
+        except ApiTelegramException as e:
+            error = e
+            retry_after = _retry_after(e)
+            if retry_after is not None:
+                logger.warning(f"{label}: Flood control hit, pausing all senders for {retry_after}s.")
+                _bucket.pause(retry_after + 1)
+                continue
+            if e.error_code in _PERMANENT_ERROR_CODES:
+                return None, e
+        except Exception as e:
+            error = e
+        time.sleep(attempt)
+    return None, error
+
+
+def _error_text(error: Exception) -> str:
+    return str(getattr(error, 'description', None) or error)[:200]
+
+
+def _deliver(bot, broadcast: dict, user_id: int) -> Tuple[int, str, Optional[str]]:
+    """پیام را برای یک گیرنده کپی می‌کند و (user_id, status, error) را برمی‌گرداند."""
+    _, error = _send_with_retries(
+        lambda: bot.copy_message(chat_id=user_id, from_chat_id=broadcast['admin_id'], message_id=broadcast['source_message_id']),
+        f"BROADCAST #{broadcast['id']}"
+    )
+    if error is not None:
+        return user_id, 'failed', _error_text(error)
+    return user_id, 'sent', None
+
+
+def send_paced(bot, messages: List[Tuple[int, str]], label: str = "REPORT",
+               parse_mode: str = "MarkdownV2") -> List[Tuple[int, Optional[types.Message], Optional[Exception]]]:
+    """
+    پیام‌های از پیش ساخته‌شده (chat_id, text) را با چند ترد و زیر همان سقف نرخ سراسری پیام همگانی ارسال می‌کند.
+    خروجی به ترتیب ورودی: (chat_id, پیام ارسال شده یا None, خطا یا None).
+    """
+    def _send(item):
+        chat_id, text = item
+        sent_message, error = _send_with_retries(lambda: bot.send_message(chat_id, text, parse_mode=parse_mode), label)
+        return chat_id, sent_message, error
+
+    with ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix=label.lower()) as pool:
+        return list(pool.map(_send, messages))
+
+
+def _progress_text(stats: dict) -> str:
+    done = stats['sent'] + stats['failed']
+    percent = (done / stats['total'] * 100) if stats['total'] else 100
+    return (
+        f"⏳ *در حال ارسال پیام همگانی\\.\\.\\.*\n\n"
+        f"{create_progress_bar(percent)}\n"
+        f"🔹 *موفق :* {stats['sent']}\n"
+        f"🔸 *ناموفق :* {stats['failed']}\n"
+        f"⏱ *باقی‌مانده :* {stats['pending']}"
+    )
+
+
+def _finish(bot, broadcast: dict) -> None:
+    stats = db.get_broadcast_stats(broadcast['id'])
+    db.finish_broadcast(broadcast['id'])
+
+    try: bot.delete_message(chat_id=broadcast['admin_id'], message_id=broadcast['source_message_id'])
+    except Exception as e: logger.warning(f"Could not delete broadcast source message for admin {broadcast['admin_id']}: {e}")
+
+    back_to_broadcast_menu = types.InlineKeyboardMarkup()
+    back_to_broadcast_menu.add(types.InlineKeyboardButton("🔙 بازگشت به پیام همگانی", callback_data="admin:broadcast"))
+    final_report_text = (
+        f"✅ *ارسال همگانی به پایان رسید\\.*\n\n"
+        f"🔹 *موفقیت‌آمیز :* {stats['sent']}\n"
+        f"🔸 *ناموفق :* {stats['failed']}"
+    )
+    if broadcast.get('progress_message_id'):
+        _safe_edit(broadcast['admin_id'], broadcast['progress_message_id'], final_report_text, reply_markup=back_to_broadcast_menu)
+    else:
+        bot.send_message(broadcast['admin_id'], final_report_text, parse_mode='MarkdownV2', reply_markup=back_to_broadcast_menu)
+    logger.info(f"BROADCAST #{broadcast['id']}: Finished. sent={stats['sent']}, failed={stats['failed']}")
+
+
+def _run_broadcast(bot, broadcast_id: int) -> None:
+    try:
+        broadcast = db.get_broadcast(broadcast_id)
+        if not broadcast or broadcast['status'] != 'running':
+            return
+        logger.info(f"BROADCAST #{broadcast_id}: Sending started.")
+        last_progress = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix=f"broadcast-{broadcast_id}") as pool:
+            while True:
+                pending = db.get_pending_broadcast_recipients(broadcast_id, BROADCAST_BATCH_SIZE)
+                if not pending:
+                    break
+                results = list(pool.map(lambda uid: _deliver(bot, broadcast, uid), pending))
+                # وضعیت هر دسته یکجا ذخیره می‌شود؛ در صورت کرش حداکثر یک دسته دوباره ارسال خواهد شد
+                db.update_broadcast_recipients(broadcast_id, results)
+
+                if broadcast.get('progress_message_id') and time.monotonic() - last_progress >= BROADCAST_PROGRESS_INTERVAL:
+                    last_progress = time.monotonic()
+                    _bucket.acquire()
+                    _safe_edit(broadcast['admin_id'], broadcast['progress_message_id'],
+                               _progress_text(db.get_broadcast_stats(broadcast_id)), reply_markup=None)
+
+        _finish(bot, broadcast)
+    except Exception as e:
+        logger.error(f"BROADCAST #{broadcast_id}: Engine stopped unexpectedly: {e}", exc_info=True)
+    finally:
+        with _active_lock:
+            _active_broadcasts.discard(broadcast_id)
+
+
+def start_broadcast(bot, broadcast_id: int) -> bool:
+    """ارسال یک پیام همگانی ثبت‌شده را در پس‌زمینه آغاز می‌کند (اگر از قبل در حال اجرا نباشد)."""
+    with _active_lock:
+        if broadcast_id in _active_broadcasts:
+            return False
+        _active_broadcasts.add(broadcast_id)
+    threading.Thread(target=_run_broadcast, args=(bot, broadcast_id), name=f"broadcast-{broadcast_id}", daemon=True).start()
+    return True
+
+
+def resume_broadcasts(bot) -> int:
+    """پیام‌های همگانی نیمه‌تمام (به دلیل کرش یا ری‌استارت) را از همان نقطه ادامه می‌دهد."""
+    resumed = 0
+    for broadcast in db.get_running_broadcasts():
+        if start_broadcast(bot, broadcast['id']):
+            resumed += 1
+            logger.info(f"BROADCAST #{broadcast['id']}: Resuming unfinished broadcast.")
+    return resumed
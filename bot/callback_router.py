@@ -2,6 +2,7 @@ from telebot import types, telebot
 from .config import ADMIN_IDS
 from .admin_router import handle_admin_callbacks
 from .user_router import handle_user_callbacks
+from .combined_handler import lookup_scope
 
 def register_callback_router(bot: telebot.TeleBot):
     """
@@ -27,8 +28,10 @@ def register_callback_router(bot: telebot.TeleBot):
         # --- منطق اصلی مسیریابی ---
         # اگر کاربر ادمین باشد و callback با پیشوند "admin:" شروع شود،
         # درخواست به مسیریاب ادمین ارسال می‌شود.
-        if is_admin and data.startswith("admin:"):
-            handle_admin_callbacks(call)
-        else:
-            # در غیر این صورت، درخواست به مسیریاب کاربران عادی ارسال می‌شود.
-            handle_user_callbacks(call)
\ No newline at end of file
+        # تمام استعلام‌های یک کلیک در یک محدوده انجام می‌شوند تا اطلاعات هر کاربر یک بار از پنل‌ها گرفته شود
+        with lookup_scope():
+            if is_admin and data.startswith("admin:"):
+                handle_admin_callbacks(call)
+            else:
+                # در غیر این صورت، درخواست به مسیریاب کاربران عادی ارسال می‌شود.
+                handle_user_callbacks(call)
\ No newline at end of file
@@ -0,0 +1,184 @@
+# bot/catalog.py
+"""
+کاتالوگ حافظه‌ای فایل‌های JSON ربات (plans.json، addons.json، events.json، serverless_config.json و ...).
+هر فایل فقط یک بار خوانده و پارس می‌شود و تنها وقتی امضای فایل (mtime، اندازه و inode) عوض شود دوباره بارگذاری
+می‌شود؛ بنابراین ویرایش دستی فایل یا ذخیره آن از پروسس دیگر (ربات یا وب‌اپ) بدون ری‌استارت دیده می‌شود.
+برای plans.json ایندکس‌های نام، قیمت، حجم و نوع به همراه حجم (GB) و مدت (روز) پارس‌شده هر پلن از قبل ساخته می‌شوند.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+# کلیدهای حجم پلن‌های اختصاصی به ترتیبی که برای تعیین حجم کل پلن بررسی می‌شوند
+_DEDICATED_VOLUME_KEYS = ('volume_de', 'volume_fr', 'volume_tr', 'volume_us', 'volume_ro')
+_NUMBER_RE = re.compile(r'\d+')
+
+
+def parse_volume_string(volume_str: str) -> int:
+    if not isinstance(volume_str, str):
+        return 0
+    numbers = _NUMBER_RE.findall(volume_str)
+    if numbers:
+        return int(numbers[0])
+    return 0
+
+
+class ServicePlan:
+    """یک پلن plans.json به همراه مقادیر عددی پارس‌شده آن."""
+    __slots__ = ('index', 'data', 'name', 'type', 'price', 'days', 'volumes', 'total_gb', 'limit_gb')
+
+    def __init__(self, index: int, data: dict):
+        self.index = index
+        self.data = data
+        self.name = data.get('name')
+        self.type = data.get('type')
+        self.price = data.get('price')
+        self.days = parse_volume_string(data.get('duration', '0'))
+        # حجم (GB) هر کلید volume_* و total_volume موجود در پلن
+        self.volumes = {key: parse_volume_string(value) for key, value in data.items()
+                        if key == 'total_volume' or key.startswith('volume_')}
+        # حجم نمایشی پلن (برای پیشنهاد پلن به کاربر)
+        self.total_gb = parse_volume_string(data.get('total_volume') or data.get('volume_de') or data.get('volume_fr')
+                                            or data.get('volume_tr') or '0')
+        # حجم کلی که پلن روی پنل‌ها اعمال می‌کند (برای تشخیص پلن فعلی کاربر از روی سقف حجمش)
+        if self.type == 'combined':
+            self.limit_gb = self.gb('volume_de') + self.gb('volume_fr')
+        else:
+            self.limit_gb = next((self.gb(key) for key in _DEDICATED_VOLUME_KEYS if key in data), 0)
+
+    def gb(self, key: str) -> int:
+        return self.volumes.get(key, 0)
+
+    @property
+    def panel_volumes(self) -> Tuple[float, float]:
+        """(حجم پنل آلمان/هیدیفای، حجم پنل فرانسه/مرزبان) برای مقایسه با سقف حجم کاربران."""
+        return float(self.gb('volume_de')), float(self.gb('volume_fr'))
+
+
+class PlanCatalog:
+    """پلن‌های plans.json به ترتیب فایل به همراه ایندکس‌ها؛ در هر ایندکس اولین پلن منطبق نگه داشته می‌شود."""
+
+    def __init__(self, plans: list):
+        if not isinstance(plans, list):
+            plans = []
+        self.plans: Tuple[ServicePlan, ...] = tuple(ServicePlan(i, plan) for i, plan in enumerate(plans))
+        self.by_name: Dict[str, ServicePlan] = {}
+        self.by_price: Dict[Any, ServicePlan] = {}
+        self.by_limit_gb: Dict[int, ServicePlan] = {}
+        self.by_panel_volumes: Dict[Tuple[float, float], ServicePlan] = {}
+        self.by_type: Dict[str, List[ServicePlan]] = {}
+        for plan in self.plans:
+            self.by_name.setdefault(plan.name, plan)
+            self.by_price.setdefault(plan.price, plan)
+            self.by_limit_gb.setdefault(plan.limit_gb, plan)
+            self.by_panel_volumes.setdefault(plan.panel_volumes, plan)
+            self.by_type.setdefault(plan.type, []).append(plan)
+
+    def __len__(self) -> int:
+        return len(self.plans)
+
+    def as_list(self) -> List[dict]:
+        """کپی قابل ویرایش پلن‌ها (همان خروجی قبلی load_service_plans)."""
+        return [dict(plan.data) for plan in self.plans]
+
+
+class CatalogFile:
+    """
+    یک فایل داده در پوشه bot که خروجی پارس‌شده‌اش در حافظه می‌ماند.
+    build متن فایل را به شیء نهایی تبدیل می‌کند؛ در صورت نبودن یا خراب بودن فایل default(None) استفاده می‌شود.
+    """
+
+    def __init__(self, file_name: str, build: Callable[[str], Any] = json.loads, default: Callable[[], Any] = dict):
+        self.file_name = file_name
+        self.path = os.path.join(_BOT_DIR, file_name)
+        self._build = build
+        self._default = default
+        self._signature = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def _stat_signature(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def get(self) -> Any:
+        signature = self._stat_signature()
+        if self._value is not None and signature == self._signature:
+            return self._value
+        with self._lock:
+            signature = self._stat_signature()
+            if self._value is None or signature != self._signature:
+                self._value = self._load(signature)
+                self._signature = signature
+            return self._value
+
+    def _load(self, signature: Optional[tuple]) -> Any:
+        if signature is None:
+            logger.warning(f"CATALOG: File not found: {self.file_name}")
+            return self._default()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return self._build(f.read())
+        except Exception as e:
+            logger.error(f"CATALOG: Failed to load or parse {self.file_name}: {e}")
+            return self._default()
+
+    def save(self, data: Any) -> bool:
+        """
+        داده را به صورت اتمیک (فایل موقت و سپس os.replace) ذخیره کرده و نسخه حافظه را همزمان جایگزین می‌کند؛
+        خواننده‌ها (در این پروسس یا پروسس‌های دیگر) هیچ‌وقت فایل نیمه‌نوشته نمی‌بینند.
+        """
+        text = json.dumps(data, ensure_ascii=False, indent=4)
+        with self._lock:
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(prefix=f".{self.file_name}.", dir=_BOT_DIR)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if os.path.exists(self.path):
+                    os.chmod(tmp_path, os.stat(self.path).st_mode & 0o777)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.error(f"CATALOG: Failed to save {self.file_name}: {e}")
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return False
+            self._value = self._build(text)
+            self._signature = self._stat_signature()
+            return True
+
+
+def _build_plan_catalog(text: str) -> PlanCatalog:
+    return PlanCatalog(json.loads(text))
+
+
+service_plans = CatalogFile('plans.json', build=_build_plan_catalog, default=lambda: PlanCatalog([]))
+serverless_config = CatalogFile('serverless_config.json', build=str, default=str)
+
+_files: Dict[str, CatalogFile] = {'plans.json': service_plans, 'serverless_config.json': serverless_config}
+_files_lock = threading.Lock()
+
+
+def catalog_file(file_name: str) -> CatalogFile:
+    """CatalogFile یک فایل JSON پوشه bot (مثل addons.json و events.json) را برمی‌گرداند."""
+    catalog = _files.get(file_name)
+    if catalog is None:
+        with _files_lock:
+            catalog = _files.setdefault(file_name, CatalogFile(file_name))
+    return catalog
+
+
+def get_plan_catalog() -> PlanCatalog:
+    return service_plans.get()
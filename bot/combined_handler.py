@@ -1,24 +1,87 @@
 # bot/combined_handler.py
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
 from .hiddify_api_handler import HiddifyAPIHandler
 from .marzban_api_handler import MarzbanAPIHandler
 from .utils import validate_uuid
+from .shared_cache import shared_cache
+from .config import (PANEL_FETCH_MAX_WORKERS, PANEL_FETCH_DEADLINE_SECONDS, COMBINED_USERS_CACHE_TTL,
+                     COMBINED_USERS_PARTIAL_CACHE_TTL, BULK_MODIFY_WORKERS_PER_PANEL)
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta, timezone
+import copy
+import functools
 import logging
-import time 
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# رجیستری سراسری handler ها به ازای شناسه پنل تا سشن HTTP و توکن مرزبان بین درخواست‌ها حفظ شود
+_handler_registry: Dict[Any, tuple] = {}
+_registry_lock = threading.Lock()
+
+
+def _panel_fingerprint(panel_config: Dict[str, Any]) -> tuple:
+    """مشخصاتی از پنل که در صورت تغییرشان، handler باید از نو ساخته شود."""
+    return (
+        panel_config.get('panel_type'),
+        panel_config.get('api_url'),
+        panel_config.get('api_token1'),
+        panel_config.get('api_token2'),
+    )
+
+
 def _get_handler_for_panel(panel_config: Dict[str, Any]):
-    """یک نمونه API handler بر اساس نوع پنل می‌سازد."""
-    try:
-        if panel_config['panel_type'] == 'hiddify':
-            return HiddifyAPIHandler(panel_config)
-        elif panel_config['panel_type'] == 'marzban':
-            return MarzbanAPIHandler(panel_config)
-    except Exception as e:
-        logger.error(f"Failed to create handler for panel {panel_config.get('name')}: {e}")
-    return None
+    """
+    handler مربوط به یک پنل را از رجیستری برمی‌گرداند و در صورت نبود، آن را می‌سازد.
+    اگر آدرس یا اطلاعات ورود پنل تغییر کرده باشد، handler قبلی کنار گذاشته می‌شود.
+    """
+    registry_key = panel_config.get('id') or panel_config.get('name')
+    fingerprint = _panel_fingerprint(panel_config)
+
+    with _registry_lock:
+        entry = _handler_registry.get(registry_key)
+        if entry and entry[0] == fingerprint:
+            return entry[1]
+
+        handler = None
+        try:
+            if panel_config['panel_type'] == 'hiddify':
+                handler = HiddifyAPIHandler(panel_config)
+            elif panel_config['panel_type'] == 'marzban':
+                handler = MarzbanAPIHandler(panel_config)
+        except Exception as e:
+            logger.error(f"Failed to create handler for panel {panel_config.get('name')}: {e}")
+
+        if handler:
+            _handler_registry[registry_key] = (fingerprint, handler)
+        else:
+            _handler_registry.pop(registry_key, None)
+        return handler
+
+
+def invalidate_panel_handlers(panel_id: Optional[int] = None) -> None:
+    """handler ذخیره شده یک پنل (یا در صورت عدم تعیین، همه پنل‌ها) را از رجیستری حذف می‌کند."""
+    with _registry_lock:
+        if panel_id is None:
+            removed = list(_handler_registry.values())
+            _handler_registry.clear()
+        else:
+            entry = _handler_registry.pop(panel_id, None)
+            removed = [entry] if entry else []
+
+    for _, handler in removed:
+        session = getattr(handler, 'session', None)
+        if session:
+            try:
+                session.close()
+            except Exception:
+                pass
+    if removed:
+        logger.info(f"COMBINED_HANDLER: Invalidated {len(removed)} cached panel handler(s).")
+    invalidate_combined_users_cache()
 
 def _process_and_merge_user_data(all_users_map: dict) -> List[Dict[str, Any]]:
     """اطلاعات خام جمع‌آوری شده از پنل‌ها را پردازش نهایی می‌کند."""
@@ -50,98 +113,397 @@ def _process_and_merge_user_data(all_users_map: dict) -> List[Dict[str, Any]]:
         processed_list.append(data)
     return processed_list
 
-def get_all_users_combined() -> List[Dict[str, Any]]:
+class CombinedUserList(list):
+    """
+    لیست کاربران ترکیب شده از پنل‌ها.
+    missing_panels نام پنل‌هایی است که در مهلت تعیین شده پاسخ ندادند یا خطا داشتند؛
+    در این حالت داده‌های لیست ناقص (partial) است.
+    """
+    def __init__(self, users=(), missing_panels=None):
+        super().__init__(users)
+        self.missing_panels: List[str] = list(missing_panels or [])
+
+    @property
+    def is_partial(self) -> bool:
+        return bool(self.missing_panels)
+
+
+def _fetch_panel_users(panel_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """کاربران یک پنل را دریافت می‌کند (در ترد جداگانه اجرا می‌شود)."""
+    handler = _get_handler_for_panel(panel_config)
+    if not handler:
+        raise RuntimeError(f"Could not create handler for panel: {panel_config['name']}")
+    return handler.get_all_users() or []
+
+
+# استخر ترد مشترک دریافت لیست کاربران پنل‌ها؛ تعداد تردها در کل پروسه به PANEL_FETCH_MAX_WORKERS محدود است
+_panel_fetch_executor = ThreadPoolExecutor(max_workers=PANEL_FETCH_MAX_WORKERS, thread_name_prefix="panel-fetch")
+# دریافت در حال انجام هر پنل؛ اگر پنلی گیر کرده باشد دریافت بعدی منتظر همان می‌ماند و ترد جدیدی اشغال نمی‌شود
+_panel_fetches: Dict[tuple, Future] = {}
+_panel_fetches_lock = threading.Lock()
+
+
+def _submit_panel_fetch(panel_config: Dict[str, Any]) -> Future:
+    key = (panel_config.get('id') or panel_config.get('name'), _panel_fingerprint(panel_config))
+    with _panel_fetches_lock:
+        for done_key in [k for k, f in _panel_fetches.items() if f.done()]:
+            del _panel_fetches[done_key]
+        future = _panel_fetches.get(key)
+        if future is None:
+            future = _panel_fetch_executor.submit(_fetch_panel_users, panel_config)
+            _panel_fetches[key] = future
+        return future
+
+
+def _merge_panel_users(all_users_map: dict, panel_config: Dict[str, Any], panel_users: List[Dict[str, Any]], uuid_by_marzban_username: Dict[str, str]) -> None:
+    """کاربران یک پنل را در نقشه کاربران ترکیب شده ادغام می‌کند."""
+    panel_name = panel_config['name']
+
+    for user in panel_users:
+        identifier = None
+        uuid = None
+
+        if panel_config['panel_type'] == 'hiddify':
+            uuid = user.get('uuid')
+            identifier = uuid
+        elif panel_config['panel_type'] == 'marzban':
+            marzban_username = user.get('username')
+            linked_uuid = uuid_by_marzban_username.get(marzban_username)
+            if linked_uuid:
+                identifier = linked_uuid
+                uuid = linked_uuid
+            else:
+                identifier = f"marzban_{marzban_username}"
+                uuid = None
+        
+        if not identifier:
+            continue
+        
+        if identifier not in all_users_map:
+            all_users_map[identifier] = {
+                'uuid': uuid,
+                'is_active': False, 'expire': None,
+                'last_online': None,
+                'current_usage_GB': 0, 'usage_limit_GB': 0,
+                'breakdown': {},
+                'panels': set()
+            }
+
+        if uuid and not all_users_map[identifier].get('uuid'):
+             all_users_map[identifier]['uuid'] = uuid
+
+        all_users_map[identifier]['breakdown'][panel_name] = {
+            "data": user,
+            "type": panel_config['panel_type']
+        }
+        all_users_map[identifier]['panels'].add(panel_name)
+        current_last_online = all_users_map[identifier].get('last_online')
+        new_last_online = user.get('last_online')
+        if new_last_online:
+            if not current_last_online or new_last_online > current_last_online:
+                all_users_map[identifier]['last_online'] = new_last_online
+        all_users_map[identifier]['is_active'] |= user.get('is_active', False)
+        all_users_map[identifier]['current_usage_GB'] += user.get('current_usage_GB', 0)
+        all_users_map[identifier]['usage_limit_GB'] += user.get('usage_limit_GB', 0)
+
+        new_expire = user.get('expire')
+        if new_expire is not None:
+            current_expire = all_users_map[identifier]['expire']
+            if current_expire is None or new_expire < current_expire:
+                all_users_map[identifier]['expire'] = new_expire
+
+
+def _fetch_all_users_combined() -> CombinedUserList:
     from .database import db
-    """اطلاعات کاربران را از تمام پنل‌های فعال دریافت و ترکیب می‌کند."""
+    """
+    اطلاعات کاربران را از تمام پنل‌های فعال به صورت همزمان دریافت و ترکیب می‌کند.
+    هر پنل حداکثر PANEL_FETCH_DEADLINE_SECONDS ثانیه فرصت دارد؛ پنل‌هایی که در این مهلت
+    پاسخ ندهند در missing_panels لیست خروجی ثبت شده و نتیجه به صورت ناقص برگردانده می‌شود.
+    """
     logger.info("COMBINED_HANDLER: Fetching users from all active panels.")
     all_users_map = {}
     active_panels = db.get_active_panels()
+    if not active_panels:
+        return CombinedUserList()
+
+    # جدول مپینگ مرزبان یک بار برای کل ادغام خوانده می‌شود (به جای یک کوئری به ازای هر کاربر)
+    mapping_index = db.get_marzban_mapping_index()
 
-    for panel_config in active_panels:
+    futures = {_submit_panel_fetch(panel_config): panel_config for panel_config in active_panels}
+    # دریافت‌های کند در پس‌زمینه ادامه می‌یابند و دریافت بعدی همان پنل به آن‌ها می‌پیوندد
+    wait(futures, timeout=PANEL_FETCH_DEADLINE_SECONDS)
+
+    missing_panels = []
+    # ادغام به ترتیب پنل‌ها (ترتیب نام) انجام می‌شود تا خروجی پایدار باشد
+    for future, panel_config in futures.items():
         panel_name = panel_config['name']
-        handler = _get_handler_for_panel(panel_config)
-        if not handler:
-            logger.warning(f"Could not create handler for panel: {panel_name}")
+        if not future.done():
+            logger.warning(f"Panel '{panel_name}' did not respond within {PANEL_FETCH_DEADLINE_SECONDS}s. Returning partial data without it.")
+            missing_panels.append(panel_name)
             continue
-
         try:
-            panel_users = handler.get_all_users() or []
+            panel_users = future.result()
             logger.info(f"Fetched {len(panel_users)} users from '{panel_name}'.")
         except Exception as e:
             logger.error(f"Could not fetch users from panel '{panel_name}': {e}")
+            missing_panels.append(panel_name)
             continue
 
-        for user in panel_users:
-            identifier = None
-            uuid = None
+        _merge_panel_users(all_users_map, panel_config, panel_users, mapping_index['by_username'])
 
-            if panel_config['panel_type'] == 'hiddify':
-                uuid = user.get('uuid')
-                identifier = uuid
-            elif panel_config['panel_type'] == 'marzban':
-                marzban_username = user.get('username')
-                linked_uuid = db.get_uuid_by_marzban_username(marzban_username)
-                if linked_uuid:
-                    identifier = linked_uuid
-                    uuid = linked_uuid
-                else:
-                    identifier = f"marzban_{marzban_username}"
-                    uuid = None
-            
-            if not identifier:
-                continue
-            
-            if identifier not in all_users_map:
-                all_users_map[identifier] = {
-                    'uuid': uuid,
-                    'is_active': False, 'expire': None,
-                    'last_online': None,
-                    'current_usage_GB': 0, 'usage_limit_GB': 0,
-                    'breakdown': {},
-                    'panels': set()
-                }
-
-            if uuid and not all_users_map[identifier].get('uuid'):
-                 all_users_map[identifier]['uuid'] = uuid
-
-            all_users_map[identifier]['breakdown'][panel_name] = {
-                "data": user,
-                "type": panel_config['panel_type']
-            }
-            all_users_map[identifier]['panels'].add(panel_name)
-            current_last_online = all_users_map[identifier].get('last_online')
-            new_last_online = user.get('last_online')
-            if new_last_online:
-                if not current_last_online or new_last_online > current_last_online:
-                    all_users_map[identifier]['last_online'] = new_last_online
-            all_users_map[identifier]['is_active'] |= user.get('is_active', False)
-            all_users_map[identifier]['current_usage_GB'] += user.get('current_usage_GB', 0)
-            all_users_map[identifier]['usage_limit_GB'] += user.get('usage_limit_GB', 0)
-
-            new_expire = user.get('expire')
-            if new_expire is not None:
-                current_expire = all_users_map[identifier]['expire']
-                if current_expire is None or new_expire < current_expire:
-                    all_users_map[identifier]['expire'] = new_expire
-    
-    return _process_and_merge_user_data(all_users_map)
+    return CombinedUserList(_process_and_merge_user_data(all_users_map), missing_panels)
+
+
+class _SnapshotFlight:
+    """یک دریافت در حال انجام از پنل‌ها که فراخوان‌های همزمان منتظر نتیجه آن می‌مانند."""
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.done = threading.Event()
+        self.result: Optional[CombinedUserList] = None
+        self.error: Optional[BaseException] = None
+        # عمر نتیجه (اگر از حافظه مشترک خوانده شده باشد) و نسخه مشترکی که نتیجه به آن تعلق دارد
+        self.age = 0.0
+        self.shared_generation = 0
+
+
+# اسنپ‌شات مشترک لیست ترکیبی کاربران در کل پروسه
+_snapshot_lock = threading.Lock()
+_snapshot: Optional[CombinedUserList] = None
+_snapshot_taken_at = 0.0
+_snapshot_generation = 0
+_snapshot_flight: Optional[_SnapshotFlight] = None
+_snapshot_shared_generation = 0
+
+# کلید اسنپ‌شات در حافظه مشترک بین پروسس‌ها (ورکرهای وب‌اپ و ربات)
+_SHARED_SNAPSHOT_KEY = 'combined_users'
+
+
+def _snapshot_ttl(max_age: float, is_partial: bool) -> float:
+    # نتیجه ناقص (پنل بدون پاسخ) مدت کوتاه‌تری نگه داشته می‌شود تا پنل برگشته زود دیده شود،
+    # اما تا آن زمان هر فراخوان دوباره منتظر پنل بدون پاسخ نمی‌ماند
+    return min(max_age, COMBINED_USERS_PARTIAL_CACHE_TTL) if is_partial else max_age
 
 
-def get_combined_user_info(identifier: str) -> Optional[Dict[str, Any]]:
+def _copy_snapshot(snapshot: CombinedUserList) -> CombinedUserList:
+    # فراخوان‌ها روی دیکشنری کاربران کلید اضافه می‌کنند؛ کپی سطحی جلوی نشت آن به بقیه را می‌گیرد
+    return CombinedUserList((dict(u) for u in snapshot), snapshot.missing_panels)
+
+
+def _load_combined_users(flight: _SnapshotFlight, max_age: float, fresh: bool) -> CombinedUserList:
+    """
+    نتیجه را از حافظه مشترک بین پروسس‌ها می‌خواند یا از پنل‌ها می‌گیرد.
+    در هر لحظه فقط یک پروسس (دارنده lease) از پنل‌ها دریافت می‌کند و بقیه منتظر نتیجه آن می‌مانند.
+    """
+
+    requested_at = time.time()
+    shared_generation = shared_cache.generation(_SHARED_SNAPSHOT_KEY)
+    flight.shared_generation = shared_generation
+
+    def _usable(entry, min_taken_at: float = 0.0) -> bool:
+        return (entry['generation'] == shared_generation and entry['taken_at'] >= min_taken_at
+                and time.time() - entry['taken_at'] <= _snapshot_ttl(max_age, bool(entry.get('missing_panels'))))
+
+    def _from_entry(entry) -> CombinedUserList:
+        flight.age = max(0.0, time.time() - entry['taken_at'])
+        return CombinedUserList(entry['users'], entry.get('missing_panels'))
+
+    if not fresh:
+        entry = shared_cache.get(_SHARED_SNAPSHOT_KEY)
+        if entry is not None and _usable(entry):
+            return _from_entry(entry)
+
+    with shared_cache.lease(_SHARED_SNAPSHOT_KEY, PANEL_FETCH_DEADLINE_SECONDS + 10) as acquired:
+        if acquired:
+            result = _fetch_all_users_combined()
+            if shared_cache.generation(_SHARED_SNAPSHOT_KEY) == shared_generation:
+                shared_cache.set(_SHARED_SNAPSHOT_KEY, {
+                    'generation': shared_generation, 'taken_at': time.time(), 'users': list(result),
+                    'missing_panels': result.missing_panels
+                }, _snapshot_ttl(COMBINED_USERS_CACHE_TTL, result.is_partial))
+            return result
+
+    # پروسس دیگری در حال دریافت است؛ نتیجه‌ای که پس از این درخواست گرفته شود قابل استفاده است
+    entry = shared_cache.wait_for(_SHARED_SNAPSHOT_KEY, PANEL_FETCH_DEADLINE_SECONDS + 10,
+                                  lambda e: _usable(e, requested_at if fresh else 0.0))
+    if entry is not None:
+        return _from_entry(entry)
+    return _fetch_all_users_combined()
+
+
+def get_all_users_combined(max_age: Optional[float] = None, fresh: bool = False) -> CombinedUserList:
+    """
+    لیست ترکیبی کاربران تمام پنل‌ها را از اسنپ‌شات مشترک برمی‌گرداند.
+    - max_age: حداکثر عمر قابل قبول اسنپ‌شات بر حسب ثانیه (پیش‌فرض COMBINED_USERS_CACHE_TTL).
+    - fresh: اسنپ‌شات ذخیره شده نادیده گرفته شده و داده از پنل‌ها گرفته می‌شود.
+    اگر چند فراخوان همزمان نیاز به به‌روزرسانی داشته باشند، فقط یک درخواست به پنل‌ها ارسال
+    شده و بقیه منتظر نتیجه همان درخواست می‌مانند. نتایج ناقص (پنل بدون پاسخ) با missing_panels و فقط
+    به مدت COMBINED_USERS_PARTIAL_CACHE_TTL ثانیه نگه داشته می‌شوند.
+    """
+    global _snapshot, _snapshot_taken_at, _snapshot_flight, _snapshot_shared_generation
+    if max_age is None:
+        max_age = COMBINED_USERS_CACHE_TTL
+
+    # تغییر کاربران در پروسس دیگر (ورکر دیگر وب‌اپ یا ربات) نسخه مشترک را بالا می‌برد
+    if _snapshot is not None and shared_cache.generation(_SHARED_SNAPSHOT_KEY) != _snapshot_shared_generation:
+        with _snapshot_lock:
+            _snapshot = None
+
+    with _snapshot_lock:
+        if (not fresh and _snapshot is not None
+                and time.monotonic() - _snapshot_taken_at <= _snapshot_ttl(max_age, _snapshot.is_partial)):
+            return _copy_snapshot(_snapshot)
+
+        flight = _snapshot_flight
+        is_leader = flight is None
+        if is_leader:
+            flight = _SnapshotFlight(_snapshot_generation)
+            _snapshot_flight = flight
+
+    if not is_leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return _copy_snapshot(flight.result)
+
+    try:
+        flight.result = _load_combined_users(flight, max_age, fresh)
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _snapshot_lock:
+            if _snapshot_flight is flight:
+                _snapshot_flight = None
+            if flight.result is not None and flight.generation == _snapshot_generation:
+                _snapshot = flight.result
+                _snapshot_taken_at = time.monotonic() - flight.age
+                _snapshot_shared_generation = flight.shared_generation
+        flight.done.set()
+
+    return _copy_snapshot(flight.result)
+
+
+def invalidate_combined_users_cache() -> None:
+    """
+    اسنپ‌شات مشترک را باطل می‌کند تا فراخوان بعدی داده تازه از پنل‌ها بگیرد (پس از تغییر کاربران).
+    نسخه حافظه مشترک هم بالا می‌رود تا اسنپ‌شات پروسس‌های دیگر نیز باطل شود.
+    """
+    global _snapshot, _snapshot_generation, _snapshot_flight
+    shared_cache.bump(_SHARED_SNAPSHOT_KEY)
+    with _snapshot_lock:
+        _snapshot = None
+        _snapshot_generation += 1
+        # نتیجه دریافت در حال انجام ممکن است پیش از تغییر گرفته شده باشد؛ فراخوان‌های بعدی منتظرش نمی‌مانند
+        _snapshot_flight = None
+    # اطلاعات تک‌کاربرهایی که در محدوده جاری گرفته شده‌اند هم دیگر معتبر نیستند
+    forget_user_lookup()
+
+
+# --- حافظه موقت استعلام تک‌کاربر در محدوده یک تعامل ---
+# یک کلیک در ربات، یک درخواست وب یا یک وظیفه زمان‌بندی‌شده معمولاً چند بار اطلاعات همان کاربر را می‌خواهد.
+# داخل lookup_scope هر شناسه فقط یک بار از پنل‌ها استعلام می‌شود. حافظه به context جاری (ترد/درخواست) تعلق دارد
+# و با هر تغییر موفق روی پنل‌ها (invalidate_combined_users_cache) پاک می‌شود؛ چون ابطال ممکن است در ترد یا
+# پروسه دیگری رخ دهد، حافظه نسخه اسنپ‌شات را نگه می‌دارد و با تغییر آن پیش از استعلام بعدی خالی می‌شود.
+_lookup_memo: ContextVar[Optional['_LookupMemo']] = ContextVar('combined_lookup_memo', default=None)
+
+
+def _current_generation() -> tuple:
+    return _snapshot_generation, shared_cache.generation(_SHARED_SNAPSHOT_KEY)
+
+
+class _LookupMemo(dict):
+    """نتایج حفظ‌شده یک محدوده به همراه نسخه داده پنل‌ها در زمان ذخیره آن‌ها."""
+
+    def __init__(self):
+        super().__init__()
+        self.generation = _current_generation()
+
+    def sync(self) -> None:
+        """اگر از زمان ذخیره، داده پنل‌ها در هر کجا ابطال شده باشد، حافظه را خالی می‌کند."""
+        generation = _current_generation()
+        if generation != self.generation:
+            self.clear()
+            self.generation = generation
+
+
+def _lookup_key(identifier: str) -> str:
+    return identifier.lower() if validate_uuid(identifier) else identifier
+
+
+def begin_lookup_scope():
+    """یک محدوده استعلام باز می‌کند و توکن آن را برمی‌گرداند (None اگر از قبل محدوده‌ای باز باشد)."""
+    if _lookup_memo.get() is not None:
+        return None
+    return _lookup_memo.set(_LookupMemo())
+
+
+def end_lookup_scope(token) -> None:
+    if token is not None:
+        _lookup_memo.reset(token)
+
+
+@contextmanager
+def lookup_scope():
+    """محدوده استعلام به صورت context manager؛ محدوده‌های تودرتو از حافظه بیرونی استفاده می‌کنند."""
+    token = begin_lookup_scope()
+    try:
+        yield
+    finally:
+        end_lookup_scope(token)
+
+
+def scoped_lookups(func):
+    """دکوراتور: کل اجرای تابع (مثلاً یک هندلر next_step) داخل یک محدوده استعلام انجام می‌شود."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with lookup_scope():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def forget_user_lookup(identifier: Optional[str] = None) -> None:
+    """اطلاعات حفظ‌شده یک کاربر (یا همه، در صورت None) را از محدوده جاری حذف می‌کند."""
+    memo = _lookup_memo.get()
+    if memo is None:
+        return
+    if identifier is None:
+        memo.clear()
+    else:
+        memo.pop(_lookup_key(identifier), None)
+
+
+def get_combined_user_info(identifier: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    اطلاعات یک کاربر خاص را از تمام پنل‌های فعال دریافت می‌کند.
+    داخل lookup_scope نتیجه هر شناسه حفظ می‌شود؛ refresh=True استعلام تازه را اجباری می‌کند.
+    """
+    memo = _lookup_memo.get()
+    if memo is None:
+        return _fetch_combined_user_info(identifier)
+
+    memo.sync()
+    key = _lookup_key(identifier)
+    if refresh or key not in memo:
+        memo[key] = _fetch_combined_user_info(identifier)
+    # فراخوان‌ها گاهی دیکشنری را تغییر می‌دهند؛ نسخه حفظ‌شده نباید آلوده شود
+    return copy.deepcopy(memo[key])
+
+
+def _fetch_combined_user_info(identifier: str) -> Optional[Dict[str, Any]]:
     from .database import db
-    """اطلاعات یک کاربر خاص را از تمام پنل‌های فعال دریافت می‌کند."""
     is_uuid = validate_uuid(identifier)
     all_panels = db.get_active_panels()
     
     hiddify_uuid_to_query = None
     marzban_username_to_query = None
+    mapping_index = db.get_marzban_mapping_index()
 
     if is_uuid:
         hiddify_uuid_to_query = identifier
-        marzban_username_to_query = db.get_marzban_username_by_uuid(identifier)
+        marzban_username_to_query = mapping_index['by_uuid'].get(identifier.lower())
     else:
         marzban_username_to_query = identifier
-        hiddify_uuid_to_query = db.get_uuid_by_marzban_username(identifier)
+        hiddify_uuid_to_query = mapping_index['by_username'].get(identifier)
 
     user_data_map = {}
 
@@ -228,8 +590,9 @@ def modify_user_on_all_panels(
     logger.info("╚═══════════════════════════════════════════════════════════")
 
     is_uuid = validate_uuid(identifier)
-    uuid = identifier if is_uuid else db.get_uuid_by_marzban_username(identifier)
-    marzban_username = db.get_marzban_username_by_uuid(identifier) if is_uuid else identifier
+    mapping_index = db.get_marzban_mapping_index()
+    uuid = identifier if is_uuid else mapping_index['by_username'].get(identifier)
+    marzban_username = mapping_index['by_uuid'].get(identifier.lower()) if is_uuid else identifier
 
     if not uuid and not marzban_username:
         logger.error(f"❌ User with identifier '{identifier}' could not be resolved. Aborting.")
@@ -326,6 +689,9 @@ def modify_user_on_all_panels(
                     any_success = True
                     logger.info(f"✅ Successfully modified user on Marzban panel '{panel_name}'")
 
+    if any_success:
+        invalidate_combined_users_cache()
+
     if any_success and (add_days > 0 or set_days is not None):
         if uuid:
             uuid_record = db.get_user_uuid_record(uuid)
@@ -341,6 +707,151 @@ def modify_user_on_all_panels(
     return any_success
 
 
+def _hiddify_bulk_payload(panel_data: Dict[str, Any], add_gb: float, add_days: int) -> Dict[str, Any]:
+    """همان payload که modify_user_on_all_panels برای Hiddify می‌سازد، از روی داده از پیش خوانده شده."""
+    payload = {}
+    current_remaining = panel_data.get('expire', 0)
+    if current_remaining is None or current_remaining < 0:
+        current_remaining = 0
+    if add_days > 0:
+        payload['start_date'] = None
+        payload['package_days'] = int(current_remaining + add_days)
+    if add_gb > 0:
+        payload['usage_limit_GB'] = panel_data.get('usage_limit_GB', 0) + add_gb
+    return payload
+
+
+def _marzban_bulk_payload(handler, panel_data: Dict[str, Any], add_gb: float, add_days: int) -> Dict[str, Any]:
+    """همان payload که modify_user_on_all_panels برای Marzban می‌سازد، از روی داده از پیش خوانده شده."""
+    payload = {}
+    if add_gb > 0:
+        current_limit_bytes = int((panel_data.get('usage_limit_GB', 0) or 0) * (1024**3))
+        payload['data_limit'] = current_limit_bytes + int(add_gb * (1024**3))
+    if add_days > 0:
+        if 'expire_ts' in panel_data:
+            current_expire_ts = panel_data['expire_ts']
+        else:
+            # داده‌ای که پیش از اضافه شدن expire_ts گرفته شده؛ تاریخ خام را از پنل می‌خوانیم
+            raw_marzban_user = handler._request("GET", f"/user/{panel_data['username']}")
+            current_expire_ts = raw_marzban_user.get('expire') if raw_marzban_user else None
+        start_date = datetime.now()
+        if current_expire_ts and current_expire_ts > start_date.timestamp():
+            start_date = datetime.fromtimestamp(current_expire_ts)
+        payload['expire'] = int((start_date + timedelta(days=add_days)).timestamp())
+    return payload
+
+
+def _apply_bulk_modification(handler, panel_type: str, panel_data: Dict[str, Any], add_gb: float, add_days: int) -> bool:
+    if panel_type == 'hiddify':
+        payload = _hiddify_bulk_payload(panel_data, add_gb, add_days)
+        return not payload or handler.modify_user(panel_data['uuid'], payload)
+    payload = _marzban_bulk_payload(handler, panel_data, add_gb, add_days)
+    # PUT مستقیم؛ modify_user مرزبان پیش از هر ویرایش یک GET اضافه می‌زند که اینجا لازم نیست
+    return not payload or handler._request("PUT", f"/user/{panel_data['username']}", json=payload) is not None
+
+
+def bulk_modify_users(
+    target_users: List[Dict[str, Any]],
+    add_gb: float = 0,
+    add_days: int = 0,
+    target_panel_type: Optional[str] = None,
+    progress_callback: Optional[Callable[[int, int], None]] = None
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    نسخه گروهی modify_user_on_all_panels برای دستورات گروهی ادمین.
+    به جای خواندن دوباره هر کاربر از پنل، داده breakdown همان کاربران (خروجی get_all_users_combined)
+    مبنای محاسبه حجم و تاریخ جدید است و درخواست‌های ویرایش هر پنل با یک استخر ترد محدود
+    (BULK_MODIFY_WORKERS_PER_PANEL) و همه پنل‌ها به صورت همزمان ارسال می‌شوند.
+    progress_callback(done, total) پس از اتمام کار هر کاربر در ترد فراخوان صدا زده می‌شود.
+    خروجی: {'succeeded': [...], 'partial': [...], 'failed': [...]} که هر مورد شامل identifier، name و نتیجه هر پنل
+    (panels: {نام پنل: bool}) است. succeeded یعنی تغییر روی همه پنل‌های هدف کاربر اعمال شده و partial یعنی فقط روی
+    بخشی از آن‌ها؛ فراخوان‌هایی که به نتیجه کامل وابسته‌اند (مثل کسر هزینه) باید partial را ناموفق حساب کنند.
+    """
+    from .database import db
+
+    active_panels = {p['name']: p for p in db.get_active_panels()}
+    results, tasks = [], []
+    for user in target_users:
+        result = {'identifier': user.get('uuid') or user.get('username'), 'uuid': user.get('uuid'),
+                  'name': user.get('name') or user.get('username') or '', 'panels': {}}
+        results.append(result)
+        for panel_name, panel_info in (user.get('breakdown') or {}).items():
+            panel_config = active_panels.get(panel_name)
+            panel_type, panel_data = panel_info.get('type'), panel_info.get('data') or {}
+            if not panel_config or (target_panel_type and panel_type != target_panel_type):
+                continue
+            if (panel_type == 'hiddify' and panel_data.get('uuid')) or (panel_type == 'marzban' and panel_data.get('username')):
+                tasks.append((result, panel_config, panel_type, panel_data))
+
+    total = len(results)
+    pending = {id(r): 0 for r in results}
+    for result, *_ in tasks:
+        pending[id(result)] += 1
+    # کاربرانی که در هیچ پنل فعالی نیستند از همان ابتدا انجام‌شده (و ناموفق) حساب می‌شوند
+    done = sum(1 for count in pending.values() if count == 0)
+    logger.info(f"Bulk modify: {total} user(s), {len(tasks)} panel update(s), add_gb={add_gb}, add_days={add_days}, "
+                f"target_panel_type={target_panel_type or 'ALL'}")
+
+    def _run(handler, panel_type, panel_data):
+        try:
+            return bool(_apply_bulk_modification(handler, panel_type, panel_data, add_gb, add_days))
+        except Exception as e:
+            logger.error(f"Bulk modify: update failed for '{panel_data.get('uuid') or panel_data.get('username')}': {e}", exc_info=True)
+            return False
+
+    executors = {}
+    futures = {}
+    try:
+        for result, panel_config, panel_type, panel_data in tasks:
+            panel_name = panel_config['name']
+            handler = _get_handler_for_panel(panel_config)
+            if not handler:
+                result['panels'][panel_name] = False
+                pending[id(result)] -= 1
+                if pending[id(result)] == 0:
+                    done += 1
+                continue
+            if panel_name not in executors:
+                executors[panel_name] = ThreadPoolExecutor(max_workers=BULK_MODIFY_WORKERS_PER_PANEL,
+                                                           thread_name_prefix=f"bulk-modify-{panel_name}")
+            future = executors[panel_name].submit(_run, handler, panel_type, panel_data)
+            futures[future] = (result, panel_name)
+
+        if progress_callback and done:
+            progress_callback(done, total)
+        for future in as_completed(futures):
+            result, panel_name = futures[future]
+            result['panels'][panel_name] = future.result()
+            pending[id(result)] -= 1
+            if pending[id(result)] == 0:
+                done += 1
+                if progress_callback:
+                    progress_callback(done, total)
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+
+    report = {'succeeded': [], 'partial': [], 'failed': []}
+    for result in results:
+        outcomes = list(result['panels'].values())
+        if outcomes and all(outcomes):
+            report['succeeded'].append(result)
+        elif any(outcomes):
+            report['partial'].append(result)
+        else:
+            report['failed'].append(result)
+
+    if add_days > 0:
+        # تاریخ انقضای کاربران partial هم دست‌کم روی یک پنل جابه‌جا شده است
+        db.reset_renewal_reminders_sent([r['uuid'] for r in report['succeeded'] + report['partial'] if r['uuid']])
+    if tasks:
+        invalidate_combined_users_cache()
+
+    logger.info(f"Bulk modify finished: {len(report['succeeded'])} succeeded, {len(report['partial'])} partial, "
+                f"{len(report['failed'])} failed.")
+    return report
+
+
 def delete_user_from_all_panels(identifier: str) -> bool:
     from .database import db
     """کاربر را از تمام پنل‌هایی که در آن وجود دارد حذف می‌کند."""
@@ -369,5 +880,6 @@ def delete_user_from_all_panels(identifier: str) -> bool:
     
     if user_info.get('uuid'):
         db.delete_user_by_uuid(user_info['uuid'])
-        
+
+    invalidate_combined_users_cache()
     return all_success
\ No newline at end of file
@@ -1,5 +1,4 @@
 import os
-from cachetools import TTLCache
 from dotenv import load_dotenv
 from datetime import time
 import pytz
@@ -28,10 +27,35 @@ MARZBAN_API_PASSWORD = os.getenv("MARZBAN_API_PASSWORD")
 ADMIN_SECRET_KEY = os.getenv("ADMIN_SECRET_KEY")
 
 DATABASE_PATH = "bot_data.db"
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "shared_cache.db")  # فایل SQLite حافظه موقت مشترک بین ورکرهای وب‌اپ و پروسس ربات
 TELEGRAM_FILE_SIZE_LIMIT_BYTES = 50 * 1024 * 1024
-api_cache = TTLCache(maxsize=2, ttl=60)
 API_TIMEOUT = 45
 API_RETRY_COUNT = 3
+TOKEN_REFRESH_MARGIN_SECONDS = 60  # توکن مرزبان این مقدار ثانیه پیش از انقضا تمدید می‌شود
+PANEL_FETCH_MAX_WORKERS = 4  # حداکثر تعداد پنل‌هایی که همزمان از آن‌ها لیست کاربران گرفته می‌شود
+PANEL_FETCH_DEADLINE_SECONDS = API_TIMEOUT + 5  # مهلت هر پنل؛ پس از آن نتیجه بدون آن پنل برگردانده می‌شود
+COMBINED_USERS_CACHE_TTL = 60  # حداکثر عمر (ثانیه) لیست ترکیبی کاربران که بین تمام بخش‌ها و پروسس‌ها مشترک است
+COMBINED_USERS_PARTIAL_CACHE_TTL = 15  # حداکثر عمر (ثانیه) لیست ترکیبی ناقص (وقتی پنلی پاسخ نداده است)
+LIST_VIEW_CACHE_TTL = 120  # حداکثر عمر (ثانیه) لیست‌های فیلتر و مرتب‌شده گزارش‌های ادمین که بین صفحات مشترک است
+SUBSCRIPTION_CACHE_TTL = 600  # حداکثر عمر (ثانیه) خروجی آماده لینک اشتراک هر کاربر
+SUBSCRIPTION_CACHE_MAX_ENTRIES = 5000  # حداکثر تعداد UUIDهایی که خروجی اشتراکشان در حافظه مشترک نگه داشته می‌شود
+DASHBOARD_CACHE_TTL = 60  # حداکثر عمر (ثانیه) آمار آماده داشبورد ادمین وب‌اپ که بین ورکرها مشترک است
+USER_CACHE_MAX_ENTRIES = 5000  # حداکثر تعداد کاربرانی که اطلاعاتشان (ردیف کاربر، تنظیمات، زبان و UUIDها) در حافظه هر پروسس می‌ماند
+USER_CACHE_SYNC_SECONDS = 1  # حداکثر تأخیر (ثانیه) تا تغییرات کاربران توسط پروسس دیگر (ربات یا وب‌اپ) در حافظه این پروسس دیده شود
+USER_AGENT_FLUSH_INTERVAL = 30  # فاصله (ثانیه) ذخیره دسته‌ای دستگاه‌های کاربران که هنگام دریافت لینک اشتراک ثبت می‌شوند
+USER_DIRECTORY_SYNC_MINUTES = 5  # فاصله (دقیقه) به‌روزرسانی جدول محلی کاربران پنل‌ها (panel_users) برای لیست کاربران پنل ادمین
+BROADCAST_GLOBAL_RATE = 25  # حداکثر پیام در ثانیه برای ارسال همگانی (سقف تلگرام حدود ۳۰ پیام در ثانیه است)
+BROADCAST_WORKERS = 4  # تعداد تردهای همزمان ارسال پیام همگانی
+BROADCAST_BATCH_SIZE = 100  # تعداد گیرندگانی که در هر دسته ارسال و وضعیتشان یکجا ذخیره می‌شود
+BROADCAST_PROGRESS_INTERVAL = 5  # فاصله (ثانیه) ویرایش پیام پیشرفت ادمین؛ زیر سقف یک پیام در ثانیه برای هر چت
+BROADCAST_MAX_ATTEMPTS = 3  # تعداد تلاش برای هر گیرنده پیش از ثبت به عنوان ناموفق
+BULK_MODIFY_WORKERS_PER_PANEL = 4  # تعداد درخواست‌های همزمان ویرایش کاربر به هر پنل در دستورات گروهی
+
+# --- اجرای وب‌اپ در حالت production (gunicorn.conf.py) ---
+WEBAPP_BIND = os.getenv("WEBAPP_BIND", "0.0.0.0:8001")
+WEBAPP_WORKERS = int(os.getenv("WEBAPP_WORKERS", "3"))  # تعداد پروسس‌های ورکر gunicorn
+WEBAPP_THREADS = int(os.getenv("WEBAPP_THREADS", "8"))  # تعداد ترد هر ورکر (worker_class=gthread)
+WEBAPP_TIMEOUT = int(os.getenv("WEBAPP_TIMEOUT", str(API_TIMEOUT + 30)))  # مهلت هر درخواست؛ بیشتر از مهلت API پنل‌ها
 
 TEHRAN_TZ = pytz.timezone("Asia/Tehran")
 DAILY_REPORT_TIME = time(23, 57)
@@ -14,6 +14,7 @@ from .admin_router import register_admin_handlers
 from .callback_router import register_callback_router
 from .utils import initialize_utils
 from .inline_handlers import register_inline_handlers
+from . import broadcast_engine
 
 
 logger = logging.getLogger(__name__)
@@ -97,6 +98,11 @@ class HiddifyBot:
             # شروع به کار زمان‌بند (Scheduler)
             self.scheduler.start()
             logger.info("✅ Scheduler thread started")
+
+            # ادامه پیام‌های همگانی که پیش از ری‌استارت تمام نشده بودند
+            resumed = broadcast_engine.resume_broadcasts(self.bot)
+            if resumed:
+                logger.info(f"✅ Resumed {resumed} unfinished broadcast(s)")
             
             # اطلاع‌رسانی به ادمین‌ها و شروع polling
             _notify_admins_start()
@@ -13,11 +13,13 @@ from .db.panel import PanelDB
 from .db.financials import FinancialsDB
 from .db.transfer import TransferDB
 from .db.notifications import NotificationsDB
+from .db.broadcast import BroadcastDB
+from .db.panel_users import PanelUsersDB
 
 logger = logging.getLogger(__name__)
 
 # کلاس اصلی دیتابیس که از تمام کلاس‌های دیگر ارث‌بری می‌کند
-class Database(UserDB, UsageDB, WalletDB, FeedbackDB, SupportDB, AchievementDB, PanelDB, FinancialsDB, TransferDB, NotificationsDB): # <--- کلاس جدید به لیست ارث‌بری اضافه شد
+class Database(UserDB, UsageDB, WalletDB, FeedbackDB, SupportDB, AchievementDB, PanelDB, FinancialsDB, TransferDB, NotificationsDB, BroadcastDB, PanelUsersDB): # <--- کلاس جدید به لیست ارث‌بری اضافه شد
     """
     کلاس جامع برای مدیریت دیتابیس.
     """
@@ -102,6 +102,15 @@ class AchievementDB(DatabaseManager):
             rows = c.execute(query, (user_id, start_date)).fetchall()
             return [dict(r) for r in rows]
             
+    def get_all_achievements_in_range(self, start_date: datetime) -> Dict[int, List[Dict[str, Any]]]:
+        """دستاوردهای کسب شده تمام کاربران از یک زمان مشخص را به تفکیک user_id برمی‌گرداند."""
+        query = "SELECT user_id, badge_code, awarded_at FROM user_achievements WHERE awarded_at >= ? ORDER BY awarded_at DESC"
+        achievements = {}
+        with self._conn() as c:
+            for row in c.execute(query, (start_date,)):
+                achievements.setdefault(row['user_id'], []).append({'badge_code': row['badge_code'], 'awarded_at': row['awarded_at']})
+        return achievements
+
     def get_daily_achievements(self) -> List[Dict[str, Any]]:
         """کاربرانی که امروز دستاوردی کسب کرده‌اند را به همراه جزئیات برمی‌گرداند."""
         tehran_tz = pytz.timezone("Asia/Tehran")
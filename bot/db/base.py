@@ -1,13 +1,16 @@
 # bot/db/base.py
 
+import os
 import sqlite3
 import logging
 import threading
+import time
 from contextlib import contextmanager
-from typing import Iterator
+from typing import Any, Callable, Iterator
+
+from ..config import USER_CACHE_MAX_ENTRIES, USER_CACHE_SYNC_SECONDS
+from .user_cache import UserCache
 
-# قفل برای جلوگیری از تداخل در محیط‌های چندنخی
-db_lock = threading.RLock()
 logger = logging.getLogger(__name__)
 
 class DatabaseManager:
@@ -17,27 +20,75 @@ class DatabaseManager:
     """
     def __init__(self, path: str = "bot_data.db"):
         self.path = path
-        self._user_cache = {}
+        # داده‌های پرتکرار کاربران؛ تغییرات پروسس‌های دیگر از جدول user_cache_log خوانده می‌شود
+        self._user_cache = UserCache(USER_CACHE_MAX_ENTRIES)
+        self._user_cache_seq = 0
+        self._user_cache_synced_at = 0.0
+        self._user_cache_sync_lock = threading.Lock()
+        self._marzban_mapping_index = None
+        self._template_index = None
+        self._panel_users_fts = None
+        # هر ترد یک اتصال ماندگار دارد؛ در حالت WAL خواننده‌ها همزمان کار می‌کنند
+        # و نویسنده‌ها توسط قفل نوشتن خود SQLite (busy_timeout) به صف می‌شوند
+        self._local = threading.local()
+        # صف نوشتن تأخیری دستگاه‌های کاربران (User-Agent) که در پس‌زمینه به صورت دسته‌ای ذخیره می‌شود
+        self._user_agent_buffer = {}
+        self._user_agent_lock = threading.Lock()
+        self._user_agent_flusher = None
         self._init_db()
+        with self._conn() as c:
+            row = c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'user_cache_log'").fetchone()
+            self._user_cache_seq = row['seq'] if row else 0
+
+    def _thread_conn(self) -> sqlite3.Connection:
+        """اتصال ترد جاری را برمی‌گرداند و در اولین استفاده (یا پس از fork) آن را می‌سازد."""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is None or local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, timeout=10)
+            # PRAGMA ها فقط یک بار به ازای هر اتصال اجرا می‌شوند
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys = ON;")
+            conn.row_factory = sqlite3.Row
+            local.conn, local.pid, local.depth = conn, os.getpid(), 0
+        return conn
 
     @contextmanager
     def _conn(self) -> Iterator[sqlite3.Connection]:
-        with db_lock:
-            try:
-                conn = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, timeout=10)
-                conn.execute("PRAGMA journal_mode=WAL")
-                conn.execute("PRAGMA foreign_keys = ON;")
-                conn.row_factory = sqlite3.Row
-                yield conn
+        """
+        اتصال ماندگار ترد جاری را در اختیار قرار می‌دهد.
+        فقط بیرونی‌ترین بلوک تو در تو commit یا rollback می‌کند.
+        """
+        conn = self._thread_conn()
+        local = self._local
+        local.depth += 1
+        changes_before = conn.total_changes
+        try:
+            yield conn
+            if local.depth == 1:
                 conn.commit()
-            except sqlite3.Error as e:
-                logger.error(f"Database error: {e}")
-                if 'conn' in locals():
-                    conn.rollback()
-                raise
-            finally:
-                if 'conn' in locals():
-                    conn.close()
+                # تغییرات همین پروسس بلافاصله (و نه پس از USER_CACHE_SYNC_SECONDS) در حافظه کاربران اعمال می‌شود
+                if conn.total_changes != changes_before:
+                    self._sync_user_cache(force=True)
+        except sqlite3.Error as e:
+            logger.error(f"Database error: {e}")
+            if local.depth == 1:
+                conn.rollback()
+            raise
+        except BaseException:
+            # اتصال بسته نمی‌شود، پس تراکنش نیمه‌کاره نباید به استفاده بعدی منتقل شود
+            if local.depth == 1 and conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            local.depth -= 1
+
+    def close_thread_connection(self) -> None:
+        """اتصال ترد جاری را می‌بندد (برای تردهای کارگر پیش از خروج)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
 
     def write_conn(self, query: str, params: tuple = ()):
         with self._conn() as conn:
@@ -55,344 +106,43 @@ class DatabaseManager:
             return False
 
     def clear_user_cache(self, user_id: int):
-        if user_id in self._user_cache:
-            with db_lock:
-                if user_id in self._user_cache:
-                    del self._user_cache[user_id]
+        self._user_cache.discard((user_id,))
 
-    def _init_db(self):
+    def _sync_user_cache(self, force: bool = False) -> None:
         """
-        ایجاد جداول ضروری دیتابیس.
-        جداول قدیمی و ناسازگار از این لیست حذف شده‌اند.
-        تمام کلیدهای خارجی به درستی به users(user_id) اشاره می‌کنند.
+        کاربرانی را که از آخرین بررسی (در هر پروسسی) تغییر کرده‌اند از حافظه LRU حذف می‌کند.
+        تریگرهای جداول users و user_uuids شناسه کاربر تغییر کرده را در user_cache_log ثبت می‌کنند.
         """
-        tables_queries = [
-            # 1. جدول کاربران
-            """CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                birthday DATE,
-                daily_reports INTEGER DEFAULT 1,
-                expiry_warnings INTEGER DEFAULT 1,
-                data_warning_de INTEGER DEFAULT 1,
-                data_warning_fr INTEGER DEFAULT 1,
-                data_warning_tr INTEGER DEFAULT 1,
-                data_warning_us INTEGER DEFAULT 1,
-                data_warning_nl INTEGER DEFAULT 1,
-                data_warning_al INTEGER DEFAULT 1,
-                data_warning_ro INTEGER DEFAULT 1,
-                data_warning_supp INTEGER DEFAULT 1,
-                show_info_config INTEGER DEFAULT 1,
-                admin_note TEXT,
-                lang_code TEXT,
-                last_checkin DATE,
-                streak_count INTEGER DEFAULT 0,
-                weekly_reports INTEGER DEFAULT 1,
-                monthly_reports INTEGER DEFAULT 1,
-                auto_delete_reports INTEGER DEFAULT 0,
-                referral_code TEXT,
-                referred_by_user_id INTEGER,
-                referral_reward_applied INTEGER DEFAULT 0,
-                achievement_points INTEGER DEFAULT 0,
-                achievement_alerts INTEGER DEFAULT 1,
-                promotional_alerts INTEGER DEFAULT 1,
-                wallet_balance REAL DEFAULT 0.0,
-                auto_renew INTEGER DEFAULT 0
-            );""",
-
-            # 2. جدول کانفیگ‌ها
-            """CREATE TABLE IF NOT EXISTS user_uuids (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                uuid TEXT,
-                name TEXT,
-                is_active INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP,
-                first_connection_time TIMESTAMP,
-                welcome_message_sent INTEGER DEFAULT 0,
-                renewal_reminder_sent INTEGER DEFAULT 0,
-                is_vip INTEGER DEFAULT 0,
-                has_access_ir INTEGER DEFAULT 0,
-                has_access_de INTEGER DEFAULT 1,
-                has_access_fr INTEGER DEFAULT 0,
-                has_access_tr INTEGER DEFAULT 0,
-                has_access_us INTEGER DEFAULT 0,
-                has_access_al INTEGER DEFAULT 0,
-                has_access_nl INTEGER DEFAULT 0,
-                has_access_ro INTEGER DEFAULT 0,
-                has_access_supp INTEGER DEFAULT 0,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );""",
-
-            # 3. جدول اسنپ‌شات‌های مصرف
-            """CREATE TABLE IF NOT EXISTS usage_snapshots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uuid_id INTEGER,
-                hiddify_usage_gb REAL DEFAULT 0,
-                marzban_usage_gb REAL DEFAULT 0,
-                taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(uuid_id) REFERENCES user_uuids(id) ON DELETE CASCADE
-            );""",
-
-            # 4. پیام‌های زمان‌بندی شده
-            """CREATE TABLE IF NOT EXISTS scheduled_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                job_type TEXT,
-                chat_id INTEGER,
-                message_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 5. لاگ هشدارها
-            """CREATE TABLE IF NOT EXISTS warning_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uuid_id INTEGER,
-                warning_type TEXT,
-                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 6. پرداخت‌ها
-            """CREATE TABLE IF NOT EXISTS payments (
-                payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uuid_id INTEGER,
-                payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 7. قالب‌های کانفیگ
-            """CREATE TABLE IF NOT EXISTS config_templates (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                template_str TEXT,
-                is_active INTEGER DEFAULT 1,
-                is_special INTEGER DEFAULT 0,
-                is_random_pool INTEGER DEFAULT 0,
-                server_type TEXT DEFAULT 'none',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 8. کانفیگ‌های تولید شده
-            """CREATE TABLE IF NOT EXISTS user_generated_configs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_uuid_id INTEGER,
-                template_id INTEGER,
-                generated_uuid TEXT
-            );""",
-
-            # 9. نگاشت مرزبان
-            """CREATE TABLE IF NOT EXISTS marzban_mapping (
-                hiddify_uuid TEXT,
-                marzban_username TEXT
-            );""",
-
-            # 10. توکن‌های ورود
-            """CREATE TABLE IF NOT EXISTS login_tokens (
-                token TEXT PRIMARY KEY,
-                uuid TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 11. گزارش‌های ارسال شده
-            """CREATE TABLE IF NOT EXISTS sent_reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                message_id INTEGER,
-                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 12. دستگاه‌های کاربر
-            """CREATE TABLE IF NOT EXISTS client_user_agents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uuid_id INTEGER,
-                user_agent TEXT,
-                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 13. پنل‌ها
-            """CREATE TABLE IF NOT EXISTS panels (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                panel_type TEXT,
-                api_url TEXT,
-                api_token1 TEXT,
-                api_token2 TEXT,
-                is_active INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 14. انتقال ترافیک
-            """CREATE TABLE IF NOT EXISTS traffic_transfers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sender_uuid_id INTEGER,
-                receiver_uuid_id INTEGER,
-                panel_type TEXT,
-                amount_gb REAL,
-                transferred_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 15. دستاوردهای کاربر (جدید)
-            """CREATE TABLE IF NOT EXISTS user_achievements (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                badge_code TEXT,
-                awarded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 16. لاگ خرید فروشگاه
-            """CREATE TABLE IF NOT EXISTS achievement_shop_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                item_key TEXT,
-                cost INTEGER,
-                purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 17. لاگ هدیه تولد
-            """CREATE TABLE IF NOT EXISTS birthday_gift_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                gift_year INTEGER,
-                given_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 18. لاگ هدیه سالگرد
-            """CREATE TABLE IF NOT EXISTS anniversary_gift_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                gift_year INTEGER,
-                given_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 19. تراکنش‌های کیف پول (اصلی)
-            """CREATE TABLE IF NOT EXISTS wallet_transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                amount REAL,
-                type TEXT,
-                description TEXT,
-                transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );""",
-
-            # 20. درخواست‌های شارژ
-            """CREATE TABLE IF NOT EXISTS charge_requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                amount REAL,
-                message_id INTEGER,
-                request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_pending INTEGER DEFAULT 1,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );""",
-
-            # 21. انتقال‌های کیف پول
-            """CREATE TABLE IF NOT EXISTS wallet_transfers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sender_user_id INTEGER,
-                receiver_user_id INTEGER,
-                amount REAL,
-                transferred_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 22. لاگ تمدید خودکار
-            """CREATE TABLE IF NOT EXISTS auto_renewal_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                uuid_id INTEGER,
-                plan_price REAL,
-                renewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 23. بلیط‌های قرعه‌کشی
-            """CREATE TABLE IF NOT EXISTS lottery_tickets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-
-            # 24. اعلان‌ها
-            """CREATE TABLE IF NOT EXISTS notifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                title TEXT,
-                message TEXT,
-                category TEXT DEFAULT 'info',
-                is_read INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );""",
-
-            # 25. لاگ قهرمان هفتگی
-            """CREATE TABLE IF NOT EXISTS weekly_champion_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                win_date DATE
-            );""",
-
-            # 26. درخواست‌های دستاورد
-            """CREATE TABLE IF NOT EXISTS achievement_requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                badge_code TEXT,
-                status TEXT DEFAULT 'pending',
-                requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                reviewed_by INTEGER,
-                reviewed_at TIMESTAMP
-            );""",
-
-            # 27. هزینه‌های ماهانه
-            """CREATE TABLE IF NOT EXISTS monthly_costs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                year INTEGER,
-                month INTEGER,
-                cost REAL,
-                description TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );""",
-            
-            # 28. بازخورد کاربران
-            """CREATE TABLE IF NOT EXISTS user_feedback (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                rating INTEGER,
-                comment TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );""",
-
-            # 29. تیکت‌های پشتیبانی
-            """CREATE TABLE IF NOT EXISTS support_tickets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                status TEXT DEFAULT 'open',
-                initial_admin_message_id INTEGER,
-                last_message_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
-            );"""
-        ]
+        if not force and time.monotonic() - self._user_cache_synced_at < USER_CACHE_SYNC_SECONDS:
+            return
+        with self._user_cache_sync_lock:
+            self._user_cache_synced_at = time.monotonic()
+            conn = self._thread_conn()
+            try:
+                rows = conn.execute(
+                    "SELECT seq, user_id FROM user_cache_log WHERE seq > ? ORDER BY seq LIMIT ?",
+                    (self._user_cache_seq, USER_CACHE_MAX_ENTRIES + 1)
+                ).fetchall()
+                if not rows:
+                    return
+                # شکاف در شماره‌ها یعنی رکوردهای بررسی نشده پاک شده‌اند؛ در این حالت (و تغییرات بسیار زیاد) کل حافظه خالی می‌شود
+                if rows[0]['seq'] != self._user_cache_seq + 1 or len(rows) > USER_CACHE_MAX_ENTRIES:
+                    self._user_cache.clear()
+                    self._user_cache_seq = conn.execute("SELECT MAX(seq) FROM user_cache_log").fetchone()[0]
+                else:
+                    self._user_cache.discard({row['user_id'] for row in rows})
+                    self._user_cache_seq = rows[-1]['seq']
+            except sqlite3.Error as e:
+                logger.warning(f"User cache sync failed, clearing it: {e}")
+                self._user_cache.clear()
 
-        # ایندکس‌های ضروری
-        indices_queries = [
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_referral_code ON users(referral_code);",
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_user_uuids_uuid_user ON user_uuids(user_id, uuid);",
-            "CREATE INDEX IF NOT EXISTS idx_user_uuids_uuid ON user_uuids(uuid);",
-            "CREATE INDEX IF NOT EXISTS idx_user_uuids_user_id ON user_uuids(user_id);",
-            "CREATE INDEX IF NOT EXISTS idx_usage_snapshots_uuid_taken ON usage_snapshots(uuid_id, taken_at);",
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_marzban_mapping_uuid ON marzban_mapping(hiddify_uuid);",
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_marzban_mapping_username ON marzban_mapping(marzban_username);"
-        ]
+    def _cached_user_data(self, user_id: int, kind: str, loader: Callable[[int], Any]) -> Any:
+        """داده kind کاربر را از حافظه LRU برمی‌گرداند یا با loader از دیتابیس می‌خواند."""
+        self._sync_user_cache()
+        return self._user_cache.get_or_load(user_id, kind, loader)
 
+    def _init_db(self):
+        """اسکیمای دیتابیس را با اجرای مهاجرت‌های اعمال نشده (bot/db/migrations.py) به آخرین نسخه می‌رساند."""
+        from .migrations import run_migrations
         with self._conn() as conn:
-            for query in tables_queries:
-                try:
-                    conn.execute(query)
-                except sqlite3.Error as e:
-                    logger.error(f"Error checking/creating table: {e}")
-            
-            for idx_query in indices_queries:
-                try:
-                    conn.execute(idx_query)
-                except sqlite3.Error as e:
-                    logger.warning(f"Index creation notice: {e}")
\ No newline at end of file
+            run_migrations(conn)
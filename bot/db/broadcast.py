@@ -0,0 +1,81 @@
+# bot/db/broadcast.py
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+import pytz
+
+from .base import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+class BroadcastDB(DatabaseManager):
+    """
+    کلاسی برای نگهداری وضعیت پیام‌های همگانی و گیرندگان آن‌ها،
+    تا ارسال پس از ری‌استارت ربات از همان نقطه ادامه پیدا کند.
+    """
+
+    def create_broadcast(self, admin_id: int, source_message_id: int, progress_message_id: Optional[int],
+                         target_group: str, user_ids: List[int]) -> int:
+        """یک پیام همگانی جدید به همراه تمام گیرندگان آن (در وضعیت pending) ثبت می‌کند."""
+        with self._conn() as c:
+            cursor = c.execute(
+                "INSERT INTO broadcasts (admin_id, source_message_id, progress_message_id, target_group, status, created_at) VALUES (?, ?, ?, ?, 'running', ?)",
+                (admin_id, source_message_id, progress_message_id, target_group, datetime.now(pytz.utc))
+            )
+            broadcast_id = cursor.lastrowid
+            c.executemany(
+                "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id) VALUES (?, ?)",
+                ((broadcast_id, user_id) for user_id in user_ids)
+            )
+            return broadcast_id
+
+    def get_broadcast(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        with self._conn() as c:
+            row = c.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+            return dict(row) if row else None
+
+    def get_running_broadcasts(self) -> List[Dict[str, Any]]:
+        """پیام‌های همگانی که ارسالشان تمام نشده (برای ادامه پس از ری‌استارت)."""
+        with self._conn() as c:
+            rows = c.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id ASC").fetchall()
+            return [dict(r) for r in rows]
+
+    def get_pending_broadcast_recipients(self, broadcast_id: int, limit: int) -> List[int]:
+        with self._conn() as c:
+            rows = c.execute(
+                "SELECT user_id FROM broadcast_recipients WHERE broadcast_id = ? AND status = 'pending' LIMIT ?",
+                (broadcast_id, limit)
+            ).fetchall()
+            return [r['user_id'] for r in rows]
+
+    def update_broadcast_recipients(self, broadcast_id: int, results: List[Tuple[int, str, Optional[str]]]) -> None:
+        """نتیجه ارسال یک دسته از گیرندگان را با یک تراکنش ثبت می‌کند. هر مورد: (user_id, status, error)."""
+        if not results:
+            return
+        now = datetime.now(pytz.utc)
+        with self._conn() as c:
+            c.executemany(
+                "UPDATE broadcast_recipients SET status = ?, error = ?, attempts = attempts + 1, updated_at = ? WHERE broadcast_id = ? AND user_id = ?",
+                ((status, error, now, broadcast_id, user_id) for user_id, status, error in results)
+            )
+
+    def get_broadcast_stats(self, broadcast_id: int) -> Dict[str, int]:
+        """تعداد گیرندگان هر وضعیت را برمی‌گرداند."""
+        stats = {'pending': 0, 'sent': 0, 'failed': 0}
+        with self._conn() as c:
+            rows = c.execute(
+                "SELECT status, COUNT(*) AS cnt FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status",
+                (broadcast_id,)
+            ).fetchall()
+        for r in rows:
+            stats[r['status']] = r['cnt']
+        stats['total'] = sum(stats.values())
+        return stats
+
+    def finish_broadcast(self, broadcast_id: int, status: str = 'done') -> None:
+        with self._conn() as c:
+            c.execute(
+                "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ?",
+                (status, datetime.now(pytz.utc), broadcast_id)
+            )
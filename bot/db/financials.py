@@ -100,7 +100,7 @@ class FinancialsDB(DatabaseManager):
 
     def get_user_latest_plan_price(self, uuid_id: int) -> Optional[int]:
         """قیمت آخرین پلن کاربر را با مقایسه حجم فعلی او با پلن‌ها تخمین می‌زند."""
-        from ..utils import load_service_plans, parse_volume_string
+        from ..catalog import get_plan_catalog
 
         with self._conn() as conn:
             uuid_row = conn.execute("SELECT uuid FROM user_uuids WHERE id = ?", (uuid_id,)).fetchone()
@@ -111,24 +111,8 @@ class FinancialsDB(DatabaseManager):
         if not user_info: return None
 
         current_limit_gb = user_info.get('usage_limit_GB', -1)
-        all_plans = load_service_plans()
-
-        for plan in all_plans:
-            plan_total_volume = 0
-            if plan.get('type') == 'combined':
-                vol_de = parse_volume_string(plan.get('volume_de', '0'))
-                vol_fr = parse_volume_string(plan.get('volume_fr', '0'))
-                plan_total_volume = vol_de + vol_fr
-            else:
-                volume_keys = ['volume_de', 'volume_fr', 'volume_tr', 'volume_us', 'volume_ro']
-                for key in volume_keys:
-                    if key in plan:
-                        plan_total_volume = parse_volume_string(plan.get(key, '0'))
-                        break
-            
-            if plan_total_volume == int(current_limit_gb):
-                return plan.get('price')
-        return None
+        plan = get_plan_catalog().by_limit_gb.get(int(current_limit_gb))
+        return plan.price if plan else None
 
     def get_total_payments_in_range(self, start_date: datetime, end_date: datetime) -> int:
         """تعداد کل پرداخت‌ها در یک بازه زمانی مشخص را برمی‌گرداند."""
@@ -0,0 +1,614 @@
+# bot/db/migrations.py
+"""
+مهاجرت‌های نسخه‌دار اسکیمای دیتابیس.
+نسخه اسکیمای هر فایل دیتابیس در PRAGMA user_version نگه داشته می‌شود. هر مهاجرت فقط یک بار و به ترتیب، در یک
+تراکنش BEGIN IMMEDIATE اجرا می‌شود؛ پروسس‌هایی که همزمان بالا می‌آیند (ربات و ورکرهای وب‌اپ) پشت قفل نوشتن SQLite
+منتظر می‌مانند و مهاجرتی را که پروسس دیگر اجرا کرده دوباره اجرا نمی‌کنند.
+برای تغییر اسکیما یک مهاجرت جدید به انتهای MIGRATIONS اضافه کنید و مهاجرت‌های قبلی را ویرایش نکنید.
+"""
+import logging
+import sqlite3
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _cache_version_queries(table: str) -> List[str]:
+    """تریگرهایی که با هر تغییر جدول (از هر پروسسی) شمارنده نسخه آن را در cache_versions بالا می‌برند."""
+    queries = [f"INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('{table}', 0);"]
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        queries.append(
+            f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version AFTER {event} ON {table} "
+            f"BEGIN UPDATE cache_versions SET version = version + 1 WHERE name = '{table}'; END;"
+        )
+    return queries
+
+
+def _migration_001_baseline(conn: sqlite3.Connection) -> None:
+    """
+    اسکیمای پایه (همه جداول، ستون‌های اضافه شده، تریگرها و ایندکس‌های قبل از سیستم مهاجرت).
+    همه دستورها IF NOT EXISTS هستند تا روی دیتابیس‌های قدیمی‌تر که نسخه ندارند (user_version = 0) هم اجرا شوند.
+    """
+    tables_queries = [
+        # 1. جدول کاربران
+        """CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            birthday DATE,
+            daily_reports INTEGER DEFAULT 1,
+            expiry_warnings INTEGER DEFAULT 1,
+            data_warning_de INTEGER DEFAULT 1,
+            data_warning_fr INTEGER DEFAULT 1,
+            data_warning_tr INTEGER DEFAULT 1,
+            data_warning_us INTEGER DEFAULT 1,
+            data_warning_nl INTEGER DEFAULT 1,
+            data_warning_al INTEGER DEFAULT 1,
+            data_warning_ro INTEGER DEFAULT 1,
+            data_warning_supp INTEGER DEFAULT 1,
+            show_info_config INTEGER DEFAULT 1,
+            admin_note TEXT,
+            lang_code TEXT,
+            last_checkin DATE,
+            streak_count INTEGER DEFAULT 0,
+            weekly_reports INTEGER DEFAULT 1,
+            monthly_reports INTEGER DEFAULT 1,
+            auto_delete_reports INTEGER DEFAULT 0,
+            referral_code TEXT,
+            referred_by_user_id INTEGER,
+            referral_reward_applied INTEGER DEFAULT 0,
+            achievement_points INTEGER DEFAULT 0,
+            achievement_alerts INTEGER DEFAULT 1,
+            promotional_alerts INTEGER DEFAULT 1,
+            wallet_balance REAL DEFAULT 0.0,
+            auto_renew INTEGER DEFAULT 0
+        );""",
+
+        # 2. جدول کانفیگ‌ها
+        """CREATE TABLE IF NOT EXISTS user_uuids (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            uuid TEXT,
+            name TEXT,
+            is_active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP,
+            first_connection_time TIMESTAMP,
+            welcome_message_sent INTEGER DEFAULT 0,
+            renewal_reminder_sent INTEGER DEFAULT 0,
+            is_vip INTEGER DEFAULT 0,
+            has_access_ir INTEGER DEFAULT 0,
+            has_access_de INTEGER DEFAULT 1,
+            has_access_fr INTEGER DEFAULT 0,
+            has_access_tr INTEGER DEFAULT 0,
+            has_access_us INTEGER DEFAULT 0,
+            has_access_al INTEGER DEFAULT 0,
+            has_access_nl INTEGER DEFAULT 0,
+            has_access_ro INTEGER DEFAULT 0,
+            has_access_supp INTEGER DEFAULT 0,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        );""",
+
+        # 3. جدول اسنپ‌شات‌های مصرف
+        """CREATE TABLE IF NOT EXISTS usage_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid_id INTEGER,
+            hiddify_usage_gb REAL DEFAULT 0,
+            marzban_usage_gb REAL DEFAULT 0,
+            taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(uuid_id) REFERENCES user_uuids(id) ON DELETE CASCADE
+        );""",
+
+        # 4. پیام‌های زمان‌بندی شده
+        """CREATE TABLE IF NOT EXISTS scheduled_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_type TEXT,
+            chat_id INTEGER,
+            message_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 5. لاگ هشدارها
+        """CREATE TABLE IF NOT EXISTS warning_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid_id INTEGER,
+            warning_type TEXT,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 6. پرداخت‌ها
+        """CREATE TABLE IF NOT EXISTS payments (
+            payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid_id INTEGER,
+            payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 7. قالب‌های کانفیگ
+        """CREATE TABLE IF NOT EXISTS config_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            template_str TEXT,
+            is_active INTEGER DEFAULT 1,
+            is_special INTEGER DEFAULT 0,
+            is_random_pool INTEGER DEFAULT 0,
+            server_type TEXT DEFAULT 'none',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 8. کانفیگ‌های تولید شده
+        """CREATE TABLE IF NOT EXISTS user_generated_configs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_uuid_id INTEGER,
+            template_id INTEGER,
+            generated_uuid TEXT
+        );""",
+
+        # 9. نگاشت مرزبان
+        """CREATE TABLE IF NOT EXISTS marzban_mapping (
+            hiddify_uuid TEXT,
+            marzban_username TEXT
+        );""",
+
+        # 10. توکن‌های ورود
+        """CREATE TABLE IF NOT EXISTS login_tokens (
+            token TEXT PRIMARY KEY,
+            uuid TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 11. گزارش‌های ارسال شده
+        """CREATE TABLE IF NOT EXISTS sent_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            message_id INTEGER,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 12. دستگاه‌های کاربر
+        """CREATE TABLE IF NOT EXISTS client_user_agents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid_id INTEGER,
+            user_agent TEXT,
+            client TEXT,
+            os TEXT,
+            version TEXT,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 13. پنل‌ها
+        """CREATE TABLE IF NOT EXISTS panels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            panel_type TEXT,
+            api_url TEXT,
+            api_token1 TEXT,
+            api_token2 TEXT,
+            is_active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 14. انتقال ترافیک
+        """CREATE TABLE IF NOT EXISTS traffic_transfers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_uuid_id INTEGER,
+            receiver_uuid_id INTEGER,
+            panel_type TEXT,
+            amount_gb REAL,
+            transferred_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 15. دستاوردهای کاربر (جدید)
+        """CREATE TABLE IF NOT EXISTS user_achievements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            badge_code TEXT,
+            awarded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 16. لاگ خرید فروشگاه
+        """CREATE TABLE IF NOT EXISTS achievement_shop_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            item_key TEXT,
+            cost INTEGER,
+            purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 17. لاگ هدیه تولد
+        """CREATE TABLE IF NOT EXISTS birthday_gift_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            gift_year INTEGER,
+            given_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 18. لاگ هدیه سالگرد
+        """CREATE TABLE IF NOT EXISTS anniversary_gift_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            gift_year INTEGER,
+            given_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 19. تراکنش‌های کیف پول (اصلی)
+        """CREATE TABLE IF NOT EXISTS wallet_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            type TEXT,
+            description TEXT,
+            transaction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        );""",
+
+        # 20. درخواست‌های شارژ
+        """CREATE TABLE IF NOT EXISTS charge_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            message_id INTEGER,
+            request_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_pending INTEGER DEFAULT 1,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        );""",
+
+        # 21. انتقال‌های کیف پول
+        """CREATE TABLE IF NOT EXISTS wallet_transfers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_user_id INTEGER,
+            receiver_user_id INTEGER,
+            amount REAL,
+            transferred_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 22. لاگ تمدید خودکار
+        """CREATE TABLE IF NOT EXISTS auto_renewal_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            uuid_id INTEGER,
+            plan_price REAL,
+            renewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 23. بلیط‌های قرعه‌کشی
+        """CREATE TABLE IF NOT EXISTS lottery_tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 24. اعلان‌ها
+        """CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            title TEXT,
+            message TEXT,
+            category TEXT DEFAULT 'info',
+            is_read INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        );""",
+
+        # 25. لاگ قهرمان هفتگی
+        """CREATE TABLE IF NOT EXISTS weekly_champion_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            win_date DATE
+        );""",
+
+        # 26. درخواست‌های دستاورد
+        """CREATE TABLE IF NOT EXISTS achievement_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            badge_code TEXT,
+            status TEXT DEFAULT 'pending',
+            requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            reviewed_by INTEGER,
+            reviewed_at TIMESTAMP
+        );""",
+
+        # 27. هزینه‌های ماهانه
+        """CREATE TABLE IF NOT EXISTS monthly_costs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            year INTEGER,
+            month INTEGER,
+            cost REAL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""",
+
+        # 28. بازخورد کاربران
+        """CREATE TABLE IF NOT EXISTS user_feedback (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            rating INTEGER,
+            comment TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        );""",
+
+        # 29. تیکت‌های پشتیبانی
+        """CREATE TABLE IF NOT EXISTS support_tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            status TEXT DEFAULT 'open',
+            initial_admin_message_id INTEGER,
+            last_message_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(user_id) ON DELETE CASCADE
+        );""",
+
+        # 30. خلاصه مصرف روزانه هر UUID (تاریخ به وقت تهران)، از روی usage_snapshots ساخته می‌شود
+        """CREATE TABLE IF NOT EXISTS daily_usage (
+            uuid_id INTEGER NOT NULL,
+            usage_date TEXT NOT NULL,
+            hiddify_gb REAL DEFAULT 0,
+            marzban_gb REAL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (uuid_id, usage_date),
+            FOREIGN KEY(uuid_id) REFERENCES user_uuids(id) ON DELETE CASCADE
+        );""",
+
+        # 31. پیام‌های همگانی که در پس‌زمینه ارسال می‌شوند
+        """CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            source_message_id INTEGER NOT NULL,
+            progress_message_id INTEGER,
+            target_group TEXT,
+            status TEXT DEFAULT 'running',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        );""",
+
+        # 32. وضعیت ارسال پیام همگانی برای هر گیرنده (pending / sent / failed)
+        """CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (broadcast_id, user_id),
+            FOREIGN KEY(broadcast_id) REFERENCES broadcasts(id) ON DELETE CASCADE
+        );""",
+
+        # 33. شمارنده تغییرات جداول؛ کش‌های حافظه‌ای (در ربات و وب‌اپ) با آن اعتبارسنجی می‌شوند
+        """CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        );""",
+
+        # 34. نسخه محلی لیست ترکیبی کاربران پنل‌ها برای لیست کاربران پنل ادمین (با وظیفه همگام‌سازی پر می‌شود)
+        """CREATE TABLE IF NOT EXISTS panel_users (
+            identifier TEXT PRIMARY KEY,
+            uuid TEXT,
+            name TEXT NOT NULL DEFAULT '',
+            username TEXT,
+            is_active INTEGER DEFAULT 0,
+            on_hiddify INTEGER DEFAULT 0,
+            on_marzban INTEGER DEFAULT 0,
+            current_usage_gb REAL DEFAULT 0,
+            usage_limit_gb REAL DEFAULT 0,
+            expire_days INTEGER,
+            last_online REAL,
+            breakdown TEXT,
+            synced_at TIMESTAMP
+        );""",
+
+        # 35. شناسه کاربرانی که ردیف users یا user_uuids آن‌ها تغییر کرده است (با تریگر پر می‌شود)؛
+        # هر پروسس با خواندن رکوردهای جدید، همان کاربران را از حافظه کاربران خود حذف می‌کند
+        """CREATE TABLE IF NOT EXISTS user_cache_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );"""
+    ]
+
+    # ستون‌هایی که بعد از ساخت اولیه به جداول اضافه شده‌اند؛ در دیتابیس‌های قدیمی‌تر با ALTER اضافه می‌شوند
+    # (شامل ستون‌هایی که قبلاً با اسکریپت دستی db_updater.py اضافه می‌شدند)
+    columns_to_add = [
+        ('users', 'data_warning_ro', 'INTEGER DEFAULT 1'),
+        ('users', 'referral_code', 'TEXT'),
+        ('users', 'referred_by_user_id', 'INTEGER'),
+        ('users', 'referral_reward_applied', 'INTEGER DEFAULT 0'),
+        ('user_uuids', 'has_access_ro', 'INTEGER DEFAULT 0'),
+        ('client_user_agents', 'client', 'TEXT'),
+        ('client_user_agents', 'os', 'TEXT'),
+        ('client_user_agents', 'version', 'TEXT'),
+    ]
+
+    # هر تغییری در جداول زیر (از هر پروسسی) شمارنده نسخه آن‌ها را در cache_versions یک واحد بالا می‌برد
+    triggers_queries = _cache_version_queries('config_templates')
+
+    # هر تغییر در ردیف کاربر یا UUIDهای او در user_cache_log ثبت می‌شود (حافظه کاربران در ربات و وب‌اپ)
+    triggers_queries += [
+        "CREATE TRIGGER IF NOT EXISTS trg_users_insert_cache AFTER INSERT ON users BEGIN "
+        "INSERT INTO user_cache_log (user_id) VALUES (new.user_id); END;",
+        "CREATE TRIGGER IF NOT EXISTS trg_users_update_cache AFTER UPDATE ON users BEGIN "
+        "INSERT INTO user_cache_log (user_id) SELECT old.user_id UNION SELECT new.user_id; END;",
+        "CREATE TRIGGER IF NOT EXISTS trg_users_delete_cache AFTER DELETE ON users BEGIN "
+        "INSERT INTO user_cache_log (user_id) VALUES (old.user_id); END;",
+        "CREATE TRIGGER IF NOT EXISTS trg_user_uuids_insert_cache AFTER INSERT ON user_uuids BEGIN "
+        "INSERT INTO user_cache_log (user_id) VALUES (new.user_id); END;",
+        "CREATE TRIGGER IF NOT EXISTS trg_user_uuids_update_cache AFTER UPDATE ON user_uuids BEGIN "
+        "INSERT INTO user_cache_log (user_id) SELECT old.user_id UNION SELECT new.user_id; END;",
+        "CREATE TRIGGER IF NOT EXISTS trg_user_uuids_delete_cache AFTER DELETE ON user_uuids BEGIN "
+        "INSERT INTO user_cache_log (user_id) VALUES (old.user_id); END;",
+    ]
+
+    # ایندکس جستجوی متنی (trigram) روی نام، UUID و نام کاربری مرزبان کاربران panel_users؛
+    # با تریگر همگام می‌ماند (الگوی external content در FTS5)
+    fts_table_query = """CREATE VIRTUAL TABLE IF NOT EXISTS panel_users_fts USING fts5(
+        name, uuid, username, content='panel_users', content_rowid='rowid', tokenize='trigram'
+    );"""
+    fts_triggers_queries = [
+        "CREATE TRIGGER IF NOT EXISTS trg_panel_users_fts_insert AFTER INSERT ON panel_users BEGIN "
+        "INSERT INTO panel_users_fts (rowid, name, uuid, username) VALUES (new.rowid, new.name, new.uuid, new.username); END;",
+        "CREATE TRIGGER IF NOT EXISTS trg_panel_users_fts_delete AFTER DELETE ON panel_users BEGIN "
+        "INSERT INTO panel_users_fts (panel_users_fts, rowid, name, uuid, username) VALUES ('delete', old.rowid, old.name, old.uuid, old.username); END;",
+        "CREATE TRIGGER IF NOT EXISTS trg_panel_users_fts_update AFTER UPDATE OF name, uuid, username ON panel_users BEGIN "
+        "INSERT INTO panel_users_fts (panel_users_fts, rowid, name, uuid, username) VALUES ('delete', old.rowid, old.name, old.uuid, old.username); "
+        "INSERT INTO panel_users_fts (rowid, name, uuid, username) VALUES (new.rowid, new.name, new.uuid, new.username); END;",
+    ]
+
+    # ایندکس‌های ضروری
+    indices_queries = [
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_referral_code ON users(referral_code);",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_user_uuids_uuid_user ON user_uuids(user_id, uuid);",
+        "CREATE INDEX IF NOT EXISTS idx_user_uuids_uuid ON user_uuids(uuid);",
+        "CREATE INDEX IF NOT EXISTS idx_user_uuids_user_id ON user_uuids(user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_usage_snapshots_uuid_taken ON usage_snapshots(uuid_id, taken_at);",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_marzban_mapping_uuid ON marzban_mapping(hiddify_uuid);",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_marzban_mapping_username ON marzban_mapping(marzban_username);",
+        "CREATE INDEX IF NOT EXISTS idx_daily_usage_date ON daily_usage(usage_date);",
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status ON broadcast_recipients(broadcast_id, status);",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_client_user_agents_device ON client_user_agents(uuid_id, client, os);",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_warning_log_uuid_type ON warning_log(uuid_id, warning_type);",
+        "CREATE INDEX IF NOT EXISTS idx_warning_log_sent_at ON warning_log(sent_at);",
+        "CREATE INDEX IF NOT EXISTS idx_panel_users_name ON panel_users(name COLLATE NOCASE, identifier);",
+        "CREATE INDEX IF NOT EXISTS idx_panel_users_uuid ON panel_users(uuid);",
+        "CREATE INDEX IF NOT EXISTS idx_panel_users_last_online ON panel_users(last_online);",
+        "CREATE INDEX IF NOT EXISTS idx_panel_users_expire ON panel_users(expire_days);"
+    ]
+
+    for query in tables_queries:
+        conn.execute(query)
+
+    for table, column, definition in columns_to_add:
+        existing_columns = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in existing_columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition};")
+            logger.info(f"Added column '{column}' to table '{table}'.")
+
+    # ایندکس یکتای دستگاه‌ها به پر بودن ستون‌های client/os در رکوردهای قدیمی نیاز دارد
+    _backfill_user_agent_details(conn)
+    # log_warning روی (uuid_id, warning_type) upsert می‌کند؛ پیش از ساخت ایندکس یکتا فقط آخرین رکورد هر هشدار می‌ماند
+    conn.execute(
+        "DELETE FROM warning_log WHERE id NOT IN (SELECT MAX(id) FROM warning_log GROUP BY uuid_id, warning_type)"
+    )
+
+    for idx_query in indices_queries:
+        conn.execute(idx_query)
+
+    for trigger_query in triggers_queries:
+        conn.execute(trigger_query)
+
+    # تنها خطای قابل چشم‌پوشی: SQLite بدون FTS5/trigram کامپایل شده است؛ در این حالت جستجو با LIKE انجام می‌شود
+    # و تریگرها هم ساخته نمی‌شوند، چون بدون جدول مجازی هر نوشتن روی panel_users را خراب می‌کنند
+    try:
+        conn.execute(fts_table_query)
+    except sqlite3.OperationalError as e:
+        if 'fts5' not in str(e) and 'tokenizer' not in str(e):
+            raise
+        logger.warning(f"FTS5 trigram search is unavailable, panel user search falls back to LIKE: {e}")
+    else:
+        for trigger_query in fts_triggers_queries:
+            conn.execute(trigger_query)
+
+
+def _backfill_user_agent_details(conn: sqlite3.Connection) -> None:
+    """
+    رکوردهای قدیمی client_user_agents را یک بار پارس کرده و ستون‌های client/os/version را پر می‌کند؛
+    سپس از هر دستگاه (uuid_id, client, os) فقط جدیدترین رکورد را نگه می‌دارد.
+    """
+    from ..utils import parse_user_agent # Local import to avoid circular dependency
+    rows = conn.execute("SELECT id, user_agent FROM client_user_agents WHERE client IS NULL").fetchall()
+    if not rows:
+        return
+
+    updates, invalid_ids = [], []
+    for row in rows:
+        parsed = parse_user_agent(row['user_agent'])
+        if not parsed or not parsed.get('client'):
+            invalid_ids.append((row['id'],))
+        else:
+            updates.append((parsed['client'], parsed.get('os') or '', parsed.get('version'), row['id']))
+
+    conn.executemany("UPDATE client_user_agents SET client = ?, os = ?, version = ? WHERE id = ?", updates)
+    conn.executemany("DELETE FROM client_user_agents WHERE id = ?", invalid_ids)
+    conn.execute("""
+        DELETE FROM client_user_agents WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY uuid_id, client, os ORDER BY last_seen DESC, id DESC) AS rn
+                FROM client_user_agents
+            ) WHERE rn = 1
+        )
+    """)
+    logger.info(f"Backfilled client/os for {len(updates)} user agents ({len(invalid_ids)} unparsable rows removed).")
+
+
+def _migration_002_hot_query_indexes(conn: sqlite3.Connection) -> None:
+    """ایندکس‌های کوئری‌های پرتکرار (بررسی شده با check_query_plans.py)."""
+    for query in (
+        # تاریخچه و شمارش تراکنش‌های کیف پول هر کاربر (مرتب بر اساس تاریخ، فیلتر بر اساس نوع)
+        "CREATE INDEX IF NOT EXISTS idx_wallet_transactions_user_date ON wallet_transactions(user_id, transaction_date, type);",
+        # گزارش‌های مالی بر اساس نوع تراکنش
+        "CREATE INDEX IF NOT EXISTS idx_wallet_transactions_type_date ON wallet_transactions(type, transaction_date);",
+        "CREATE INDEX IF NOT EXISTS idx_charge_requests_user_message ON charge_requests(user_id, message_id);",
+        "CREATE INDEX IF NOT EXISTS idx_notifications_user_read ON notifications(user_id, is_read, created_at);",
+        "CREATE INDEX IF NOT EXISTS idx_payments_uuid_date ON payments(uuid_id, payment_date);",
+        "CREATE INDEX IF NOT EXISTS idx_payments_date ON payments(payment_date);",
+        "CREATE INDEX IF NOT EXISTS idx_user_achievements_user_badge ON user_achievements(user_id, badge_code);",
+        "CREATE INDEX IF NOT EXISTS idx_user_achievements_awarded ON user_achievements(awarded_at);",
+        "CREATE INDEX IF NOT EXISTS idx_sent_reports_sent_at ON sent_reports(sent_at);",
+        "CREATE INDEX IF NOT EXISTS idx_sent_reports_user ON sent_reports(user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_usage_snapshots_taken ON usage_snapshots(taken_at);",
+    ):
+        conn.execute(query)
+
+
+def _migration_003_auto_renew_indexes(conn: sqlite3.Connection) -> None:
+    """ایندکس‌های انتخاب کاربران تمدید خودکار و UUID اصلی هر کاربر."""
+    for query in (
+        # فقط کاربرانی که تمدید خودکار را فعال کرده‌اند (ایندکس جزئی)
+        "CREATE INDEX IF NOT EXISTS idx_users_auto_renew ON users(user_id) WHERE auto_renew = 1;",
+        # UUIDهای فعال هر کاربر به ترتیب ساخت (UserDB.uuids و UUID اصلی کاربر)
+        "CREATE INDEX IF NOT EXISTS idx_user_uuids_user_active_created ON user_uuids(user_id, is_active, created_at);",
+    ):
+        conn.execute(query)
+
+
+def _migration_004_marzban_mapping_version(conn: sqlite3.Connection) -> None:
+    """نسخه marzban_mapping در cache_versions تا ایندکس حافظه‌ای مپینگ در همه پروسس‌ها باطل شود."""
+    for query in _cache_version_queries('marzban_mapping'):
+        conn.execute(query)
+
+
+# (نسخه، توضیح، تابع مهاجرت)؛ نسخه‌ها پشت سر هم و از ۱ شروع می‌شوند
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "baseline schema", _migration_001_baseline),
+    (2, "hot query indexes", _migration_002_hot_query_indexes),
+    (3, "auto-renew indexes", _migration_003_auto_renew_indexes),
+    (4, "marzban mapping cache version", _migration_004_marzban_mapping_version),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(conn: sqlite3.Connection) -> int:
+    """مهاجرت‌های اعمال نشده را به ترتیب اجرا کرده و نسخه نهایی اسکیما را برمی‌گرداند."""
+    if schema_version(conn) >= LATEST_VERSION:
+        return LATEST_VERSION
+    if conn.in_transaction:
+        conn.commit()
+
+    for version, description, migrate in MIGRATIONS:
+        # قفل نوشتن پیش از بررسی نسخه گرفته می‌شود تا دو پروسس یک مهاجرت را همزمان اجرا نکنند
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.critical(f"DB MIGRATION: Migration {version} ({description}) failed and was rolled back: {e}", exc_info=True)
+            raise
+        logger.info(f"DB MIGRATION: Applied migration {version} ({description}).")
+    return schema_version(conn)
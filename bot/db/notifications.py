@@ -41,6 +41,42 @@ class NotificationsDB(DatabaseManager):
             ).fetchone()
             return row is not None
 
+    def get_recent_warnings(self, hours: int) -> Dict[tuple, float]:
+        """
+        تمام هشدارهای ارسال شده در چند ساعت گذشته را با یک کوئری برمی‌گرداند:
+        {(uuid_id, warning_type): زمان ارسال به صورت epoch}؛ برای بررسی هشدارهای تکراری در حافظه.
+        """
+        time_ago = datetime.now(pytz.utc) - timedelta(hours=hours)
+        with self._conn() as c:
+            rows = c.execute(
+                "SELECT uuid_id, warning_type, CAST(strftime('%s', sent_at) AS INTEGER) AS sent_ts FROM warning_log WHERE sent_at >= ?",
+                (time_ago,)
+            ).fetchall()
+        recent = {}
+        for r in rows:
+            key = (r['uuid_id'], r['warning_type'])
+            recent[key] = max(recent.get(key, 0), r['sent_ts'] or 0)
+        return recent
+
+    def save_warning_batch(self, warning_logs: List[tuple], notifications: List[tuple],
+                           welcome_sent_ids: List[int] = (), renewal_sent_ids: List[int] = ()) -> None:
+        """
+        نتیجه یک اجرای بررسی هشدارها را در یک تراکنش ذخیره می‌کند.
+        warning_logs: (uuid_id, warning_type) و notifications: (user_id, title, message, category).
+        """
+        if not (warning_logs or notifications or welcome_sent_ids or renewal_sent_ids):
+            return
+        now = datetime.now(pytz.utc)
+        with self._conn() as c:
+            c.executemany(
+                "INSERT INTO warning_log (uuid_id, warning_type, sent_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(uuid_id, warning_type) DO UPDATE SET sent_at=excluded.sent_at",
+                ((uuid_id, warning_type, now) for uuid_id, warning_type in warning_logs)
+            )
+            c.executemany("INSERT INTO notifications (user_id, title, message, category) VALUES (?, ?, ?, ?)", notifications)
+            c.executemany("UPDATE user_uuids SET welcome_message_sent = 1 WHERE id = ?", ((i,) for i in welcome_sent_ids))
+            c.executemany("UPDATE user_uuids SET renewal_reminder_sent = 1 WHERE id = ?", ((i,) for i in renewal_sent_ids))
+
     def get_sent_warnings_since_midnight(self) -> List[Dict[str, Any]]:
         """
         گزارشی از تمام هشدارهایی که از نیمه‌شب امروز (به وقت تهران) ارسال شده‌اند را برمی‌گرداند.
@@ -73,6 +109,13 @@ class NotificationsDB(DatabaseManager):
                 (user_id, message_id)
             )
 
+    def add_sent_reports(self, records: List[tuple]) -> None:
+        """چند پیام گزارش ارسال شده را یکجا ثبت می‌کند. هر مورد: (user_id, message_id)."""
+        if not records:
+            return
+        with self._conn() as c:
+            c.executemany("INSERT INTO sent_reports (user_id, message_id) VALUES (?, ?)", records)
+
     def get_sent_reports(self, user_id: int) -> List[Dict[str, Any]]:
         """
         لیست تمام گزارش‌های ارسال شده قبلی برای یک کاربر را برمی‌گرداند.
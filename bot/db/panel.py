@@ -16,18 +16,24 @@ class PanelDB(DatabaseManager):
 
     # --- توابع مربوط به مدیریت پنل‌ها (Panels) ---
 
+    def _invalidate_panel_handlers(self, panel_id: Optional[int] = None) -> None:
+        """handler های ذخیره شده پنل‌ها را پس از تغییر جدول panels باطل می‌کند."""
+        from ..combined_handler import invalidate_panel_handlers  # Local import to avoid circular dependency
+        invalidate_panel_handlers(panel_id)
+
     def add_panel(self, name: str, panel_type: str, api_url: str, token1: str, token2: Optional[str] = None) -> bool:
         """یک پنل جدید به دیتابیس اضافه می‌کند."""
         with self._conn() as c:
             try:
-                c.execute(
+                cursor = c.execute(
                     "INSERT INTO panels (name, panel_type, api_url, api_token1, api_token2) VALUES (?, ?, ?, ?, ?)",
                     (name, panel_type, api_url, token1, token2)
                 )
-                return True
             except sqlite3.IntegrityError:
                 logger.warning(f"Attempted to add a panel with a duplicate name: {name}")
                 return False
+        self._invalidate_panel_handlers(cursor.lastrowid)
+        return True
 
     def get_all_panels(self) -> List[Dict[str, Any]]:
         """تمام پنل‌های ثبت شده را از دیتابیس برمی‌گرداند."""
@@ -45,13 +51,17 @@ class PanelDB(DatabaseManager):
         """یک پنل را با شناسه آن حذف می‌کند."""
         with self._conn() as c:
             cursor = c.execute("DELETE FROM panels WHERE id = ?", (panel_id,))
-            return cursor.rowcount > 0
+            deleted = cursor.rowcount > 0
+        self._invalidate_panel_handlers(panel_id)
+        return deleted
 
     def toggle_panel_status(self, panel_id: int) -> bool:
         """وضعیت فعال/غیرفعال یک پنل را تغییر می‌دهد."""
         with self._conn() as c:
             cursor = c.execute("UPDATE panels SET is_active = 1 - is_active WHERE id = ?", (panel_id,))
-            return cursor.rowcount > 0
+            toggled = cursor.rowcount > 0
+        self._invalidate_panel_handlers(panel_id)
+        return toggled
 
     def get_panel_by_id(self, panel_id: int) -> Optional[Dict[str, Any]]:
         """جزئیات یک پنل را با شناسه آن بازیابی می‌کند."""
@@ -70,10 +80,14 @@ class PanelDB(DatabaseManager):
         with self._conn() as c:
             try:
                 cursor = c.execute("UPDATE panels SET name = ? WHERE id = ?", (new_name, panel_id))
-                return cursor.rowcount > 0
             except sqlite3.IntegrityError:
                 logger.warning(f"Attempted to rename panel {panel_id} to an existing name: {new_name}")
                 return False
+        renamed = cursor.rowcount > 0
+        if renamed:
+            # breakdown اسنپ‌شات کاربران با نام پنل کلید خورده است
+            self._invalidate_panel_handlers(panel_id)
+        return renamed
 
     # --- توابع مربوط به مپینگ مرزبان (Marzban Mapping) ---
 
@@ -82,10 +96,11 @@ class PanelDB(DatabaseManager):
         with self._conn() as c:
             try:
                 c.execute("INSERT OR REPLACE INTO marzban_mapping (hiddify_uuid, marzban_username) VALUES (?, ?)", (hiddify_uuid.lower(), marzban_username))
-                return True
             except sqlite3.IntegrityError:
                 logger.warning(f"Marzban username '{marzban_username}' might already be mapped.")
                 return False
+        self.invalidate_marzban_mapping_index()
+        return True
 
     def get_marzban_username_by_uuid(self, hiddify_uuid: str) -> Optional[str]:
         """یوزرنیم مرزبان را با استفاده از UUID هیدیفای پیدا می‌کند."""
@@ -105,11 +120,40 @@ class PanelDB(DatabaseManager):
             rows = c.execute("SELECT hiddify_uuid, marzban_username FROM marzban_mapping ORDER BY marzban_username").fetchall()
             return [dict(r) for r in rows]
 
+    def get_marzban_mapping_index(self, refresh: bool = False) -> Dict[str, Dict[str, str]]:
+        """
+        کل جدول marzban_mapping را به صورت یک ایندکس دوطرفه در حافظه برمی‌گرداند:
+        {'by_username': {username: uuid}, 'by_uuid': {uuid: username}}
+        در هر فراخوانی فقط شمارنده تغییرات marzban_mapping خوانده می‌شود؛ اگر پروسس دیگری (ربات یا وب‌اپ)
+        مپینگ را تغییر داده باشد، ایندکس از نو ساخته می‌شود.
+        """
+        with self._conn() as c:
+            row = c.execute("SELECT version FROM cache_versions WHERE name = 'marzban_mapping'").fetchone()
+            version = row['version'] if row else None
+            index = self._marzban_mapping_index
+            if refresh or index is None or version is None or index['version'] != version:
+                by_username, by_uuid = {}, {}
+                for row in c.execute("SELECT hiddify_uuid, marzban_username FROM marzban_mapping"):
+                    if not row['hiddify_uuid'] or not row['marzban_username']:
+                        continue
+                    by_username[row['marzban_username']] = row['hiddify_uuid']
+                    by_uuid[row['hiddify_uuid'].lower()] = row['marzban_username']
+
+                index = {'by_username': by_username, 'by_uuid': by_uuid, 'version': version}
+                self._marzban_mapping_index = index
+        return index
+
+    def invalidate_marzban_mapping_index(self) -> None:
+        """ایندکس حافظه‌ای مپینگ مرزبان را باطل می‌کند تا در استفاده بعدی از دیتابیس خوانده شود."""
+        self._marzban_mapping_index = None
+
     def delete_marzban_mapping(self, hiddify_uuid: str) -> bool:
         """یک ارتباط را با استفاده از UUID هیدیفای حذف می‌کند."""
         with self._conn() as c:
             res = c.execute("DELETE FROM marzban_mapping WHERE hiddify_uuid = ?", (hiddify_uuid.lower(),))
-            return res.rowcount > 0
+            deleted = res.rowcount > 0
+        self.invalidate_marzban_mapping_index()
+        return deleted
 
     # --- توابع مربوط به قالب‌های کانفیگ (Config Templates) ---
     def add_batch_templates(self, templates: list[str]) -> int:
@@ -161,13 +205,15 @@ class PanelDB(DatabaseManager):
                 "INSERT INTO config_templates (template_str, server_type) VALUES (?, ?)", 
                 data_to_insert
             )
-            return cursor.rowcount
+        self.invalidate_template_index()
+        return cursor.rowcount
 
     def update_template(self, template_id: int, new_template_str: str) -> bool:
         """محتوای یک قالب کانفیگ را به‌روزرسانی می‌کند."""
         with self._conn() as c:
             cursor = c.execute("UPDATE config_templates SET template_str = ? WHERE id = ?", (new_template_str, template_id))
-            return cursor.rowcount > 0
+        self.invalidate_template_index()
+        return cursor.rowcount > 0
 
     def get_all_config_templates(self) -> list[dict]:
         """تمام قالب‌های کانفیگ را برمی‌گرداند."""
@@ -181,26 +227,51 @@ class PanelDB(DatabaseManager):
             rows = c.execute("SELECT * FROM config_templates WHERE is_active = 1 ORDER BY id ASC").fetchall()
             return [dict(r) for r in rows]
 
+    def get_template_index(self):
+        """
+        ایندکس حافظه‌ای قالب‌های فعال (TemplateIndex) را برمی‌گرداند.
+        در هر فراخوانی فقط شمارنده تغییرات config_templates خوانده می‌شود؛ اگر پروسس دیگری (ربات یا وب‌اپ)
+        قالب‌ها را تغییر داده باشد، ایندکس از نو ساخته می‌شود.
+        """
+        from ..template_index import TemplateIndex
+        with self._conn() as c:
+            row = c.execute("SELECT version FROM cache_versions WHERE name = 'config_templates'").fetchone()
+            version = row['version'] if row else None
+            index = self._template_index
+            if index is None or version is None or index.version != version:
+                rows = c.execute("SELECT id, template_str, server_type, is_special, is_random_pool FROM config_templates WHERE is_active = 1 ORDER BY id ASC").fetchall()
+                index = TemplateIndex([dict(r) for r in rows], version)
+                self._template_index = index
+        return index
+
+    def invalidate_template_index(self) -> None:
+        """ایندکس قالب‌ها را باطل می‌کند تا در استفاده بعدی از دیتابیس ساخته شود."""
+        self._template_index = None
+
     def toggle_template_status(self, template_id: int):
         """وضعیت فعال/غیرفعال یک قالب را تغییر می‌دهد."""
         with self._conn() as c:
             c.execute("UPDATE config_templates SET is_active = 1 - is_active WHERE id = ?", (template_id,))
+        self.invalidate_template_index()
 
     def delete_template(self, template_id: int):
         """یک قالب کانفیگ را حذف می‌کند."""
         with self._conn() as c:
             c.execute("DELETE FROM config_templates WHERE id = ?", (template_id,))
+        self.invalidate_template_index()
 
     def toggle_template_special(self, template_id: int):
         """وضعیت "ویژه" بودن یک قالب را تغییر می‌دهد."""
         with self._conn() as c:
             c.execute("UPDATE config_templates SET is_special = 1 - is_special WHERE id = ?", (template_id,))
+        self.invalidate_template_index()
     
     def toggle_template_random_pool(self, template_id: int) -> bool:
         """وضعیت عضویت یک قالب در استخر تصادفی را تغییر می‌دهد."""
         with self._conn() as c:
             cursor = c.execute("UPDATE config_templates SET is_random_pool = 1 - is_random_pool WHERE id = ?", (template_id,))
-            return cursor.rowcount > 0
+        self.invalidate_template_index()
+        return cursor.rowcount > 0
 
     def set_template_server_type(self, template_id: int, server_type: str):
         """نوع سرور یک قالب را تنظیم می‌کند."""
@@ -208,12 +279,14 @@ class PanelDB(DatabaseManager):
             return
         with self._conn() as c:
             c.execute("UPDATE config_templates SET server_type = ? WHERE id = ?", (server_type, template_id))
+        self.invalidate_template_index()
 
     def reset_templates_table(self):
         """تمام قالب‌ها را حذف و شمارنده ID را ریست می‌کند."""
         with self._conn() as c:
             c.execute("DELETE FROM config_templates;")
             c.execute("UPDATE sqlite_sequence SET seq = 0 WHERE name = 'config_templates';")
+        self.invalidate_template_index()
         logger.info("Config templates table has been reset.")
 
     # --- توابع مربوط به قالب‌های دسترسی ---
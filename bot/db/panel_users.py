@@ -0,0 +1,190 @@
+# bot/db/panel_users.py
+
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+import pytz
+
+from .base import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+# فیلدهایی از داده هر پنل که برای نمایش جزئیات کاربر در پنل ادمین نگه داشته می‌شوند
+_BREAKDOWN_FIELDS = ('uuid', 'username', 'name', 'is_active', 'current_usage_GB', 'usage_limit_GB', 'expire')
+# کوتاه‌ترین عبارتی که با ایندکس trigram (FTS5) جستجو می‌شود؛ عبارت‌های کوتاه‌تر با LIKE بررسی می‌شوند
+_FTS_MIN_QUERY_LENGTH = 3
+
+_UPSERT_QUERY = """
+    INSERT INTO panel_users (identifier, uuid, name, username, is_active, on_hiddify, on_marzban,
+                             current_usage_gb, usage_limit_gb, expire_days, last_online, breakdown, synced_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(identifier) DO UPDATE SET
+        uuid = excluded.uuid, name = excluded.name, username = excluded.username,
+        is_active = excluded.is_active, on_hiddify = excluded.on_hiddify, on_marzban = excluded.on_marzban,
+        current_usage_gb = excluded.current_usage_gb, usage_limit_gb = excluded.usage_limit_gb,
+        expire_days = excluded.expire_days, last_online = excluded.last_online,
+        breakdown = excluded.breakdown, synced_at = excluded.synced_at
+"""
+
+
+def panel_user_key(user: Dict[str, Any]) -> Optional[str]:
+    """کلید کاربر ترکیبی در جدول panel_users؛ همان کلیدی که combined_handler برای ادغام پنل‌ها استفاده می‌کند."""
+    if user.get('uuid'):
+        return user['uuid']
+    for panel in (user.get('breakdown') or {}).values():
+        username = (panel.get('data') or {}).get('username')
+        if panel.get('type') == 'marzban' and username:
+            return f"marzban_{username}"
+    return None
+
+
+def _panel_user_row(user: Dict[str, Any], synced_at: datetime) -> Optional[tuple]:
+    identifier = panel_user_key(user)
+    if not identifier:
+        return None
+
+    breakdown, username = {}, None
+    on_hiddify = on_marzban = False
+    for panel_name, panel in (user.get('breakdown') or {}).items():
+        panel_data = panel.get('data') or {}
+        breakdown[panel_name] = {'type': panel.get('type'),
+                                 'data': {key: panel_data.get(key) for key in _BREAKDOWN_FIELDS if key in panel_data}}
+        if panel.get('type') == 'hiddify':
+            on_hiddify = True
+        elif panel.get('type') == 'marzban':
+            on_marzban = True
+            username = username or panel_data.get('username')
+
+    last_online = user.get('last_online')
+    return (
+        identifier, user.get('uuid'), user.get('name') or '', username,
+        int(bool(user.get('is_active'))), int(on_hiddify), int(on_marzban),
+        user.get('current_usage_GB', 0) or 0, user.get('usage_limit_GB', 0) or 0, user.get('expire'),
+        last_online.timestamp() if isinstance(last_online, datetime) else None,
+        json.dumps(breakdown, ensure_ascii=False), synced_at,
+    )
+
+
+def _fts_phrase(query: str) -> str:
+    # کل عبارت به صورت یک phrase جستجو می‌شود تا کاراکترهای خاص FTS (مثل - و *) مشکلی ایجاد نکنند
+    return '"' + query.replace('"', '""') + '"'
+
+
+def _like_pattern(query: str) -> str:
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+class PanelUsersDB(DatabaseManager):
+    """
+    کلاسی برای نگهداری نسخه محلی لیست ترکیبی کاربران پنل‌ها (panel_users).
+    این جدول توسط وظیفه همگام‌سازی پر می‌شود تا فیلتر، جستجو، مرتب‌سازی و صفحه‌بندی لیست کاربران
+    پنل ادمین بدون دریافت کل کاربران از پنل‌ها و در خود SQLite انجام شود.
+    """
+
+    def sync_panel_users(self, users: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        جدول panel_users را با لیست کامل کاربران (خروجی get_all_users_combined) همگام می‌کند؛
+        کاربرانی که دیگر در پنل‌ها نیستند حذف می‌شوند. خروجی: (تعداد ثبت/به‌روزرسانی شده، تعداد حذف شده).
+        """
+        synced_at = datetime.now(pytz.utc)
+        rows = {}
+        for user in users:
+            row = _panel_user_row(user, synced_at)
+            if row:
+                rows[row[0]] = row
+
+        with self._conn() as c:
+            existing = {r['identifier'] for r in c.execute("SELECT identifier FROM panel_users")}
+            removed = [(identifier,) for identifier in existing - rows.keys()]
+            c.executemany("DELETE FROM panel_users WHERE identifier = ?", removed)
+            c.executemany(_UPSERT_QUERY, rows.values())
+        return len(rows), len(removed)
+
+    def upsert_panel_user(self, user: Dict[str, Any]) -> None:
+        """اطلاعات یک کاربر ترکیبی را (پس از ساخت یا ویرایش از پنل ادمین) در panel_users به‌روز می‌کند."""
+        row = _panel_user_row(user, datetime.now(pytz.utc))
+        if row:
+            with self._conn() as c:
+                c.execute(_UPSERT_QUERY, row)
+
+    def delete_panel_user(self, identifier: str) -> None:
+        with self._conn() as c:
+            c.execute("DELETE FROM panel_users WHERE identifier = ? OR uuid = ?", (identifier, identifier))
+
+    def has_panel_users(self) -> bool:
+        """آیا جدول panel_users حداقل یک بار همگام شده است؟"""
+        with self._conn() as c:
+            return c.execute("SELECT 1 FROM panel_users LIMIT 1").fetchone() is not None
+
+    def _panel_users_fts_available(self) -> bool:
+        # اگر SQLite بدون FTS5/trigram کامپایل شده باشد، جدول مجازی ساخته نمی‌شود و جستجو با LIKE انجام می‌شود
+        if self._panel_users_fts is None:
+            with self._conn() as c:
+                self._panel_users_fts = c.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'panel_users_fts'"
+                ).fetchone() is not None
+        return self._panel_users_fts
+
+    def get_panel_users_page(self, search: str = '', panel: Optional[str] = None, status_filter: str = 'all',
+                             limit: int = 15, offset: int = 0,
+                             online_identifiers: Optional[Iterable[str]] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        یک صفحه از کاربران panel_users را به ترتیب نام برمی‌گرداند: (ردیف‌ها، تعداد کل نتایج).
+        panel: 'hiddify' یا 'marzban' | status_filter: all / active / online / expiring_soon
+        last_online این جدول فقط در هر همگام‌سازی به‌روز می‌شود؛ برای فیلتر online فراخوان باید کلید کاربران آنلاین
+        (panel_user_key) را از اسنپ‌شات زنده در online_identifiers بدهد.
+        تعداد پرداخت‌ها و وضعیت VIP فقط برای ردیف‌های همین صفحه خوانده می‌شود.
+        """
+        where, params = [], []
+        search = (search or '').strip()
+        if search:
+            if len(search) >= _FTS_MIN_QUERY_LENGTH and self._panel_users_fts_available():
+                where.append("pu.rowid IN (SELECT rowid FROM panel_users_fts WHERE panel_users_fts MATCH ?)")
+                params.append(_fts_phrase(search))
+            else:
+                pattern = _like_pattern(search)
+                where.append("(pu.name LIKE ? ESCAPE '\\' OR pu.uuid LIKE ? ESCAPE '\\' OR pu.username LIKE ? ESCAPE '\\')")
+                params.extend([pattern, pattern, pattern])
+        if panel == 'hiddify':
+            where.append("pu.on_hiddify = 1")
+        elif panel == 'marzban':
+            where.append("pu.on_marzban = 1")
+        if status_filter == 'active':
+            where.append("pu.is_active = 1")
+        elif status_filter == 'online':
+            where.append("pu.identifier IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(list(online_identifiers or ())))
+        elif status_filter == 'expiring_soon':
+            where.append("pu.expire_days BETWEEN 0 AND 7")
+
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        query = f"""
+            SELECT pu.*, uu.id AS uuid_id, COALESCE(uu.is_vip, 0) AS is_vip,
+                   (SELECT COUNT(*) FROM payments p WHERE p.uuid_id = uu.id) AS payment_count
+            FROM (
+                SELECT * FROM panel_users pu {where_sql}
+                ORDER BY pu.name COLLATE NOCASE, pu.identifier
+                LIMIT ? OFFSET ?
+            ) pu
+            LEFT JOIN user_uuids uu ON uu.id = (
+                SELECT MIN(id) FROM user_uuids WHERE uuid = pu.uuid AND is_active = 1
+            )
+            ORDER BY pu.name COLLATE NOCASE, pu.identifier
+        """
+        with self._conn() as c:
+            total = c.execute(f"SELECT COUNT(*) FROM panel_users pu {where_sql}", params).fetchone()[0]
+            rows = c.execute(query, params + [limit, offset]).fetchall()
+
+        users = []
+        for r in rows:
+            users.append({
+                'identifier': r['identifier'], 'uuid': r['uuid'], 'uuid_id': r['uuid_id'], 'name': r['name'],
+                'is_active': bool(r['is_active']), 'on_hiddify': bool(r['on_hiddify']), 'on_marzban': bool(r['on_marzban']),
+                'current_usage_GB': r['current_usage_gb'], 'usage_limit_GB': r['usage_limit_gb'], 'expire': r['expire_days'],
+                'last_online': datetime.fromtimestamp(r['last_online'], pytz.utc) if r['last_online'] is not None else None,
+                'breakdown': json.loads(r['breakdown']) if r['breakdown'] else {},
+                'is_vip': bool(r['is_vip']), 'payment_count': r['payment_count'],
+            })
+        return users, total
@@ -1,7 +1,7 @@
 # bot/db/usage.py
 
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Dict, List, Any, Optional
 import logging
 import pytz
@@ -11,6 +11,39 @@ from .base import DatabaseManager
 
 logger = logging.getLogger(__name__)
 
+_REFRESH_CHUNK_SIZE = 500
+
+# مصرف هر UUID از :since تا آخرین اسنپ‌شات؛ baseline آخرین اسنپ‌شات قبل از :since و در نبود آن اولین اسنپ‌شات
+# بعد از آن است (مثل get_all_daily_usage_since_midnight). اسنپ‌شات‌های بدون تغییر ثبت نمی‌شوند، پس بازه‌ای که
+# کاربر در آن مصرفی نداشته ممکن است هیچ اسنپ‌شاتی نداشته باشد. در صورت ریست شدن حجم، مقدار پایانی مصرف است.
+_WINDOW_USAGE_CTE = """
+    WITH picks AS (
+        SELECT uu.id, uu.name,
+            (SELECT s.id FROM usage_snapshots s WHERE s.uuid_id = uu.id AND s.taken_at < :since
+             ORDER BY s.taken_at DESC LIMIT 1) AS baseline_id,
+            (SELECT s.id FROM usage_snapshots s WHERE s.uuid_id = uu.id AND s.taken_at >= :since
+             ORDER BY s.taken_at ASC LIMIT 1) AS first_id,
+            (SELECT s.id FROM usage_snapshots s WHERE s.uuid_id = uu.id
+             ORDER BY s.taken_at DESC LIMIT 1) AS last_id
+        FROM user_uuids uu
+    ),
+    edges AS (
+        SELECT p.id AS uuid_id, p.name,
+            COALESCE(l.hiddify_usage_gb, 0) AS end_h, COALESCE(b.hiddify_usage_gb, f.hiddify_usage_gb, 0) AS start_h,
+            COALESCE(l.marzban_usage_gb, 0) AS end_m, COALESCE(b.marzban_usage_gb, f.marzban_usage_gb, 0) AS start_m
+        FROM picks p
+        JOIN usage_snapshots l ON l.id = p.last_id
+        LEFT JOIN usage_snapshots b ON b.id = p.baseline_id
+        LEFT JOIN usage_snapshots f ON f.id = p.first_id
+    ),
+    window_usage AS (
+        SELECT uuid_id, name,
+            MAX(0, CASE WHEN end_h >= start_h THEN end_h - start_h ELSE end_h END) AS h_usage,
+            MAX(0, CASE WHEN end_m >= start_m THEN end_m - start_m ELSE end_m END) AS m_usage
+        FROM edges
+    )
+"""
+
 
 class UsageDB(DatabaseManager):
     """
@@ -24,6 +57,221 @@ class UsageDB(DatabaseManager):
                 "INSERT INTO usage_snapshots (uuid_id, hiddify_usage_gb, marzban_usage_gb, taken_at) VALUES (?, ?, ?, ?)",
                 (uuid_id, hiddify_usage, marzban_usage, datetime.now(pytz.utc))
             )
+            self.refresh_daily_usage(uuid_id=uuid_id)
+
+    def add_usage_snapshots_bulk(self, rows: List[tuple]) -> int:
+        """
+        اسنپ‌شات مصرف چند کاربر را در یک تراکنش و با یک زمان مشترک ثبت می‌کند.
+        rows لیستی از (uuid_id, hiddify_usage, marzban_usage) است.
+        اگر آخرین اسنپ‌شات امروزِ یک کاربر همین مقادیر را داشته باشد، ردیف تکراری ثبت نمی‌شود؛
+        اولین اسنپ‌شات هر روز همیشه ثبت می‌شود تا baseline محاسبه مصرف روزانه از بین نرود.
+        تعداد ردیف‌های ثبت شده را برمی‌گرداند.
+        """
+        if not rows:
+            return 0
+
+        now_utc = datetime.now(pytz.utc)
+        tehran_tz = pytz.timezone("Asia/Tehran")
+        today_midnight_utc = datetime.now(tehran_tz).replace(hour=0, minute=0, second=0, microsecond=0).astimezone(pytz.utc)
+
+        with self._conn() as c:
+            last_today = {
+                r['uuid_id']: (r['hiddify_usage_gb'], r['marzban_usage_gb'])
+                for r in c.execute("""
+                    SELECT s.uuid_id, s.hiddify_usage_gb, s.marzban_usage_gb
+                    FROM usage_snapshots s
+                    JOIN (
+                        SELECT uuid_id, MAX(taken_at) AS last_taken
+                        FROM usage_snapshots WHERE taken_at >= ? GROUP BY uuid_id
+                    ) l ON s.uuid_id = l.uuid_id AND s.taken_at = l.last_taken
+                """, (today_midnight_utc,))
+            }
+
+            to_insert = [
+                (uuid_id, h_usage, m_usage, now_utc)
+                for uuid_id, h_usage, m_usage in rows
+                if last_today.get(uuid_id) != (h_usage, m_usage)
+            ]
+            if to_insert:
+                c.executemany(
+                    "INSERT INTO usage_snapshots (uuid_id, hiddify_usage_gb, marzban_usage_gb, taken_at) VALUES (?, ?, ?, ?)",
+                    to_insert
+                )
+                # خلاصه مصرف امروز فقط برای UUID های ثبت شده و در همان تراکنش به‌روز می‌شود
+                self.refresh_daily_usage(uuid_ids=[row[0] for row in to_insert])
+        return len(to_insert)
+
+    def refresh_daily_usage(self, day: Optional[date] = None, uuid_id: Optional[int] = None,
+                            uuid_ids: Optional[List[int]] = None) -> int:
+        """
+        ردیف‌های جدول daily_usage یک روز (تاریخ تهران، پیش‌فرض امروز) را از روی اسنپ‌شات‌ها بازسازی می‌کند.
+        مصرف روز = آخرین اسنپ‌شات تا پایان روز منهای آخرین اسنپ‌شات قبل از شروع روز
+        (در صورت ریست شدن حجم، خود مقدار پایانی). روزهای بدون مصرف ذخیره نمی‌شوند.
+        با uuid_id یا uuid_ids فقط همان UUID ها بازسازی می‌شوند. تعداد ردیف‌های نوشته شده را برمی‌گرداند.
+        """
+        if uuid_id is not None:
+            uuid_ids = [uuid_id]
+        if uuid_ids is not None:
+            uuid_ids = list(dict.fromkeys(uuid_ids))
+            written = 0
+            # محدودیت تعداد پارامترهای هر کوئری SQLite
+            for i in range(0, len(uuid_ids), _REFRESH_CHUNK_SIZE):
+                written += self._refresh_daily_usage(day, uuid_ids[i:i + _REFRESH_CHUNK_SIZE])
+            return written
+        return self._refresh_daily_usage(day, None)
+
+    def _refresh_daily_usage(self, day: Optional[date], uuid_ids: Optional[List[int]]) -> int:
+        tehran_tz = pytz.timezone("Asia/Tehran")
+        if day is None:
+            day = datetime.now(tehran_tz).date()
+        day_start_tehran = tehran_tz.localize(datetime(day.year, day.month, day.day))
+        params = {
+            "day": day.isoformat(),
+            "day_start": day_start_tehran.astimezone(pytz.utc),
+            "day_end": tehran_tz.normalize(day_start_tehran + timedelta(days=1)).astimezone(pytz.utc),
+            "now": datetime.now(pytz.utc),
+        }
+        uuid_filter = delete_filter = ""
+        if uuid_ids is not None:
+            placeholders = ", ".join(f":id{i}" for i in range(len(uuid_ids)))
+            params.update({f"id{i}": value for i, value in enumerate(uuid_ids)})
+            uuid_filter = f"WHERE uu.id IN ({placeholders})"
+            delete_filter = f"AND uuid_id IN ({placeholders})"
+
+        with self._conn() as c:
+            c.execute(f"DELETE FROM daily_usage WHERE usage_date = :day {delete_filter}", params)
+            cursor = c.execute(f"""
+                INSERT INTO daily_usage (uuid_id, usage_date, hiddify_gb, marzban_gb, updated_at)
+                SELECT id, :day, h_usage, m_usage, :now
+                FROM (
+                    SELECT p.id,
+                        MAX(0, CASE WHEN COALESCE(e.hiddify_usage_gb, 0) >= COALESCE(b.hiddify_usage_gb, 0)
+                            THEN COALESCE(e.hiddify_usage_gb, 0) - COALESCE(b.hiddify_usage_gb, 0)
+                            ELSE COALESCE(e.hiddify_usage_gb, 0) END) AS h_usage,
+                        MAX(0, CASE WHEN COALESCE(e.marzban_usage_gb, 0) >= COALESCE(b.marzban_usage_gb, 0)
+                            THEN COALESCE(e.marzban_usage_gb, 0) - COALESCE(b.marzban_usage_gb, 0)
+                            ELSE COALESCE(e.marzban_usage_gb, 0) END) AS m_usage
+                    FROM (
+                        SELECT uu.id,
+                            (SELECT s.id FROM usage_snapshots s WHERE s.uuid_id = uu.id AND s.taken_at < :day_start
+                             ORDER BY s.taken_at DESC LIMIT 1) AS baseline_id,
+                            (SELECT s.id FROM usage_snapshots s WHERE s.uuid_id = uu.id AND s.taken_at < :day_end
+                             ORDER BY s.taken_at DESC LIMIT 1) AS end_id
+                        FROM user_uuids uu
+                        {uuid_filter}
+                    ) p
+                    JOIN usage_snapshots e ON e.id = p.end_id
+                    LEFT JOIN usage_snapshots b ON b.id = p.baseline_id
+                )
+                WHERE h_usage > 0 OR m_usage > 0
+            """, params)
+            return cursor.rowcount
+
+    def _stream_daily_usage(self, first_day: date, last_day: date) -> Dict[tuple, tuple]:
+        """
+        مصرف روزانه تمام UUID ها در بازه [first_day, last_day] (تاریخ تهران) را با یک بار پیمایش
+        اسنپ‌شات‌های بازه محاسبه می‌کند: آخرین اسنپ‌شات هر روز با GROUP BY و مقدار روز قبل با LAG().
+        خروجی: {(uuid_id, 'YYYY-MM-DD'): (hiddify_gb, marzban_gb)} فقط برای روزهای دارای مصرف.
+        منطق هر روز همان refresh_daily_usage است. (ساعت تهران از ۱۴۰۱ تغییر ساعت ندارد، پس هر روز ۲۴ ساعت است.)
+        """
+        tehran_tz = pytz.timezone("Asia/Tehran")
+        window_start = tehran_tz.localize(datetime(first_day.year, first_day.month, first_day.day)).astimezone(pytz.utc)
+        window_end = tehran_tz.localize(datetime(last_day.year, last_day.month, last_day.day) + timedelta(days=1)).astimezone(pytz.utc)
+        params = {"window_start": window_start, "window_end": window_end}
+
+        baseline_query = """
+            SELECT s.uuid_id, s.hiddify_usage_gb, s.marzban_usage_gb
+            FROM user_uuids uu
+            JOIN usage_snapshots s ON s.id = (
+                SELECT id FROM usage_snapshots WHERE uuid_id = uu.id AND taken_at < :window_start
+                ORDER BY taken_at DESC LIMIT 1
+            )
+        """
+        # در SQLite ستون‌های کنار MAX(taken_at) از همان ردیف آخر هر روز خوانده می‌شوند
+        window_query = """
+            WITH day_end AS (
+                SELECT uuid_id,
+                       CAST(julianday(taken_at) - julianday(:window_start) AS INTEGER) AS day_idx,
+                       hiddify_usage_gb AS h_end, marzban_usage_gb AS m_end, MAX(taken_at)
+                FROM usage_snapshots
+                WHERE taken_at >= :window_start AND taken_at < :window_end
+                  AND uuid_id IN (SELECT id FROM user_uuids)
+                GROUP BY uuid_id, day_idx
+            )
+            SELECT uuid_id, day_idx, h_end, m_end,
+                   LAG(h_end) OVER w AS h_start, LAG(m_end) OVER w AS m_start, LAG(day_idx) OVER w AS prev_idx
+            FROM day_end
+            WINDOW w AS (PARTITION BY uuid_id ORDER BY day_idx)
+        """
+        result = {}
+        with self._conn() as c:
+            baselines = {
+                r['uuid_id']: (r['hiddify_usage_gb'] or 0.0, r['marzban_usage_gb'] or 0.0)
+                for r in c.execute(baseline_query, params)
+            }
+            for row in c.execute(window_query, params):
+                if row['prev_idx'] is not None:
+                    h_start, m_start = row['h_start'] or 0.0, row['m_start'] or 0.0
+                else:
+                    h_start, m_start = baselines.get(row['uuid_id'], (0.0, 0.0))
+                h_end, m_end = row['h_end'] or 0.0, row['m_end'] or 0.0
+                h_usage = max(0, h_end - h_start if h_end >= h_start else h_end)
+                m_usage = max(0, m_end - m_start if m_end >= m_start else m_end)
+                if h_usage > 0 or m_usage > 0:
+                    day = first_day + timedelta(days=row['day_idx'])
+                    result[(row['uuid_id'], day.isoformat())] = (h_usage, m_usage)
+        return result
+
+    def rebuild_daily_usage(self, since: Optional[date] = None) -> int:
+        """
+        ردیف‌های daily_usage را از روی اسنپ‌شات‌های موجود از نو می‌سازد و تعداد ردیف‌های نوشته شده را برمی‌گرداند.
+        فقط روزهایی بازسازی می‌شوند که برای آن UUID اسنپ‌شاتی پیش از شروع روز وجود دارد (روزهای بعد از روز اولین
+        اسنپ‌شات)؛ اسنپ‌شات‌های قدیمی‌تر هر ماه پاک می‌شوند، پس ردیف‌های روزهای قبل‌تر (و روزهای قبل از since،
+        تاریخ تهران) دست نخورده می‌مانند و برای روز بدون مبنا ردیفی نوشته نمی‌شود.
+        """
+        tehran_tz = pytz.timezone("Asia/Tehran")
+        with self._conn() as c:
+            rows = c.execute("SELECT uuid_id, MIN(taken_at) AS first_taken FROM usage_snapshots GROUP BY uuid_id").fetchall()
+
+        # اولین روزی از هر UUID که مصرفش قابل محاسبه است: روز تهرانی بعد از اولین اسنپ‌شات
+        start_days = {}
+        for row in rows:
+            first_taken = datetime.fromisoformat(str(row['first_taken']))
+            if first_taken.tzinfo is None:
+                first_taken = pytz.utc.localize(first_taken)
+            start_day = first_taken.astimezone(tehran_tz).date() + timedelta(days=1)
+            start_days[row['uuid_id']] = max(start_day, since) if since else start_day
+        today = datetime.now(tehran_tz).date()
+        start_days = {uuid_id: day for uuid_id, day in start_days.items() if day <= today}
+        if not start_days:
+            return 0
+
+        usage = self._stream_daily_usage(min(start_days.values()), today)
+        usage = {
+            (uuid_id, day): values for (uuid_id, day), values in usage.items()
+            if uuid_id in start_days and day >= start_days[uuid_id].isoformat()
+        }
+        now_utc = datetime.now(pytz.utc)
+        with self._conn() as c:
+            c.executemany(
+                "DELETE FROM daily_usage WHERE uuid_id = ? AND usage_date >= ?",
+                ((uuid_id, day.isoformat()) for uuid_id, day in start_days.items())
+            )
+            c.executemany(
+                "INSERT INTO daily_usage (uuid_id, usage_date, hiddify_gb, marzban_gb, updated_at) VALUES (?, ?, ?, ?, ?)",
+                ((uuid_id, day, h_usage, m_usage, now_utc) for (uuid_id, day), (h_usage, m_usage) in usage.items())
+            )
+        logger.info(f"Rebuilt daily_usage rollup with {len(usage)} rows for {len(start_days)} UUID(s).")
+        return len(usage)
+
+    def ensure_daily_usage_backfilled(self) -> None:
+        """اگر جدول daily_usage خالی باشد ولی اسنپ‌شات وجود داشته باشد، آن را یک بار بازسازی می‌کند."""
+        with self._conn() as c:
+            has_rollup = c.execute("SELECT 1 FROM daily_usage LIMIT 1").fetchone()
+            has_snapshots = c.execute("SELECT 1 FROM usage_snapshots LIMIT 1").fetchone()
+        if not has_rollup and has_snapshots:
+            logger.info("daily_usage rollup is empty. Backfilling from usage_snapshots...")
+            self.rebuild_daily_usage()
 
     def get_usage_since_midnight(self, uuid_id: int) -> Dict[str, float]:
         """
@@ -93,56 +341,70 @@ class UsageDB(DatabaseManager):
 
     def get_user_daily_usage_history_by_panel(self, uuid_id: int, days: int = 7) -> list:
         """
-        (نسخه اصلاح‌شده نهایی)
-        محاسبه مصرف روزانه واقعی کاربر به تفکیک پنل‌ها با مدیریت هوشمند ریست API.
+        مصرف روزانه کاربر در N روز اخیر را به تفکیک پنل از جدول daily_usage برمی‌گرداند.
         """
-        logger.info(f"Generating daily usage history for UUID {uuid_id} (last {days} days)...")
         tehran_tz = pytz.timezone("Asia/Tehran")
-        now_in_tehran = datetime.now(tehran_tz)
-        history = []
+        today = datetime.now(tehran_tz).date()
+        first_day = today - timedelta(days=days - 1)
 
         with self._conn() as c:
-            for i in range(days - 1, -1, -1):
-                target_date = (now_in_tehran - timedelta(days=i)).date()
-                day_start_utc = datetime(
-                    target_date.year, target_date.month, target_date.day,
-                    tzinfo=tehran_tz
-                ).astimezone(pytz.utc)
-                day_end_utc = day_start_utc + timedelta(days=1)
-
-                try:
-                    baseline_snap = c.execute(
-                        "SELECT hiddify_usage_gb, marzban_usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at < ? ORDER BY taken_at DESC LIMIT 1",
-                        (uuid_id, day_start_utc)
-                    ).fetchone()
-
-                    end_snap = c.execute(
-                        "SELECT hiddify_usage_gb, marzban_usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at < ? ORDER BY taken_at DESC LIMIT 1",
-                        (uuid_id, day_end_utc)
-                    ).fetchone()
-
-                    if not end_snap:
-                        history.append({"date": target_date, "hiddify_usage": 0.0, "marzban_usage": 0.0, "total_usage": 0.0})
-                        continue
+            rows = c.execute(
+                "SELECT usage_date, hiddify_gb, marzban_gb FROM daily_usage WHERE uuid_id = ? AND usage_date >= ?",
+                (uuid_id, first_day.isoformat())
+            ).fetchall()
+        usage_by_date = {r['usage_date']: r for r in rows}
 
-                    h_start = baseline_snap['hiddify_usage_gb'] if baseline_snap and baseline_snap['hiddify_usage_gb'] is not None else 0.0
-                    m_start = baseline_snap['marzban_usage_gb'] if baseline_snap and baseline_snap['marzban_usage_gb'] is not None else 0.0
-                    h_end = end_snap['hiddify_usage_gb'] if end_snap and end_snap['hiddify_usage_gb'] is not None else 0.0
-                    m_end = end_snap['marzban_usage_gb'] if end_snap and end_snap['marzban_usage_gb'] is not None else 0.0
+        history = []
+        for i in range(days - 1, -1, -1):
+            target_date = today - timedelta(days=i)
+            row = usage_by_date.get(target_date.isoformat())
+            h_usage = (row['hiddify_gb'] or 0.0) if row else 0.0
+            m_usage = (row['marzban_gb'] or 0.0) if row else 0.0
+            history.append({
+                "date": target_date,
+                "hiddify_usage": round(h_usage, 2),
+                "marzban_usage": round(m_usage, 2),
+                "total_usage": round(h_usage + m_usage, 2)
+            })
+        return history
 
-                    daily_h_usage = h_end - h_start if h_end >= h_start else h_end
-                    daily_m_usage = m_end - m_start if m_end >= m_start else m_end
+    def get_all_daily_usage_history_by_panel(self, days: int = 7) -> Dict[int, list]:
+        """
+        همان خروجی get_user_daily_usage_history_by_panel را برای تمام UUID های فعال با یک کوئری
+        برمی‌گرداند: {uuid_id: [...]}.
+        """
+        tehran_tz = pytz.timezone("Asia/Tehran")
+        today = datetime.now(tehran_tz).date()
+        dates = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
 
-                    history.append({
-                        "date": target_date,
-                        "hiddify_usage": round(max(0.0, daily_h_usage), 2),
-                        "marzban_usage": round(max(0.0, daily_m_usage), 2),
-                        "total_usage": round(max(0.0, daily_h_usage) + max(0.0, daily_m_usage), 2)
-                    })
-                except Exception as e:
-                    logger.error(f"Failed to calculate daily usage for {target_date}: {e}")
-                    history.append({"date": target_date, "hiddify_usage": 0.0, "marzban_usage": 0.0, "total_usage": 0.0})
-        return history
+        usage_by_uuid = {}
+        with self._conn() as c:
+            rows = c.execute("""
+                SELECT uu.id AS uuid_id, du.usage_date, du.hiddify_gb, du.marzban_gb
+                FROM user_uuids uu
+                LEFT JOIN daily_usage du ON du.uuid_id = uu.id AND du.usage_date >= ?
+                WHERE uu.is_active = 1
+            """, (dates[0].isoformat(),)).fetchall()
+        for r in rows:
+            usage_by_date = usage_by_uuid.setdefault(r['uuid_id'], {})
+            if r['usage_date'] is not None:
+                usage_by_date[r['usage_date']] = r
+
+        history_map = {}
+        for uuid_id, usage_by_date in usage_by_uuid.items():
+            history = []
+            for target_date in dates:
+                row = usage_by_date.get(target_date.isoformat())
+                h_usage = (row['hiddify_gb'] or 0.0) if row else 0.0
+                m_usage = (row['marzban_gb'] or 0.0) if row else 0.0
+                history.append({
+                    "date": target_date,
+                    "hiddify_usage": round(h_usage, 2),
+                    "marzban_usage": round(m_usage, 2),
+                    "total_usage": round(h_usage + m_usage, 2)
+                })
+            history_map[uuid_id] = history
+        return history_map
 
     def delete_all_daily_snapshots(self) -> int:
         """تمام اسنپ‌شات‌های مصرف امروز (به وقت UTC) را برای همه کاربران حذف می‌کند."""
@@ -150,6 +412,7 @@ class UsageDB(DatabaseManager):
         with self._conn() as c:
             cursor = c.execute("DELETE FROM usage_snapshots WHERE taken_at >= ?", (today_start_utc,))
             deleted_count = cursor.rowcount
+            self.refresh_daily_usage()
             logger.info(f"ADMIN ACTION: Deleted {deleted_count} daily snapshots for all users.")
             return deleted_count
 
@@ -203,63 +466,95 @@ class UsageDB(DatabaseManager):
         intervals = {3: 0.0, 6: 0.0, 12: 0.0, 24: 0.0}
 
         with self._conn() as c:
+            last_row = c.execute(f"SELECT {panel_name} AS usage FROM usage_snapshots WHERE uuid_id = ? ORDER BY taken_at DESC LIMIT 1",
+                                 (uuid_id,)).fetchone()
+            if not last_row:
+                return intervals
+            end = last_row['usage'] or 0
             for hours in intervals.keys():
                 time_ago = now_utc - timedelta(hours=hours)
-                query = f"SELECT (MAX({panel_name}) - MIN({panel_name})) as usage FROM usage_snapshots WHERE uuid_id = ? AND taken_at >= ?"
-                row = c.execute(query, (uuid_id, time_ago)).fetchone()
-                if row and row['usage'] is not None:
-                    intervals[hours] = max(0, row['usage'])
+                # اسنپ‌شات بدون تغییر ثبت نمی‌شود؛ baseline آخرین اسنپ‌شات قبل از بازه است (در نبود آن اولین اسنپ‌شات بازه)
+                start_row = (
+                    c.execute(f"SELECT {panel_name} AS usage FROM usage_snapshots WHERE uuid_id = ? AND taken_at < ? ORDER BY taken_at DESC LIMIT 1",
+                              (uuid_id, time_ago)).fetchone()
+                    or c.execute(f"SELECT {panel_name} AS usage FROM usage_snapshots WHERE uuid_id = ? AND taken_at >= ? ORDER BY taken_at ASC LIMIT 1",
+                                 (uuid_id, time_ago)).fetchone()
+                )
+                start = (start_row['usage'] or 0) if start_row else end
+                intervals[hours] = max(0, end - start if end >= start else end)
         return intervals
 
     def get_all_daily_usage_since_midnight(self) -> Dict[str, Dict[str, float]]:
+        """
+        مصرف امروز (از نیمه‌شب تهران) تمام UUID های فعال را با یک کوئری برمی‌گرداند.
+        منطق دقیقاً مانند get_usage_since_midnight است: baseline آخرین اسنپ‌شات قبل از نیمه‌شب،
+        در نبود آن اولین اسنپ‌شات امروز، و در صورت ریست شدن حجم، مقدار پایانی به عنوان مصرف.
+        برای هر UUID سه جستجوی ایندکسی روی (uuid_id, taken_at) انجام می‌شود و نه اسکن کل جدول.
+        """
+        tehran_tz = pytz.timezone("Asia/Tehran")
+        today_midnight_utc = datetime.now(tehran_tz).replace(hour=0, minute=0, second=0, microsecond=0).astimezone(pytz.utc)
+
+        query = """
+            WITH picks AS (
+                SELECT uu.id, uu.uuid,
+                    (SELECT s.id FROM usage_snapshots s WHERE s.uuid_id = uu.id AND s.taken_at < :midnight
+                     ORDER BY s.taken_at DESC LIMIT 1) AS baseline_id,
+                    (SELECT s.id FROM usage_snapshots s WHERE s.uuid_id = uu.id AND s.taken_at >= :midnight
+                     ORDER BY s.taken_at ASC LIMIT 1) AS first_today_id,
+                    (SELECT s.id FROM usage_snapshots s WHERE s.uuid_id = uu.id
+                     ORDER BY s.taken_at DESC LIMIT 1) AS last_id
+                FROM user_uuids uu
+                WHERE uu.is_active = 1
+            )
+            SELECT p.uuid, p.baseline_id, p.last_id,
+                   b.hiddify_usage_gb AS b_h, b.marzban_usage_gb AS b_m,
+                   f.hiddify_usage_gb AS f_h, f.marzban_usage_gb AS f_m,
+                   l.hiddify_usage_gb AS l_h, l.marzban_usage_gb AS l_m
+            FROM picks p
+            LEFT JOIN usage_snapshots b ON b.id = p.baseline_id
+            LEFT JOIN usage_snapshots f ON f.id = p.first_today_id
+            LEFT JOIN usage_snapshots l ON l.id = p.last_id
+        """
         usage_map = {}
-        all_uuids = self.get_all_user_uuids()
-        for u in all_uuids:
-            if u.get('is_active'):
-                usage_map[u['uuid']] = self.get_usage_since_midnight(u['id'])
+        with self._conn() as c:
+            rows = c.execute(query, {"midnight": today_midnight_utc}).fetchall()
+
+        for row in rows:
+            if row['last_id'] is None:
+                usage_map[row['uuid']] = {'hiddify': 0.0, 'marzban': 0.0}
+                continue
+
+            h_end, m_end = row['l_h'] or 0.0, row['l_m'] or 0.0
+            if row['baseline_id'] is not None:
+                h_start, m_start = row['b_h'] or 0.0, row['b_m'] or 0.0
+            else:
+                h_start, m_start = row['f_h'] or 0.0, row['f_m'] or 0.0
+
+            h_usage = h_end - h_start if h_end >= h_start else h_end
+            m_usage = m_end - m_start if m_end >= m_start else m_end
+            usage_map[row['uuid']] = {'hiddify': max(0, h_usage), 'marzban': max(0, m_usage)}
         return usage_map
 
-    def get_daily_usage_summary(self) -> List[Dict[str, Any]]:
-        """(نسخه اصلاح شده) خلاصه مصرف روزانه کل سیستم برای ۷ روز گذشته را با منطق پایتون محاسبه می‌کند."""
+    def get_daily_usage_summary(self, days: int = 7) -> List[Dict[str, Any]]:
+        """خلاصه مصرف روزانه کل سیستم برای N روز گذشته را از جدول daily_usage برمی‌گرداند."""
         tehran_tz = pytz.timezone('Asia/Tehran')
         today = datetime.now(tehran_tz).date()
-        summary = []
-        all_active_uuids = [u['id'] for u in self.get_all_active_uuids_with_user_id()]
+        first_day = today - timedelta(days=days - 1)
 
         with self._conn() as c:
-            for i in range(7):
-                date_to_check = today - timedelta(days=i)
-                day_start_utc = datetime(date_to_check.year, date_to_check.month, date_to_check.day, tzinfo=tehran_tz).astimezone(pytz.utc)
-                day_end_utc = day_start_utc + timedelta(days=1)
-                
-                total_day_usage = 0.0
-                for uuid_id in all_active_uuids:
-                    baseline_snap = c.execute(
-                        "SELECT hiddify_usage_gb, marzban_usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at < ? ORDER BY taken_at DESC LIMIT 1",
-                        (uuid_id, day_start_utc)
-                    ).fetchone()
-                    
-                    end_snap = c.execute(
-                        "SELECT hiddify_usage_gb, marzban_usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at < ? ORDER BY taken_at DESC LIMIT 1",
-                        (uuid_id, day_end_utc)
-                    ).fetchone()
-
-                    if not end_snap:
-                        continue
-
-                    h_start = baseline_snap['hiddify_usage_gb'] if baseline_snap and baseline_snap['hiddify_usage_gb'] is not None else 0.0
-                    m_start = baseline_snap['marzban_usage_gb'] if baseline_snap and baseline_snap['marzban_usage_gb'] is not None else 0.0
-                    h_end = end_snap['hiddify_usage_gb'] if end_snap and end_snap['hiddify_usage_gb'] is not None else 0.0
-                    m_end = end_snap['marzban_usage_gb'] if end_snap and end_snap['marzban_usage_gb'] is not None else 0.0
-                    
-                    h_usage = h_end - h_start if h_end >= h_start else h_end
-                    m_usage = m_end - m_start if m_end >= m_start else m_end
-                    
-                    total_day_usage += max(0, h_usage) + max(0, m_usage)
-                
-                summary.append({"date": date_to_check.strftime('%Y-%m-%d'), "total_usage": total_day_usage})
-                
-        return sorted(summary, key=lambda x: x['date'])
+            rows = c.execute("""
+                SELECT du.usage_date, SUM(du.hiddify_gb + du.marzban_gb) AS total_usage
+                FROM daily_usage du
+                JOIN user_uuids uu ON uu.id = du.uuid_id
+                WHERE uu.is_active = 1 AND du.usage_date >= ?
+                GROUP BY du.usage_date
+            """, (first_day.isoformat(),)).fetchall()
+        totals = {r['usage_date']: r['total_usage'] or 0.0 for r in rows}
+
+        return [
+            {"date": d.strftime('%Y-%m-%d'), "total_usage": totals.get(d.isoformat(), 0.0)}
+            for d in (first_day + timedelta(days=i) for i in range(days))
+        ]
     
     def get_new_users_per_month_stats(self) -> Dict[str, int]:
         """
@@ -288,27 +583,17 @@ class UsageDB(DatabaseManager):
             ).fetchone()
             return row[0] if row else 0
 
-    def get_top_consumers_by_usage(self, limit: int = 10) -> List[Dict[str, Any]]:
-        """لیست ۱۰ کاربر پرمصرف در ۳۰ روز گذشته را برمی‌گرداند."""
-        thirty_days_ago = datetime.now(pytz.utc) - timedelta(days=30)
+    def get_top_consumers_by_usage(self, days: int = 30, limit: int = 10) -> List[Dict[str, Any]]:
+        """لیست پرمصرف‌ترین UUID ها در N روز گذشته (name، h_usage، m_usage) را برمی‌گرداند."""
+        since = datetime.now(pytz.utc) - timedelta(days=days)
         with self._conn() as c:
-            rows = c.execute("""
-                SELECT u.telegram_id, u.name,
-                       SUM(s.h_usage + s.m_usage) as total_usage
-                FROM (
-                    SELECT uuid_id,
-                           MAX(hiddify_usage_gb) - MIN(hiddify_usage_gb) as h_usage,
-                           MAX(marzban_usage_gb) - MIN(marzban_usage_gb) as m_usage
-                    FROM usage_snapshots
-                    WHERE taken_at >= ?
-                    GROUP BY uuid_id
-                ) s
-                JOIN user_uuids uu ON s.uuid_id = uu.id
-                JOIN users u ON uu.user_id = u.id
-                GROUP BY u.id
-                ORDER BY total_usage DESC
-                LIMIT ?
-            """, (thirty_days_ago, limit)).fetchall()
+            rows = c.execute(_WINDOW_USAGE_CTE + """
+                SELECT name, h_usage, m_usage
+                FROM window_usage
+                WHERE h_usage > 0 OR m_usage > 0
+                ORDER BY (h_usage + m_usage) DESC
+                LIMIT :limit
+            """, {"since": since, "limit": limit}).fetchall()
             return [dict(row) for row in rows]
 
     def get_new_users_in_range(self, start_date: datetime, end_date: datetime) -> int:
@@ -329,72 +614,32 @@ class UsageDB(DatabaseManager):
 
     def get_daily_usage_per_panel(self, days: int = 30) -> list[dict[str, Any]]:
         """
-        (نسخه کاملاً اصلاح شده) مصرف روزانه را به تفکیک هر پنل با منطق صحیح محاسبه می‌کند
+        مصرف روزانه N روز گذشته را به تفکیک هر پنل از جدول daily_usage برمی‌گرداند.
         """
         tehran_tz = pytz.timezone("Asia/Tehran")
-        end_date = datetime.now(tehran_tz)
-        
-        all_uuids = self.get_all_active_uuids_with_user_id()
-        uuid_ids = [u['id'] for u in all_uuids]
-
-        daily_summary = {}
+        today = datetime.now(tehran_tz).date()
+        first_day = today - timedelta(days=days - 1)
 
         with self._conn() as c:
-            for i in range(days):
-                target_date = (end_date - timedelta(days=i)).date()
-                date_str = target_date.strftime('%Y-%m-%d')
-                
-                day_start_utc = datetime(
-                    target_date.year, target_date.month, target_date.day,
-                    tzinfo=tehran_tz
-                ).astimezone(pytz.utc)
-                day_end_utc = day_start_utc + timedelta(days=1)
-
-                day_total_h_gb = 0.0
-                day_total_m_gb = 0.0
-
-                for uuid_id in uuid_ids:
-                    baseline_snap = c.execute(
-                        "SELECT hiddify_usage_gb, marzban_usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at < ? ORDER BY taken_at DESC LIMIT 1",
-                        (uuid_id, day_start_utc)
-                    ).fetchone()
-
-                    end_snap = c.execute(
-                        "SELECT hiddify_usage_gb, marzban_usage_gb FROM usage_snapshots WHERE uuid_id = ? AND taken_at < ? ORDER BY taken_at DESC LIMIT 1",
-                        (uuid_id, day_end_utc)
-                    ).fetchone()
-
-                    if not end_snap:
-                        continue
-
-                    h_start = baseline_snap['hiddify_usage_gb'] if baseline_snap and baseline_snap['hiddify_usage_gb'] is not None else 0.0
-                    m_start = baseline_snap['marzban_usage_gb'] if baseline_snap and baseline_snap['marzban_usage_gb'] is not None else 0.0
-                    h_end = end_snap['hiddify_usage_gb'] if end_snap and end_snap['hiddify_usage_gb'] is not None else 0.0
-                    m_end = end_snap['marzban_usage_gb'] if end_snap and end_snap['marzban_usage_gb'] is not None else 0.0
-                    
-                    h_usage = h_end - h_start if h_end >= h_start else h_end
-                    m_usage = m_end - m_start if m_end >= m_start else m_end
-                    
-                    day_total_h_gb += max(0, h_usage)
-                    day_total_m_gb += max(0, m_usage)
-
-                daily_summary[date_str] = {
-                    'total_h_gb': round(day_total_h_gb, 2),
-                    'total_m_gb': round(day_total_m_gb, 2)
-                }
+            rows = c.execute("""
+                SELECT du.usage_date, SUM(du.hiddify_gb) AS total_h_gb, SUM(du.marzban_gb) AS total_m_gb
+                FROM daily_usage du
+                JOIN user_uuids uu ON uu.id = du.uuid_id
+                WHERE uu.is_active = 1 AND du.usage_date >= ?
+                GROUP BY du.usage_date
+            """, (first_day.isoformat(),)).fetchall()
+        daily_summary = {r['usage_date']: r for r in rows}
 
         result = []
         for i in range(days):
-            target_date = (end_date - timedelta(days=i)).date()
-            date_str = target_date.strftime('%Y-%m-%d')
-            data = daily_summary.get(date_str, {'total_h_gb': 0, 'total_m_gb': 0})
+            date_str = (first_day + timedelta(days=i)).strftime('%Y-%m-%d')
+            row = daily_summary.get(date_str)
             result.append({
                 'date': date_str,
-                'total_h_gb': data['total_h_gb'],
-                'total_m_gb': data['total_m_gb']
+                'total_h_gb': round(row['total_h_gb'] or 0.0, 2) if row else 0,
+                'total_m_gb': round(row['total_m_gb'] or 0.0, 2) if row else 0
             })
-
-        return sorted(result, key=lambda x: x['date'])
+        return result
 
     def get_activity_heatmap_data(self) -> List[Dict[str, Any]]:
         """
@@ -441,16 +686,7 @@ class UsageDB(DatabaseManager):
         n_days_ago = datetime.now(pytz.utc) - timedelta(days=days)
         with self._conn() as c:
             row = c.execute(
-                """
-                SELECT SUM(s.h_usage + s.m_usage)
-                FROM (
-                    SELECT MAX(hiddify_usage_gb) - MIN(hiddify_usage_gb) as h_usage,
-                           MAX(marzban_usage_gb) - MIN(marzban_usage_gb) as m_usage
-                    FROM usage_snapshots
-                    WHERE taken_at >= ?
-                    GROUP BY uuid_id
-                ) s
-                """, (n_days_ago,)
+                _WINDOW_USAGE_CTE + "SELECT SUM(h_usage + m_usage) FROM window_usage", {"since": n_days_ago}
             ).fetchone()
             return row[0] if row and row[0] is not None else 0.0
 
@@ -545,6 +781,7 @@ class UsageDB(DatabaseManager):
         """
         logger.info("Starting weekly top consumers report generation (single-function approach)...")
         tehran_tz = pytz.timezone("Asia/Tehran")
+        self.ensure_daily_usage_backfilled()
 
         with self._conn() as c:
             # --- ۱. بررسی وجود اسنپ‌شات‌ها ---
@@ -588,88 +825,49 @@ class UsageDB(DatabaseManager):
                 # مطابق لاگ‌هایی که فرستادی، پیام مشابه بنویسیم
                 logger.error(f"Failed to fetch user names. Report will use fallback names. Error: {e}")
 
-            # --- ۳. خواندن همه UUIDهای فعال (از generator all_active_uuids) ---
-            try:
-                all_uuids = list(self.all_active_uuids())
-            except Exception as e:
-                logger.error(f"Failed to retrieve active UUIDs: {e}")
-                return {'top_10_overall': [], 'top_daily': {}}
-
-            if not all_uuids:
-                logger.warning("No active UUIDs found. Returning empty report.")
-                return {'top_10_overall': [], 'top_daily': {}}
-
-            weekly_usage_data: Dict[int, Dict[str, Any]] = {}
-            daily_winners_list: list = []
-
-            logger.info(f"Calculating usage for {len(all_uuids)} active UUIDs over 7 days (base date: {report_base_date}).")
-
-            # --- ۴. محاسبه مصرف هر روز و تجمع هفتگی ---
-            for day_offset in range(7):
-                target_date = report_base_date - timedelta(days=day_offset)
-                # نیمه‌شب به وقت تهران برای آن روز
-                day_start_tehran = tehran_tz.localize(datetime(target_date.year, target_date.month, target_date.day, 0, 0, 0))
-                day_start_utc = day_start_tehran.astimezone(pytz.utc)
-                day_end_utc = (day_start_tehran + timedelta(days=1)).astimezone(pytz.utc)
-
-                top_day = {'name': None, 'usage': 0.0}
-
-                for uuid_info in all_uuids:
-                    uuid_id = uuid_info.get('id')
-                    user_id = uuid_info.get('user_id')
-                    # نام کاربر: اول از user_names_map، در غیر اینصورت از فیلد name در user_uuids استفاده کن
-                    user_name = user_names_map.get(user_id) if user_id is not None else None
-                    if not user_name:
-                        user_name = uuid_info.get('name') or (f"User {user_id}" if user_id is not None else "Unknown")
-
-                    # گرفتن آخرین اسنپ‌شات قبل از شروع روز (baseline) و آخرین قبل از انتهای روز (end)
-                    baseline_row = c.execute(
-                        "SELECT hiddify_usage_gb, marzban_usage_gb FROM usage_snapshots "
-                        "WHERE uuid_id = ? AND taken_at < ? ORDER BY taken_at DESC LIMIT 1",
-                        (uuid_id, day_start_utc)
-                    ).fetchone()
-
-                    end_row = c.execute(
-                        "SELECT hiddify_usage_gb, marzban_usage_gb FROM usage_snapshots "
-                        "WHERE uuid_id = ? AND taken_at < ? ORDER BY taken_at DESC LIMIT 1",
-                        (uuid_id, day_end_utc)
-                    ).fetchone()
-
-                    if not end_row:
-                        continue
-
-                    h_start = baseline_row['hiddify_usage_gb'] if baseline_row and baseline_row['hiddify_usage_gb'] is not None else 0.0
-                    m_start = baseline_row['marzban_usage_gb'] if baseline_row and baseline_row['marzban_usage_gb'] is not None else 0.0
-                    h_end = end_row['hiddify_usage_gb'] if end_row and end_row['hiddify_usage_gb'] is not None else 0.0
-                    m_end = end_row['marzban_usage_gb'] if end_row and end_row['marzban_usage_gb'] is not None else 0.0
-
-                    # در صورت ریست شدن کانترها (مقدار انتهایی کمتر از شروع) از مقدار انتهایی به عنوان مصرف استفاده می‌کنیم
-                    h_usage = h_end - h_start if h_end >= h_start else h_end
-                    m_usage = m_end - m_start if m_end >= m_start else m_end
-                    total_daily_usage = max(0.0, h_usage) + max(0.0, m_usage)
-
-                    # جمع‌بندی هفتگی
-                    if total_daily_usage > 0.001:
-                        key = user_id if user_id is not None else (uuid_id or user_name)
-                        if key not in weekly_usage_data:
-                            weekly_usage_data[key] = {'name': user_name, 'total_usage': 0.0}
-                        weekly_usage_data[key]['total_usage'] += total_daily_usage
-
-                    # بررسی قهرمان روز
-                    if total_daily_usage > top_day['usage']:
-                        top_day['name'] = user_name
-                        top_day['usage'] = total_daily_usage
-
-                # ثبت قهرمان آن روز در صورت وجود
-                if top_day['name']:
-                    daily_winners_list.append({
-                        'date': target_date,
-                        'name': top_day['name'],
-                        'usage': top_day['usage']
-                    })
+            # --- ۳. مصرف هفتگی هر کاربر و قهرمان هر روز از جدول daily_usage ---
+            first_day = (report_base_date - timedelta(days=6)).isoformat()
+            last_day = report_base_date.isoformat()
+            logger.info(f"Aggregating daily_usage rollup from {first_day} to {last_day}.")
+
+            weekly_rows = c.execute("""
+                SELECT uu.user_id, MIN(uu.name) AS uuid_name,
+                       SUM(du.hiddify_gb + du.marzban_gb) AS total_usage
+                FROM daily_usage du
+                JOIN user_uuids uu ON uu.id = du.uuid_id AND uu.is_active = 1
+                WHERE du.usage_date BETWEEN ? AND ? AND du.hiddify_gb + du.marzban_gb > 0.001
+                GROUP BY COALESCE(uu.user_id, -uu.id)
+            """, (first_day, last_day)).fetchall()
+
+            # در SQLite ستون‌های بدون تابع تجمیعی کنار MAX از همان ردیف بیشینه خوانده می‌شوند
+            champion_rows = c.execute("""
+                SELECT du.usage_date, uu.user_id, uu.name AS uuid_name,
+                       MAX(du.hiddify_gb + du.marzban_gb) AS usage
+                FROM daily_usage du
+                JOIN user_uuids uu ON uu.id = du.uuid_id AND uu.is_active = 1
+                WHERE du.usage_date BETWEEN ? AND ?
+                GROUP BY du.usage_date
+            """, (first_day, last_day)).fetchall()
+
+            def _display_name(user_id, uuid_name):
+                # نام کاربر: اول از user_names_map، در غیر اینصورت از فیلد name در user_uuids استفاده کن
+                user_name = user_names_map.get(user_id) if user_id is not None else None
+                return user_name or uuid_name or (f"User {user_id}" if user_id is not None else "Unknown")
+
+            sorted_consumers = sorted(
+                ({'name': _display_name(r['user_id'], r['uuid_name']), 'total_usage': r['total_usage']} for r in weekly_rows),
+                key=lambda x: x['total_usage'], reverse=True
+            )
+            daily_winners_list = [
+                {
+                    'date': datetime.strptime(r['usage_date'], "%Y-%m-%d").date(),
+                    'name': _display_name(r['user_id'], r['uuid_name']),
+                    'usage': r['usage']
+                }
+                for r in champion_rows if r['usage'] and r['usage'] > 0
+            ]
 
-            # --- ۵. مرتب‌سازی و آماده‌سازی خروجی نهایی ---
-            sorted_consumers = sorted(weekly_usage_data.values(), key=lambda x: x['total_usage'], reverse=True)
+            # --- ۴. آماده‌سازی خروجی نهایی ---
             unique_consumers = []
             seen_consumers = set() # (name, usage)
             for consumer in sorted_consumers:
@@ -939,7 +1137,7 @@ class UsageDB(DatabaseManager):
     def get_previous_day_total_usage(self) -> float:
         """مجموع مصرف کل در روز گذشته را برمی‌گرداند."""
         yesterday_summary = self.get_daily_usage_summary(days=2)
-        return yesterday_summary[1]['total_usage'] if len(yesterday_summary) > 1 else 0.0
+        return yesterday_summary[0]['total_usage'] if len(yesterday_summary) > 1 else 0.0
 
     def count_all_active_users(self) -> int:
         """تعداد کل کاربران فعال را شمارش می‌کند."""
@@ -6,7 +6,9 @@ from typing import Any, Dict, List, Optional
 from datetime import datetime, timedelta
 import logging
 import secrets
+import atexit
 import pytz
+import threading
 import time
 
 from .base import DatabaseManager
@@ -22,14 +24,13 @@ class UserDB(DatabaseManager):
         """
         اطلاعات کامل یک کاربر را با استفاده از کش واکشی می‌کند.
         """
-        if user_id in self._user_cache:
-            return self._user_cache[user_id]
-        with self._conn() as c:  #
+        user_data = self._cached_user_data(user_id, 'user', self._load_user)
+        return dict(user_data) if user_data else None
+
+    def _load_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._conn() as c:
             row = c.execute("SELECT * FROM users WHERE user_id=?", (user_id,)).fetchone()
-            user_data = dict(row) if row else None
-            if user_data:
-                self._user_cache[user_id] = user_data
-            return user_data
+            return dict(row) if row else None
 
     def add_or_update_user(self, user_id: int, username: Optional[str], first: Optional[str], last: Optional[str]) -> bool:
         """
@@ -50,6 +51,9 @@ class UserDB(DatabaseManager):
 
     def get_user_settings(self, user_id: int) -> Dict[str, bool]:
         """تنظیمات مختلف کاربر را برمی‌گرداند."""
+        return dict(self._cached_user_data(user_id, 'settings', self._load_user_settings))
+
+    def _load_user_settings(self, user_id: int) -> Dict[str, bool]:
         with self._conn() as c:
             row = c.execute("SELECT daily_reports, weekly_reports, monthly_reports, expiry_warnings, data_warning_de, data_warning_fr, data_warning_tr, data_warning_us, data_warning_al, data_warning_nl, data_warning_ro, data_warning_supp, show_info_config, auto_delete_reports, achievement_alerts, promotional_alerts FROM users WHERE user_id=?", (user_id,)).fetchone()
             if row:
@@ -63,6 +67,32 @@ class UserDB(DatabaseManager):
                 'auto_delete_reports': False, 'achievement_alerts': True, 'promotional_alerts': True
             }
 
+    def get_report_recipients(self, user_id: Optional[int] = None) -> Dict[int, Dict[str, Any]]:
+        """
+        تنظیمات، زبان و UUID های فعال تمام کاربران (یا فقط یک کاربر) را با دو کوئری برمی‌گرداند؛
+        برای ساخت گزارش‌های زمان‌بندی‌شده بدون چند کوئری جداگانه به ازای هر کاربر.
+        خروجی: {user_id: {'settings': {...}, 'lang_code': str, 'uuids': [...]}}
+        """
+        user_filter, params = ("WHERE user_id = ?", (user_id,)) if user_id is not None else ("", ())
+        recipients = {}
+        with self._conn() as c:
+            rows = c.execute(f"SELECT user_id, lang_code, daily_reports, weekly_reports, monthly_reports, expiry_warnings, data_warning_de, data_warning_fr, data_warning_tr, data_warning_us, data_warning_al, data_warning_nl, data_warning_ro, data_warning_supp, show_info_config, auto_delete_reports, achievement_alerts, promotional_alerts FROM users {user_filter}", params).fetchall()
+            for row in rows:
+                row_dict = dict(row)
+                uid = row_dict.pop('user_id')
+                lang_code = row_dict.pop('lang_code')
+                recipients[uid] = {
+                    'settings': {k: bool(v) for k, v in row_dict.items()},
+                    'lang_code': lang_code or 'fa',
+                    'uuids': []
+                }
+
+            uuid_filter = "AND user_id = ?" if user_id is not None else ""
+            for row in c.execute(f"SELECT * FROM user_uuids WHERE is_active = 1 {uuid_filter} ORDER BY created_at", params):
+                if row['user_id'] in recipients:
+                    recipients[row['user_id']]['uuids'].append(dict(row))
+        return recipients
+
     def update_user_setting(self, user_id: int, setting: str, value: bool) -> None:
         """یک تنظیم خاص کاربر را به‌روزرسانی می‌کند."""
         valid_settings = [
@@ -103,6 +133,9 @@ class UserDB(DatabaseManager):
 
     def get_user_language(self, user_id: int) -> str:
         """زبان کاربر را از دیتابیس می‌خواند."""
+        return self._cached_user_data(user_id, 'language', self._load_user_language)
+
+    def _load_user_language(self, user_id: int) -> str:
         with self._conn() as c:
             row = c.execute("SELECT lang_code FROM users WHERE user_id = ?", (user_id,)).fetchone()
             return row['lang_code'] if row and row['lang_code'] else 'fa'
@@ -137,6 +170,12 @@ class UserDB(DatabaseManager):
             self.clear_user_cache(user_id)
             return cursor.rowcount > 0
 
+    def delete_old_user_cache_log(self, hours: int = 24) -> int:
+        """رکوردهای قدیمی user_cache_log را پاک می‌کند (پروسس‌ها فقط رکوردهای جدید را می‌خوانند)."""
+        with self._conn() as c:
+            cursor = c.execute("DELETE FROM user_cache_log WHERE changed_at < datetime('now', ?)", (f"-{hours} hours",))
+            return cursor.rowcount
+
     # --- توابع مربوط به UUID ---
 
     def add_uuid(self, user_id: int, uuid_str: str, name: str) -> any:
@@ -179,6 +218,9 @@ class UserDB(DatabaseManager):
 
     def uuids(self, user_id: int) -> List[Dict[str, Any]]:
         """تمام UUID های فعال یک کاربر را برمی‌گرداند."""
+        return [dict(r) for r in self._cached_user_data(user_id, 'uuids', self._load_uuids)]
+
+    def _load_uuids(self, user_id: int) -> List[Dict[str, Any]]:
         with self._conn() as c:
             rows = c.execute("SELECT * FROM user_uuids WHERE user_id=? AND is_active=1 ORDER BY created_at", (user_id,)).fetchall()
             return [dict(r) for r in rows]
@@ -263,13 +305,38 @@ class UserDB(DatabaseManager):
         """وضعیت ارسال یادآوری تمدید را برای تست ریست می‌کند."""
         with self._conn() as c:
             c.execute("UPDATE user_uuids SET renewal_reminder_sent = 0 WHERE id = ?", (uuid_id,))
+
+    def reset_renewal_reminders_sent(self, uuid_strs: list[str]):
+        """نسخه گروهی reset_renewal_reminder_sent بر اساس رشته UUID اکانت‌های فعال؛ همه در یک تراکنش."""
+        if not uuid_strs:
+            return
+        with self._conn() as c:
+            c.executemany("UPDATE user_uuids SET renewal_reminder_sent = 0 WHERE uuid = ? AND is_active = 1",
+                          [(uuid_str,) for uuid_str in uuid_strs])
             
     def get_user_uuid_record(self, uuid_str: str) -> dict | None:
         """اطلاعات کامل یک رکورد UUID را بر اساس رشته آن برمی‌گرداند."""
         with self._conn() as c:
             row = c.execute("SELECT * FROM user_uuids WHERE uuid = ? AND is_active = 1", (uuid_str,)).fetchone()
             return dict(row) if row else None
-            
+
+    def get_subscription_state(self, uuid_str: str) -> dict | None:
+        """
+        رکورد UUID به همراه هر چیزی که خروجی لینک اشتراک به آن وابسته است (نسخه قالب‌ها، تنظیم نمایش
+        کانفیگ اطلاعات و آخرین اسنپ‌شات مصرف) را با یک کوئری برمی‌گرداند؛ برای اعتبارسنجی کش اشتراک.
+        """
+        with self._conn() as c:
+            row = c.execute("""
+                SELECT uu.*,
+                       IFNULL(u.show_info_config, 1) AS show_info_config,
+                       (SELECT version FROM cache_versions WHERE name = 'config_templates') AS templates_version,
+                       (SELECT MAX(id) FROM usage_snapshots WHERE uuid_id = uu.id) AS last_snapshot_id
+                FROM user_uuids uu
+                LEFT JOIN users u ON u.user_id = uu.user_id
+                WHERE uu.uuid = ? AND uu.is_active = 1
+            """, (uuid_str,)).fetchone()
+            return dict(row) if row else None
+
     def get_all_user_uuids(self) -> List[Dict[str, Any]]:
         """تمام رکوردهای UUID را برای پنل ادمین برمی‌گرداند."""
         with self._conn() as c:
@@ -338,24 +405,61 @@ class UserDB(DatabaseManager):
 
     # --- توابع مربوط به دستگاه‌های کاربر (User Agents) ---
 
-    def record_user_agent(self, uuid_id: int, user_agent: str):
-        """دستگاه کاربر را به صورت هوشمند ثبت یا به‌روزرسانی می‌کند."""
+    def record_user_agent(self, uuid_id: int, user_agent: str) -> bool:
+        """
+        دستگاه کاربر را در صف نوشتن تأخیری قرار می‌دهد و بلافاصله برمی‌گردد.
+        مشاهده‌های تکراری همان دستگاه (uuid_id, client, os) در یک بازه با هم ادغام شده و
+        هر USER_AGENT_FLUSH_INTERVAL ثانیه یکجا ذخیره می‌شوند.
+        """
         from ..utils import parse_user_agent # Local import to avoid circular dependency
-        new_parsed = parse_user_agent(user_agent)
-        if not new_parsed or not new_parsed.get('client'):
-            return
+        parsed = parse_user_agent(user_agent)
+        if not parsed or not parsed.get('client'):
+            return False
 
-        existing_agents = self.get_user_agents_for_uuid(uuid_id)
-        for agent in existing_agents:
-            existing_parsed = parse_user_agent(agent['user_agent'])
-            if existing_parsed and existing_parsed.get('client') == new_parsed.get('client') and existing_parsed.get('os') == new_parsed.get('os'):
-                # اگر دستگاهی با همین کلاینت و سیستم‌عامل وجود داشت، فقط آن را آپدیت کن
-                with self._conn() as c:
-                    c.execute("UPDATE client_user_agents SET user_agent = ?, last_seen = ? WHERE uuid_id = ? AND user_agent = ?", (user_agent, datetime.now(pytz.utc), uuid_id, agent['user_agent']))
-                return
-        # اگر دستگاه جدید بود، آن را اضافه کن
-        with self._conn() as c:
-            c.execute("INSERT INTO client_user_agents (uuid_id, user_agent, last_seen) VALUES (?, ?, ?) ON CONFLICT(uuid_id, user_agent) DO UPDATE SET last_seen = excluded.last_seen;", (uuid_id, user_agent, datetime.now(pytz.utc)))
+        key = (uuid_id, parsed['client'], parsed.get('os') or '')
+        with self._user_agent_lock:
+            self._user_agent_buffer[key] = (user_agent, parsed.get('version'), datetime.now(pytz.utc))
+            # ترد ذخیره‌سازی در اولین استفاده (و پس از fork که تردها از بین می‌روند) ساخته می‌شود
+            if self._user_agent_flusher is None or not self._user_agent_flusher.is_alive():
+                if self._user_agent_flusher is None:
+                    atexit.register(self.flush_user_agents)
+                self._user_agent_flusher = threading.Thread(target=self._user_agent_flush_loop, name="user-agent-flusher", daemon=True)
+                self._user_agent_flusher.start()
+        return True
+
+    def _user_agent_flush_loop(self):
+        from ..config import USER_AGENT_FLUSH_INTERVAL
+        while True:
+            time.sleep(USER_AGENT_FLUSH_INTERVAL)
+            try:
+                self.flush_user_agents()
+            except Exception as e:
+                logger.error(f"Failed to flush user agents: {e}", exc_info=True)
+
+    def flush_user_agents(self) -> int:
+        """دستگاه‌های صف‌شده را با یک upsert دسته‌ای ذخیره می‌کند و تعداد آن‌ها را برمی‌گرداند."""
+        with self._user_agent_lock:
+            pending, self._user_agent_buffer = self._user_agent_buffer, {}
+        if not pending:
+            return 0
+        try:
+            with self._conn() as c:
+                c.executemany("""
+                    INSERT INTO client_user_agents (uuid_id, user_agent, client, os, version, last_seen)
+                    SELECT ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM user_uuids WHERE id = ?)
+                    ON CONFLICT(uuid_id, client, os) DO UPDATE SET
+                        user_agent = excluded.user_agent, version = excluded.version, last_seen = excluded.last_seen
+                """, [
+                    (uuid_id, user_agent, client, os_name, version, last_seen, uuid_id)
+                    for (uuid_id, client, os_name), (user_agent, version, last_seen) in pending.items()
+                ])
+        except Exception:
+            # دسته به صف برمی‌گردد تا در نوبت بعد دوباره ذخیره شود؛ مشاهده‌های جدیدتر همان دستگاه حفظ می‌شوند
+            with self._user_agent_lock:
+                for key, value in pending.items():
+                    self._user_agent_buffer.setdefault(key, value)
+            raise
+        return len(pending)
 
     def delete_all_user_agents(self) -> int:
         """تمام دستگاه‌های ثبت‌شده را حذف می‌کند."""
@@ -370,12 +474,12 @@ class UserDB(DatabaseManager):
     def get_user_agents_for_uuid(self, uuid_id: int) -> List[Dict[str, Any]]:
         """تمام دستگاه‌های ثبت‌شده برای یک UUID خاص را برمی‌گرداند."""
         with self._conn() as c:
-            rows = c.execute("SELECT user_agent, last_seen FROM client_user_agents WHERE uuid_id = ? ORDER BY last_seen DESC", (uuid_id,)).fetchall()
+            rows = c.execute("SELECT user_agent, client, os, version, last_seen FROM client_user_agents WHERE uuid_id = ? ORDER BY last_seen DESC", (uuid_id,)).fetchall()
             return [dict(r) for r in rows]
 
     def get_all_user_agents(self) -> List[Dict[str, Any]]:
         """تمام دستگاه‌های ثبت‌شده به همراه اطلاعات کاربر را برمی‌گرداند."""
-        query = "SELECT ca.user_agent, ca.last_seen, uu.name as config_name, u.first_name, u.user_id FROM client_user_agents ca JOIN user_uuids uu ON ca.uuid_id = uu.id LEFT JOIN users u ON uu.user_id = u.user_id ORDER BY ca.last_seen DESC;"
+        query = "SELECT ca.user_agent, ca.client, ca.os, ca.version, ca.last_seen, uu.name as config_name, u.first_name, u.user_id FROM client_user_agents ca JOIN user_uuids uu ON ca.uuid_id = uu.id LEFT JOIN users u ON uu.user_id = u.user_id ORDER BY ca.last_seen DESC;"
         with self._conn() as c:
             rows = c.execute(query).fetchall()
             return [dict(r) for r in rows]
@@ -386,6 +490,12 @@ class UserDB(DatabaseManager):
             row = c.execute("SELECT COUNT(id) FROM client_user_agents WHERE uuid_id = ?", (uuid_id,)).fetchone()
         return row[0] if row else 0
 
+    def get_user_agent_counts(self) -> Dict[int, int]:
+        """تعداد دستگاه‌های ثبت‌شده تمام UUID ها را با یک کوئری برمی‌گرداند: {uuid_id: تعداد}."""
+        with self._conn() as c:
+            rows = c.execute("SELECT uuid_id, COUNT(id) AS cnt FROM client_user_agents GROUP BY uuid_id").fetchall()
+        return {r['uuid_id']: r['cnt'] for r in rows}
+
     def delete_user_agents_by_uuid_id(self, uuid_id: int) -> int:
         """تمام دستگاه‌های یک UUID خاص را حذف می‌کند."""
         with self._conn() as c:
@@ -474,6 +584,25 @@ class UserDB(DatabaseManager):
             c.execute("UPDATE users SET auto_renew = ? WHERE user_id = ?", (int(status), user_id))
         self.clear_user_cache(user_id)
 
+    def get_auto_renew_candidates(self) -> List[Dict[str, Any]]:
+        """
+        کاربران دارای تمدید خودکار را با یک کوئری برمی‌گرداند: user_id، موجودی کیف پول و UUID اصلی کاربر
+        (اولین UUID فعال، همان uuids(user_id)[0]) به صورت uuid_id و uuid. کاربران بدون UUID فعال حذف می‌شوند.
+        """
+        query = """
+            SELECT u.user_id, COALESCE(u.wallet_balance, 0) AS wallet_balance, uu.id AS uuid_id, uu.uuid
+            FROM users u
+            JOIN user_uuids uu ON uu.id = (
+                SELECT id FROM user_uuids
+                WHERE user_id = u.user_id AND is_active = 1
+                ORDER BY created_at, id LIMIT 1
+            )
+            WHERE u.auto_renew = 1
+        """
+        with self._conn() as c:
+            rows = c.execute(query).fetchall()
+            return [dict(r) for r in rows]
+
     def get_all_active_uuids_with_user_id(self) -> List[Dict[str, Any]]:
         with self._conn() as c:
             rows = c.execute("SELECT id, user_id FROM user_uuids WHERE is_active=1").fetchall()
@@ -0,0 +1,61 @@
+# bot/db/user_cache.py
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Tuple
+
+_MISSING = object()
+
+
+class UserCache:
+    """
+    حافظه LRU با اندازه محدود برای داده‌های پرتکرار هر کاربر (ردیف users، تنظیمات، زبان و UUIDها).
+    برای هر کاربر یک ورودی نگه داشته می‌شود که چند نوع داده (kind) دارد؛ باطل کردن یک کاربر همه آن‌ها را پاک می‌کند.
+    شمارنده version با هر باطل‌سازی بالا می‌رود تا داده‌ای که پیش از باطل‌سازی از دیتابیس خوانده شده، ذخیره نشود.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.version = 0
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, user_id: int, kind: str) -> Tuple[Any, int]:
+        """(مقدار یا _MISSING، نسخه فعلی حافظه) را برمی‌گرداند."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or kind not in entry:
+                return _MISSING, self.version
+            self._entries.move_to_end(user_id)
+            return entry[kind], self.version
+
+    def put(self, user_id: int, kind: str, value: Any, version: int) -> None:
+        """مقدار را فقط اگر از زمان خواندن آن (version) باطل‌سازی‌ای رخ نداده باشد ذخیره می‌کند."""
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries.setdefault(user_id, {})[kind] = value
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            self.version += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def get_or_load(self, user_id: int, kind: str, loader: Callable[[int], Any]) -> Any:
+        value, version = self.lookup(user_id, kind)
+        if value is _MISSING:
+            value = loader(user_id)
+            self.put(user_id, kind, value, version)
+        return value
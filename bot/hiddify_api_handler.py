@@ -4,8 +4,7 @@ from typing import Dict, Any, Optional, List
 import pytz
 import requests
 from requests.adapters import HTTPAdapter, Retry
-from cachetools import cached
-from .config import HIDDIFY_DOMAIN, ADMIN_PROXY_PATH, ADMIN_UUID, API_TIMEOUT, api_cache
+from .config import HIDDIFY_DOMAIN, ADMIN_PROXY_PATH, ADMIN_UUID, API_TIMEOUT
 from .utils import safe_float
 from requests.exceptions import RequestException
 
@@ -96,7 +95,6 @@ class HiddifyAPIHandler:
             }
             return normalized_data
 
-    @cached(api_cache)
     def get_all_users(self) -> List[Dict[str, Any]]:
         """فقط کاربران پنل Hiddify را برمیگرداند."""
         data = self._request("GET", "/user/")
@@ -1,11 +1,13 @@
 import requests
 import logging
 import json
+import base64
+import threading
+import time
 from datetime import datetime, timedelta
 import pytz
 import os
-from .config import MARZBAN_API_BASE_URL, MARZBAN_API_USERNAME, MARZBAN_API_PASSWORD, API_TIMEOUT, api_cache
-from cachetools import cached
+from .config import MARZBAN_API_BASE_URL, MARZBAN_API_USERNAME, MARZBAN_API_PASSWORD, API_TIMEOUT, TOKEN_REFRESH_MARGIN_SECONDS
 from typing import Dict, Any, Optional
 
 logger = logging.getLogger(__name__)
@@ -25,6 +27,8 @@ class MarzbanAPIHandler:
         self.username = panel_config.get("api_token1")
         self.password = panel_config.get("api_token2")
         self.access_token = None
+        self.token_expires_at = 0.0
+        self._token_lock = threading.Lock()
         self.utc_tz = pytz.utc
         self.session = self._create_session()
 
@@ -32,6 +36,23 @@ class MarzbanAPIHandler:
         session = requests.Session()
         return session
 
+    @staticmethod
+    def _read_token_expiry(token: str) -> float:
+        """Reads the `exp` claim of a JWT without verifying it. Returns 0 if it can't be read."""
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            return float(json.loads(base64.urlsafe_b64decode(payload)).get('exp') or 0)
+        except (IndexError, ValueError, TypeError, AttributeError):
+            return 0.0
+
+    def _token_is_valid(self) -> bool:
+        """True if we hold a token that is not about to expire."""
+        if not self.access_token:
+            return False
+        # Tokens without a readable expiry are kept until the panel answers 401.
+        return not self.token_expires_at or time.time() < self.token_expires_at - TOKEN_REFRESH_MARGIN_SECONDS
+
     def _get_access_token(self) -> bool:
         """Fetches and sets the access token. Returns True on success, False on failure."""
         try:
@@ -41,6 +62,7 @@ class MarzbanAPIHandler:
             response.raise_for_status()
             self.access_token = response.json().get("access_token")
             if self.access_token:
+                self.token_expires_at = self._read_token_expiry(self.access_token)
                 logger.info("Marzban: Successfully obtained new access token.")
                 self.session.headers.update({"Authorization": f"Bearer {self.access_token}", "Accept": "application/json"})
                 return True
@@ -49,12 +71,24 @@ class MarzbanAPIHandler:
         except requests.exceptions.RequestException as e:
             logger.error(f"Marzban: Failed to get access token: {e}", exc_info=True)
             self.access_token = None
+            self.token_expires_at = 0.0
             return False
+
+    def _ensure_access_token(self, stale_token: Optional[str] = None) -> bool:
+        """
+        Makes sure a usable token is held, logging in at most once even when
+        several threads share this handler. `stale_token` forces a refresh if
+        it is still the current token (i.e. the panel rejected it).
+        """
+        with self._token_lock:
+            if self._token_is_valid() and (stale_token is None or self.access_token != stale_token):
+                return True
+            return self._get_access_token()
         
     def _request(self, method, endpoint, retry=True, **kwargs):
         """A central request function with automatic token refresh."""
-        if not self.access_token:
-            if not self._get_access_token():
+        if not self._token_is_valid():
+            if not self._ensure_access_token():
                 return None
 
         url = f"{self.api_base_url}/{endpoint.strip('/')}"
@@ -65,7 +99,7 @@ class MarzbanAPIHandler:
             response = self.session.request(method, url, timeout=API_TIMEOUT, **kwargs) 
             if response.status_code == 401 and retry:
                 logger.warning("Marzban: Access token expired or invalid. Retrying to get a new one.")
-                if self._get_access_token():
+                if self._ensure_access_token(stale_token=headers["Authorization"][len("Bearer "):]):
                     kwargs['headers'] = self.session.headers
                     return self._request(method, endpoint, retry=False, **kwargs)
 
@@ -146,23 +180,23 @@ class MarzbanAPIHandler:
     def get_user_info(self, uuid: str) -> dict | None:
         from .database import db
         """Gets a single user's details from Marzban by their Hiddify UUID."""
-        if not self.access_token:
-            if not self._get_access_token():
+        if not self._token_is_valid():
+            if not self._ensure_access_token():
                 return None
         
-        marzban_username = db.get_marzban_username_by_uuid(uuid)
+        marzban_username = db.get_marzban_mapping_index()['by_uuid'].get(uuid.lower())
         if not marzban_username:
             return None
 
         return self.get_user_by_username(marzban_username)
 
-    @cached(api_cache)
     def get_all_users(self) -> list[dict]:
             from .database import db
             all_users_raw = self._request("GET", "/users")
             if not all_users_raw or 'users' not in all_users_raw:
                 return []
 
+            uuid_by_username = db.get_marzban_mapping_index()['by_username']
             normalized_users = []
             for user in all_users_raw['users']:
                 username = user.get("username")
@@ -175,7 +209,7 @@ class MarzbanAPIHandler:
                 data_limit = user.get('data_limit')
                 limit_gb = round(data_limit / (1024**3), 3) if data_limit is not None else 0
                 
-                uuid = db.get_uuid_by_marzban_username(username)
+                uuid = uuid_by_username.get(username)
                 expire_timestamp = user.get('expire')
                 expire_days = None
                 if expire_timestamp and expire_timestamp > 0:
@@ -193,6 +227,7 @@ class MarzbanAPIHandler:
                     "remaining_GB": max(0, limit_gb - usage_gb),
                     "usage_percentage": (usage_gb / limit_gb * 100) if limit_gb > 0 else 0,
                     "expire": expire_days,
+                    "expire_ts": expire_timestamp,
                 }
                 normalized_users.append(normalized_data)
                 
@@ -203,7 +238,7 @@ class MarzbanAPIHandler:
         user = self._request("GET", f"/user/{username}")
         if not user: return None
 
-        uuid = db.get_uuid_by_marzban_username(username)
+        uuid = db.get_marzban_mapping_index()['by_username'].get(username)
         usage_gb = user.get('used_traffic', 0) / (1024 ** 3)
         limit_gb = round(user.get('data_limit', 0) / (1024 ** 3), 3)
         expire_timestamp = user.get('expire')
@@ -218,7 +253,7 @@ class MarzbanAPIHandler:
             "usage_limit_GB": limit_gb, "current_usage_GB": usage_gb,
             "remaining_GB": max(0, limit_gb - usage_gb),
             "usage_percentage": (usage_gb / limit_gb * 100) if limit_gb > 0 else 0,
-            "expire": expire_days,
+            "expire": expire_days, "expire_ts": expire_timestamp,
         }
         return normalized_data
 
@@ -704,15 +704,18 @@ class Menu:
     
     # Utility & Helper Menus
     # =============================================================================
-    def create_pagination_menu(self, base_callback: str, current_page: int, total_items: int, back_callback: str, lang_code: Optional[str] = None, context: Optional[str] = None) -> types.InlineKeyboardMarkup:
+    def create_pagination_menu(self, base_callback: str, current_page: int, total_items: int, back_callback: str, lang_code: Optional[str] = None, context: Optional[str] = None, refresh_callback: Optional[str] = None) -> types.InlineKeyboardMarkup:
         effective_lang_code = lang_code or 'fa'
         kb = types.InlineKeyboardMarkup(row_width=2)
         
         back_text = f"🔙 {get_string('back', effective_lang_code)}"
         prev_text = f"⬅️ {get_string('btn_prev_page', effective_lang_code)}"
         next_text = f"{get_string('btn_next_page', effective_lang_code)} ➡️"
+        refresh_button = types.InlineKeyboardButton("🔄 بروزرسانی", callback_data=refresh_callback) if refresh_callback else None
 
         if total_items <= PAGE_SIZE:
+            if refresh_button:
+                kb.add(refresh_button)
             kb.add(types.InlineKeyboardButton(back_text, callback_data=back_callback))
             return kb
 
@@ -730,6 +733,8 @@ class Menu:
         if nav_buttons:
             kb.row(*nav_buttons)
 
+        if refresh_button:
+            kb.add(refresh_button)
         kb.add(types.InlineKeyboardButton(back_text, callback_data=back_callback))
         return kb
 
@@ -0,0 +1,78 @@
+# bot/report_bundle.py
+"""
+داده‌های لازم برای ساخت گزارش‌های زمان‌بندی‌شده (شبانه و هفتگی) که با چند کوئری مجموعه‌ای
+و یکجا از دیتابیس خوانده می‌شوند. فرمت‌کننده‌ها به جای کوئری‌های جداگانه برای هر کاربر و هر اکانت،
+از همین بسته در حافظه استفاده می‌کنند.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .database import db
+
+logger = logging.getLogger(__name__)
+
+_ACCESS_KEYS = ('has_access_de', 'has_access_fr', 'has_access_tr', 'has_access_us', 'has_access_al',
+                'has_access_nl', 'has_access_ro', 'has_access_ir', 'has_access_supp')
+_ZERO_USAGE = {'hiddify': 0.0, 'marzban': 0.0}
+
+
+class ReportBundle:
+    def __init__(self, recipients: Dict[int, Dict[str, Any]], daily_usage: Optional[Dict[str, Dict[str, float]]] = None,
+                 usage_history: Optional[Dict[int, list]] = None, achievements: Optional[Dict[int, List[dict]]] = None):
+        self.recipients = recipients
+        self.daily_usage = daily_usage or {}
+        self.usage_history = usage_history or {}
+        self.achievements = achievements or {}
+        self._uuid_records = {row['uuid']: row for r in recipients.values() for row in r['uuids']}
+
+    @classmethod
+    def load(cls, user_id: Optional[int] = None, today_usage: bool = False, history_days: Optional[int] = None,
+             achievements_since: Optional[datetime] = None) -> "ReportBundle":
+        """
+        بسته را با کوئری‌های مجموعه‌ای می‌سازد. فقط بخش‌هایی که خواسته شده‌اند خوانده می‌شوند:
+        today_usage برای گزارش شبانه و history_days / achievements_since برای گزارش هفتگی.
+        """
+        recipients = db.get_report_recipients(user_id)
+        bundle = cls(
+            recipients,
+            daily_usage=db.get_all_daily_usage_since_midnight() if today_usage else None,
+            usage_history=db.get_all_daily_usage_history_by_panel(history_days) if history_days else None,
+            achievements=db.get_all_achievements_in_range(achievements_since) if achievements_since else None,
+        )
+        logger.info(f"ReportBundle: Loaded {len(recipients)} user(s) and {len(bundle._uuid_records)} active account(s).")
+        return bundle
+
+    def settings(self, user_id: int) -> Dict[str, bool]:
+        recipient = self.recipients.get(user_id)
+        return recipient['settings'] if recipient else {}
+
+    def lang_code(self, user_id: int) -> str:
+        recipient = self.recipients.get(user_id)
+        return recipient['lang_code'] if recipient else 'fa'
+
+    def uuids(self, user_id: int) -> List[Dict[str, Any]]:
+        recipient = self.recipients.get(user_id)
+        return recipient['uuids'] if recipient else []
+
+    def user_record(self, uuid_str: str) -> Optional[Dict[str, Any]]:
+        """معادل db.get_user_uuid_record (فقط رکوردهای فعال)."""
+        return self._uuid_records.get(uuid_str)
+
+    def access_rights(self, user_id: int) -> Dict[str, bool]:
+        """معادل db.get_user_access_rights؛ دسترسی بر اساس اولین اکانت ثبت شده کاربر تعیین می‌شود."""
+        access_rights = {key: False for key in _ACCESS_KEYS}
+        user_uuids = self.uuids(user_id)
+        if user_uuids:
+            for key in _ACCESS_KEYS:
+                access_rights[key] = user_uuids[0].get(key, False)
+        return access_rights
+
+    def usage_since_midnight(self, uuid_str: str) -> Dict[str, float]:
+        return dict(self.daily_usage.get(uuid_str, _ZERO_USAGE))
+
+    def daily_usage_history(self, uuid_id: int) -> list:
+        return self.usage_history.get(uuid_id, [])
+
+    def achievements_for(self, user_id: int) -> List[dict]:
+        return self.achievements.get(user_id, [])
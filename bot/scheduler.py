@@ -5,8 +5,9 @@ import schedule
 import pytz
 from telebot import TeleBot
 
-from bot.config import DAILY_REPORT_TIME, TEHRAN_TZ, USAGE_WARNING_CHECK_HOURS, ONLINE_REPORT_UPDATE_HOURS
+from bot.config import DAILY_REPORT_TIME, TEHRAN_TZ, USAGE_WARNING_CHECK_HOURS, ONLINE_REPORT_UPDATE_HOURS, USER_DIRECTORY_SYNC_MINUTES
 from bot.scheduler_jobs import reports, warnings, rewards, maintenance
+from bot.combined_handler import lookup_scope
 from .scheduler_jobs import financials
 
 
@@ -26,7 +27,8 @@ class SchedulerManager:
         with scheduler_lock:
             try:
                 # نمونه bot را به عنوان اولین آرگومان به تابع وظیفه پاس می‌دهیم
-                job_func(self.bot, *args, **kwargs)
+                with lookup_scope():
+                    job_func(self.bot, *args, **kwargs)
             except Exception as e:
                 logger.error(f"SCHEDULER: A critical error occurred in job '{job_func.__name__}': {e}", exc_info=True)
         logger.info(f"SCHEDULER: Job finished: {job_func.__name__}")
@@ -58,6 +60,7 @@ class SchedulerManager:
         schedule.every().day.at("00:15", self.tz_str).do(self._run_job, rewards.check_for_special_occasions)
         schedule.every().day.at("04:30", self.tz_str).do(self._run_job, rewards.check_auto_renewals_and_warnings)
         schedule.every(12).hours.do(self._run_job, maintenance.sync_users_with_panels)
+        schedule.every(USER_DIRECTORY_SYNC_MINUTES).minutes.do(self._run_job, maintenance.sync_user_directory)
         schedule.every(8).hours.do(self._run_job, maintenance.cleanup_old_reports)
         schedule.every().friday.at("16:00", self.tz_str).do(self._run_job, reports.send_monthly_satisfaction_survey)
         schedule.every().day.at("04:00", self.tz_str).do(self._run_job, maintenance.run_monthly_vacuum)
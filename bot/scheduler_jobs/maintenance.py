@@ -20,13 +20,20 @@ def hourly_snapshots(bot) -> None:
     """
     logger.info("SCHEDULER (Snapshot): Starting hourly usage snapshot job.")
     try:
-        all_users_info = combined_handler.get_all_users_combined()
+        # پس از اولین استقرار جدول daily_usage، سابقه قبلی یک بار از روی اسنپ‌شات‌ها ساخته می‌شود
+        db.ensure_daily_usage_backfilled()
+        all_users_info = combined_handler.get_all_users_combined(fresh=True)
         if not all_users_info:
             logger.warning("SCHEDULER (Snapshot): No user info could be fetched. Aborting job.")
             return
-        
+        if getattr(all_users_info, 'missing_panels', None):
+            # مصرف کاربران پنل‌های جاافتاده صفر ثبت می‌شد و محاسبه مصرف روزانه را خراب می‌کرد
+            logger.warning(f"SCHEDULER (Snapshot): Panels {all_users_info.missing_panels} did not respond. Skipping this hour's snapshot.")
+            return
+
         user_info_map = {user['uuid']: user for user in all_users_info if user.get('uuid')}
         all_uuids_from_db = list(db.all_active_uuids())
+        snapshot_rows = []
         
         for u_row in all_uuids_from_db:
             try:
@@ -44,10 +51,13 @@ def hourly_snapshots(bot) -> None:
                         elif panel_type == 'marzban':
                             m_usage += panel_data.get('current_usage_GB', 0.0)
                     
-                    db.add_usage_snapshot(u_row['id'], h_usage, m_usage)
+                    snapshot_rows.append((u_row['id'], h_usage, m_usage))
             except Exception as e:
                 logger.error(f"SCHEDULER (Snapshot): Failed to process for uuid_id {u_row['id']}: {e}")
-        logger.info("SCHEDULER (Snapshot): Finished hourly usage snapshot job successfully.")
+
+        # کل اسنپ‌شات این ساعت در یک تراکنش نوشته می‌شود
+        written = db.add_usage_snapshots_bulk(snapshot_rows)
+        logger.info(f"SCHEDULER (Snapshot): Finished hourly usage snapshot job successfully. {written}/{len(snapshot_rows)} snapshots written (unchanged ones skipped).")
     except Exception as e:
         logger.error(f"SCHEDULER (Snapshot): A critical error occurred: {e}", exc_info=True)
 
@@ -77,6 +87,28 @@ def update_online_reports(bot) -> None:
             else:
                 logger.error(f"Scheduler: Failed to update online report for chat {msg_info['chat_id']}: {e}")
 
+def _store_user_directory(all_users) -> None:
+    """لیست ترکیبی کاربران را در جدول panel_users (لیست کاربران پنل ادمین) ذخیره می‌کند."""
+    if getattr(all_users, 'missing_panels', None):
+        # با داده ناقص، کاربران پنل‌های جاافتاده از جدول حذف می‌شدند
+        logger.warning(f"SYNCER: Panels {all_users.missing_panels} did not respond. Skipping user directory refresh.")
+        return
+    stored, removed = db.sync_panel_users(all_users)
+    logger.info(f"SYNCER: User directory refreshed ({stored} stored, {removed} removed).")
+
+
+def sync_user_directory(bot) -> None:
+    """جدول panel_users را از روی اسنپ‌شات لیست ترکیبی کاربران تازه می‌کند."""
+    try:
+        all_users = combined_handler.get_all_users_combined()
+        if not all_users:
+            logger.warning("SYNCER: Fetched user list from panels is empty. Skipping user directory refresh.")
+            return
+        _store_user_directory(all_users)
+    except Exception as e:
+        logger.error(f"SYNCER: Failed to refresh user directory: {e}", exc_info=True)
+
+
 def sync_users_with_panels(bot):
     """
     (نسخه اصلاح شده با اجرای غیرمسدود دیتابیس)
@@ -105,6 +137,8 @@ def sync_users_with_panels(bot):
             db_users_map = {user['uuid']: user for user in db_users} if db_users else {}
 
             logger.info(f"SYNCER: Fetched {len(all_users_from_api)} users from panels and {len(db_users_map)} users from local DB.")
+
+            await loop.run_in_executor(None, _store_user_directory, all_users_from_api)
             
             update_tasks = []
 
@@ -178,6 +212,7 @@ def run_monthly_vacuum(bot) -> None:
     اسنپ‌شات‌های قدیمی را حذف کرده و در روز اول هر ماه، دیتابیس را بهینه‌سازی می‌کند.
     """
     db.delete_old_snapshots(days_to_keep=32)
+    db.delete_old_user_cache_log(hours=24)
     if datetime.now(pytz.timezone("Asia/Tehran")).day == 1:
         logger.info("SCHEDULER: It's the first day of the month. Running database VACUUM.")
         db.vacuum_db()
\ No newline at end of file
@@ -8,6 +8,8 @@ from ..menu import menu
 
 from bot import combined_handler
 from bot.database import db
+from bot.report_bundle import ReportBundle
+from bot.broadcast_engine import send_paced
 from bot.utils import escape_markdown
 from bot.admin_formatters import fmt_admin_report, fmt_weekly_admin_summary, fmt_daily_achievements_report
 from bot.user_formatters import fmt_user_report, fmt_user_weekly_report, fmt_user_monthly_report
@@ -16,10 +18,30 @@ from bot.language import get_string
 
 logger = logging.getLogger(__name__)
 
+def _deliver_reports(bot, bundle: ReportBundle, messages: list, label: str) -> None:
+    """
+    گزارش‌های ساخته‌شده را با ارسال‌کننده زمان‌بندی‌شده می‌فرستد و شناسه پیام‌ها را یکجا ثبت می‌کند.
+    UUID های کاربرانی که ربات را بلاک کرده‌اند غیرفعال می‌شوند.
+    """
+    sent_records = []
+    for user_id, sent_message, error in send_paced(bot, messages, label=f"SCHEDULER ({label})"):
+        if sent_message:
+            sent_records.append((user_id, sent_message.message_id))
+        elif isinstance(error, apihelper.ApiTelegramException) and "bot was blocked by the user" in str(error.description):
+            logger.warning(f"SCHEDULER ({label}): User {user_id} blocked bot. Deactivating UUIDs.")
+            for u in bundle.uuids(user_id):
+                db.deactivate_uuid(u['id'])
+        elif error is not None:
+            logger.error(f"SCHEDULER ({label}): API error for user {user_id}: {error}")
+    db.add_sent_reports(sent_records)
+    logger.info(f"SCHEDULER ({label}): Delivered {len(sent_records)}/{len(messages)} report(s).")
+
+
 def nightly_report(bot, target_user_id: int = None) -> None:
     """
     گزارش شبانه را برای کاربران و گزارش جامع را برای ادمین‌ها ارسال می‌کند.
-    (نسخه اصلاح شده با مدیریت خطا در حلقه)
+    داده‌های تمام کاربران (تنظیمات، زبان، اکانت‌ها و مصرف امروز) ابتدا یکجا خوانده و گزارش‌ها در حافظه ساخته می‌شوند،
+    سپس ارسال با محدودکننده نرخ انجام می‌شود؛ بنابراین اعداد «امروز» حتی اگر ارسال از نیمه‌شب بگذرد ثابت می‌مانند.
     """
     tehran_tz = pytz.timezone("Asia/Tehran")
     now_gregorian = datetime.now(tehran_tz)
@@ -35,17 +57,24 @@ def nightly_report(bot, target_user_id: int = None) -> None:
         return
         
     user_info_map = {user['uuid']: user for user in all_users_info_from_api}
-    
-    user_ids_to_process = [target_user_id] if target_user_id else list(db.get_all_user_ids())
+    bundle = ReportBundle.load(user_id=target_user_id, today_usage=True)
+
+    user_ids_to_process = [target_user_id] if target_user_id else list(bundle.recipients)
     separator = '\n' + '─' * 18 + '\n'
+    user_header = f"🌙 *گزارش شبانه* {escape_markdown('-')} {escape_markdown(now_str)}{separator}"
+    admin_full_message = None
+    messages = []
 
     for user_id in user_ids_to_process:
         try:
             # گزارش جامع برای ادمین‌ها (همیشه ارسال می‌شود)
             if user_id in ADMIN_IDS:
-                admin_header = f"👑 *گزارش جامع* {escape_markdown('-')} {escape_markdown(now_str)}{separator}"
-                admin_report_text = fmt_admin_report(all_users_info_from_api, db)
-                admin_full_message = admin_header + admin_report_text
+                if admin_full_message is None:
+                    admin_header = f"👑 *گزارش جامع* {escape_markdown('-')} {escape_markdown(now_str)}{separator}"
+                    if getattr(all_users_info_from_api, 'missing_panels', None):
+                        missing_str = escape_markdown(f"⚠️ پنل‌های {', '.join(all_users_info_from_api.missing_panels)} پاسخ ندادند؛ این گزارش ناقص است.")
+                        admin_header += f"{missing_str}\n\n"
+                    admin_full_message = admin_header + fmt_admin_report(all_users_info_from_api, db)
                 
                 if len(admin_full_message) > 4096:
                     chunks = [admin_full_message[i:i + 4090] for i in range(0, len(admin_full_message), 4090)]
@@ -62,45 +91,38 @@ def nightly_report(bot, target_user_id: int = None) -> None:
                 continue
 
             # گزارش شخصی برای همه کاربران (شامل ادمین‌ها)
-            user_settings = db.get_user_settings(user_id)
+            user_settings = bundle.settings(user_id)
             if not user_settings.get('daily_reports', True) and not target_user_id:
                 continue
 
-            user_uuids_from_db = db.uuids(user_id)
-            user_infos_for_report = []
-            
-            for u_row in user_uuids_from_db:
-                if u_row['uuid'] in user_info_map:
-                    user_data = user_info_map[u_row['uuid']]
-                    user_data['db_id'] = u_row['id'] 
-                    user_infos_for_report.append(user_data)
+            user_infos_for_report = [
+                dict(user_info_map[u_row['uuid']], db_id=u_row['id'])
+                for u_row in bundle.uuids(user_id) if u_row['uuid'] in user_info_map
+            ]
             
             if user_infos_for_report:
-                user_header = f"🌙 *گزارش شبانه* {escape_markdown('-')} {escape_markdown(now_str)}{separator}"
-                lang_code = db.get_user_language(user_id)
-                user_report_text = fmt_user_report(user_infos_for_report, lang_code)
-                user_full_message = user_header + user_report_text
-                
-                sent_message = bot.send_message(user_id, user_full_message, parse_mode="MarkdownV2")
-                if sent_message:
-                    db.add_sent_report(user_id, sent_message.message_id)
+                lang_code = bundle.lang_code(user_id)
+                user_report_text = fmt_user_report(user_infos_for_report, lang_code, bundle=bundle)
+                messages.append((user_id, user_header + user_report_text))
 
         except apihelper.ApiTelegramException as e:
             if "bot was blocked by the user" in e.description:
                 logger.warning(f"SCHEDULER: User {user_id} blocked bot. Deactivating UUIDs.")
-                for u in db.uuids(user_id):
+                for u in bundle.uuids(user_id):
                     db.deactivate_uuid(u['id'])
             else:
                 logger.error(f"SCHEDULER: API error for user {user_id}: {e}")
         except Exception as e:
             logger.error(f"SCHEDULER: CRITICAL FAILURE for user {user_id}: {e}", exc_info=True)
+
+    _deliver_reports(bot, bundle, messages, "Nightly")
     logger.info("SCHEDULER: ----- Finished nightly report job -----")
 
 
 def weekly_report(bot, target_user_id: int = None) -> None:
     """
     گزارش هفتگی مصرف را برای کاربران ارسال می‌کند.
-    (نسخه اصلاح شده با مدیریت خطا در حلقه)
+    مانند گزارش شبانه، داده‌ها یکجا خوانده، گزارش‌ها در حافظه ساخته و سپس با محدودکننده نرخ ارسال می‌شوند.
     """
     # --- بررسی تداخل با گزارش ماهانه ---
     if not target_user_id: # اگر تست دستی ادمین نبود
@@ -122,37 +144,30 @@ def weekly_report(bot, target_user_id: int = None) -> None:
     if not all_users_info:
         return
     user_info_map = {u['uuid']: u for u in all_users_info}
+    bundle = ReportBundle.load(user_id=target_user_id, history_days=7, achievements_since=db.get_week_start_utc())
     
-    user_ids_to_process = [target_user_id] if target_user_id else list(db.get_all_user_ids())
+    user_ids_to_process = [target_user_id] if target_user_id else list(bundle.recipients)
     separator = '\n' + '─' * 18 + '\n'
+    header = f"📊 *گزارش هفتگی* {escape_markdown('-')} {escape_markdown(now_str)}{separator}"
+    messages = []
 
     for user_id in user_ids_to_process:
         try:
-            user_settings = db.get_user_settings(user_id)
+            user_settings = bundle.settings(user_id)
             if not user_settings.get('weekly_reports', True) and not target_user_id:
                 continue
 
-            user_uuids = db.uuids(user_id)
-            user_infos = [user_info_map[u['uuid']] for u in user_uuids if u['uuid'] in user_info_map]
+            user_infos = [user_info_map[u['uuid']] for u in bundle.uuids(user_id) if u['uuid'] in user_info_map]
             
             if user_infos:
-                header = f"📊 *گزارش هفتگی* {escape_markdown('-')} {escape_markdown(now_str)}{separator}"
-                lang_code = db.get_user_language(user_id)
-                report_text = fmt_user_weekly_report(user_infos, lang_code)
-                final_message = header + report_text
-                sent_message = bot.send_message(user_id, final_message, parse_mode="MarkdownV2")
-                if sent_message:
-                    db.add_sent_report(user_id, sent_message.message_id)
-        except apihelper.ApiTelegramException as e:
-            if "bot was blocked by the user" in e.description:
-                logger.warning(f"SCHEDULER (Weekly): User {user_id} blocked bot. Deactivating.")
-                for u in db.uuids(user_id):
-                    db.deactivate_uuid(u['id'])
-            else:
-                logger.error(f"SCHEDULER (Weekly): API error for user {user_id}: {e}")
+                lang_code = bundle.lang_code(user_id)
+                report_text = fmt_user_weekly_report(user_infos, lang_code, bundle=bundle)
+                messages.append((user_id, header + report_text))
         except Exception as e:
             logger.error(f"SCHEDULER (Weekly): Failure for user {user_id}: {e}", exc_info=True)
 
+    _deliver_reports(bot, bundle, messages, "Weekly")
+
 
 def send_weekly_admin_summary(bot) -> None:
     """
@@ -10,7 +10,8 @@ from telebot import types
 
 from bot import combined_handler
 from bot.database import db
-from bot.utils import escape_markdown, load_json_file, load_service_plans, parse_volume_string, days_until_next_birthday
+from bot.utils import escape_markdown, load_json_file, days_until_next_birthday
+from bot.catalog import get_plan_catalog
 from bot.config import (
     ADMIN_IDS, BIRTHDAY_GIFT_GB, BIRTHDAY_GIFT_DAYS,
     ACHIEVEMENTS, ENABLE_LUCKY_LOTTERY, LUCKY_LOTTERY_BADGE_REQUIREMENT,
@@ -544,57 +545,62 @@ def send_weekend_normal_user_message(bot) -> None:
             logger.error(f"Failed to send normal user message to user {user_id}: {e}")
 
 
+# کلید حجم پلن برای هر نوع پنل هنگام تمدید خودکار: {نوع پلن: {نوع پنل: کلید حجم}}
+# سایر پلن‌های اختصاصی (ترکیه و ...) حجم volume_tr را روی پنل مرزبان می‌گیرند
+_RENEWAL_VOLUME_KEYS = {
+    'combined': {'hiddify': 'volume_de', 'marzban': 'volume_fr'},
+    'germany': {'hiddify': 'volume_de'},
+    'france': {'marzban': 'volume_fr'},
+}
+_DEFAULT_RENEWAL_VOLUME_KEYS = {'marzban': 'volume_tr'}
+_LOW_BALANCE_WARNING_HOURS = 72
+
+
 def check_auto_renewals_and_warnings(bot) -> None:
     """
-    (نسخه کامل و نهایی)
     هر روز اجرا شده و وضعیت تمدید خودکار و هشدارهای کمبود موجودی را بررسی می‌کند.
+    کاربران تمدید خودکار با یک کوئری، اطلاعات پنل‌ها از اسنپ‌شات مشترک get_all_users_combined و پلن فعلی
+    هر کاربر از ایندکس حجم کاتالوگ پلن‌ها خوانده می‌شود؛ تمدیدها برای هر پلن با bulk_modify_users اعمال می‌شوند.
     """
     from .warnings import send_warning_message
     logger.info("SCHEDULER: Starting auto-renewal and low balance check job.")
-    users_with_auto_renew = [u for u in db.get_all_user_ids() if (ud := db.user(u)) and ud.get('auto_renew')]
+    candidates = db.get_auto_renew_candidates()
+    if not candidates:
+        logger.info("SCHEDULER: No users with auto-renewal enabled.")
+        return
 
-    for user_id in users_with_auto_renew:
+    snapshot = combined_handler.get_all_users_combined()
+    users_info_map = {u['uuid']: u for u in snapshot if u.get('uuid')}
+    if snapshot.is_partial:
+        # حجم و پنل‌های کاربران پنل بدون پاسخ ناقص است؛ اطلاعات این اجرا تک‌به‌تک از پنل‌ها خوانده می‌شود
+        logger.warning(f"SCHEDULER: Panel snapshot is partial (missing: {', '.join(snapshot.missing_panels)}). "
+                       f"Fetching {len(candidates)} auto-renew user(s) individually.")
+        users_info_map = None
+
+    catalog = get_plan_catalog()
+    recent_warnings = db.get_recent_warnings(hours=_LOW_BALANCE_WARNING_HOURS)
+    renewals = {}  # {plan.index: [(candidate, user_info), ...]}
+    warning_logs = []
+
+    for candidate in candidates:
+        user_id = candidate['user_id']
         try:
-            user_uuids = db.uuids(user_id)
-            if not user_uuids: continue
-
-            uuid_record = user_uuids[0]
-            user_info = combined_handler.get_combined_user_info(uuid_record['uuid'])
-
+            if users_info_map is None:
+                user_info = get_combined_user_info(candidate['uuid'])
+            else:
+                user_info = users_info_map.get(candidate['uuid'])
             if not user_info or user_info.get('expire') is None: continue
 
             expire_days = user_info['expire']
-            user_balance = (db.user(user_id) or {}).get('wallet_balance', 0.0)
-            plan_price = db.get_user_latest_plan_price(uuid_record['id'])
+            user_balance = candidate['wallet_balance']
+            plan_info = catalog.by_limit_gb.get(int(user_info.get('usage_limit_GB', -1)))
+            plan_price = plan_info.price if plan_info else None
 
             if expire_days == 1 and plan_price and user_balance >= plan_price:
-                plan_info = next((p for p in load_service_plans() if p.get('price') == plan_price), None)
-                if not plan_info:
-                    logger.warning(f"Auto-renewal failed for user {user_id}: Could not find a plan with price {plan_price}.")
-                    continue
-
-                add_days = parse_volume_string(plan_info.get('duration', '0'))
-                if add_days > 0:
-                    combined_handler.modify_user_on_all_panels(uuid_record['uuid'], add_days=add_days)
-
-                plan_type = plan_info.get('type')
-                if plan_type == 'combined':
-                    add_gb_de = parse_volume_string(plan_info.get('volume_de', '0'))
-                    add_gb_fr_tr = parse_volume_string(plan_info.get('volume_fr', '0'))
-                    combined_handler.modify_user_on_all_panels(uuid_record['uuid'], add_gb=add_gb_de, target_panel_type='hiddify')
-                    combined_handler.modify_user_on_all_panels(uuid_record['uuid'], add_gb=add_gb_fr_tr, target_panel_type='marzban')
-                else:
-                    target_panel = 'hiddify' if plan_type == 'germany' else 'marzban'
-                    volume_key = 'volume_de' if plan_type == 'germany' else 'volume_fr' if plan_type == 'france' else 'volume_tr'
-                    add_gb = parse_volume_string(plan_info.get(volume_key, '0'))
-                    combined_handler.modify_user_on_all_panels(uuid_record['uuid'], add_gb=add_gb, target_panel_type=target_panel)
-                
-                db.update_wallet_balance(user_id, -plan_price, 'auto_renewal', f"تمدید خودکار سرویس: {plan_info.get('name')}")
-                bot.send_message(user_id, f"✅ سرویس شما با موفقیت به صورت خودکار تمدید شد. مبلغ {plan_price:,.0f} تومان از حساب شما کسر گردید.", parse_mode="MarkdownV2")
-                logger.info(f"Auto-renewal successful for user {user_id} with plan '{plan_info.get('name')}'.")
+                renewals.setdefault(plan_info.index, []).append((candidate, user_info))
 
             elif 1 < expire_days <= 3 and plan_price and user_balance < plan_price:
-                if not db.has_recent_warning(uuid_record['id'], 'low_balance_for_renewal', hours=72):
+                if (candidate['uuid_id'], 'low_balance_for_renewal') not in recent_warnings:
                     needed_amount = plan_price - user_balance
                     msg = (
                         f"⚠️ *هشدار کمبود موجودی برای تمدید خودکار*\n\n"
@@ -602,11 +608,62 @@ def check_auto_renewals_and_warnings(bot) -> None:
                         f"برای تمدید، نیاز به شارژ حساب به مبلغ حداقل *{needed_amount:,.0f} تومان* دارید\\."
                     )
                     if send_warning_message(bot, user_id, msg):
-                        db.log_warning(uuid_record['id'], 'low_balance_for_renewal')
+                        warning_logs.append((candidate['uuid_id'], 'low_balance_for_renewal'))
 
         except Exception as e:
             logger.error(f"Error during auto-renewal check for user {user_id}: {e}", exc_info=True)
 
+    db.save_warning_batch(warning_logs, [])
+    for plan_index, items in renewals.items():
+        try:
+            _apply_auto_renewals(bot, catalog.plans[plan_index], items)
+        except Exception as e:
+            logger.error(f"Error during auto-renewal of plan index {plan_index}: {e}", exc_info=True)
+
+    logger.info(f"SCHEDULER: Auto-renewal check finished: {len(candidates)} candidate(s), "
+                f"{sum(len(items) for items in renewals.values())} renewal(s), {len(warning_logs)} low balance warning(s).")
+
+
+def _apply_auto_renewals(bot, plan_info, items) -> None:
+    """
+    یک پلن را برای همه کاربران آن (candidate، user_info) تمدید می‌کند: برای هر نوع پنل یک فراخوان bulk_modify_users
+    (روزها روی همه پنل‌ها و حجم فقط روی پنل مربوط به پلن). فقط از کاربرانی که تمدید روی تمام پنل‌هایشان موفق بود
+    مبلغ کسر می‌شود؛ تمدید ناقص (partial) برای بررسی دستی ادمین ثبت شده و هزینه‌ای برنمی‌دارد.
+    """
+    volume_keys = _RENEWAL_VOLUME_KEYS.get(plan_info.type, _DEFAULT_RENEWAL_VOLUME_KEYS)
+    add_days = max(plan_info.days, 0)
+    target_users = [user_info for _, user_info in items]
+
+    renewed_uuids, incomplete_uuids = set(), set()
+    for panel_type in ('hiddify', 'marzban'):
+        add_gb = plan_info.gb(volume_keys[panel_type]) if panel_type in volume_keys else 0
+        if add_gb <= 0 and add_days <= 0:
+            continue
+        report = combined_handler.bulk_modify_users(target_users, add_gb=add_gb, add_days=add_days, target_panel_type=panel_type)
+        renewed_uuids.update(item['uuid'] for item in report['succeeded'] + report['partial'])
+        # کاربری که روی این نوع پنل حسابی ندارد (panels خالی) شکست حساب نمی‌شود
+        incomplete_uuids.update(item['uuid'] for item in report['partial'])
+        incomplete_uuids.update(item['uuid'] for item in report['failed'] if item['panels'])
+
+    for candidate, _ in items:
+        user_id, plan_price = candidate['user_id'], plan_info.price
+        if candidate['uuid'] in incomplete_uuids:
+            level = "partially applied" if candidate['uuid'] in renewed_uuids else "did not succeed"
+            logger.error(f"Auto-renewal failed for user {user_id}: Panel update for plan '{plan_info.name}' {level}; "
+                         f"wallet was not charged.")
+            continue
+        if candidate['uuid'] not in renewed_uuids:
+            logger.error(f"Auto-renewal failed for user {user_id}: Panel update for plan '{plan_info.name}' did not succeed.")
+            continue
+        if not db.update_wallet_balance(user_id, -plan_price, 'auto_renewal', f"تمدید خودکار سرویس: {plan_info.name}"):
+            logger.error(f"Auto-renewal for user {user_id}: Service renewed but wallet charge of {plan_price} failed.")
+            continue
+        try:
+            bot.send_message(user_id, f"✅ سرویس شما با موفقیت به صورت خودکار تمدید شد\\. مبلغ {plan_price:,.0f} تومان از حساب شما کسر گردید\\.", parse_mode="MarkdownV2")
+        except Exception as e:
+            logger.error(f"Failed to send auto-renewal message to user {user_id}: {e}")
+        logger.info(f"Auto-renewal successful for user {user_id} with plan '{plan_info.name}'.")
+
 
 def run_monthly_lottery(bot) -> None:
     """
@@ -631,22 +688,19 @@ def run_monthly_lottery(bot) -> None:
     winner_info = db.get_user_by_telegram_id(winner_id)
     winner_name = escape_markdown(winner_info.get('first_name', f"کاربر {winner_id}"))
 
-    prize_plan = next((p for p in load_service_plans() if p['name'] == 'Gold 🥇'), None)
+    prize_plan = get_plan_catalog().by_name.get('Gold 🥇')
     if prize_plan:
         winner_uuids = db.uuids(winner_id)
         if winner_uuids:
             winner_main_uuid = winner_uuids[0]['uuid']
             
-            add_days = parse_volume_string(prize_plan.get('duration', '0'))
-            if add_days > 0:
-                combined_handler.modify_user_on_all_panels(winner_main_uuid, add_days=add_days)
+            if prize_plan.days > 0:
+                combined_handler.modify_user_on_all_panels(winner_main_uuid, add_days=prize_plan.days)
 
-            add_gb_de = parse_volume_string(prize_plan.get('volume_de', '0'))
-            add_gb_fr_tr = parse_volume_string(prize_plan.get('volume_fr', '0'))
-            combined_handler.modify_user_on_all_panels(winner_main_uuid, add_gb=add_gb_de, target_panel_type='hiddify')
-            combined_handler.modify_user_on_all_panels(winner_main_uuid, add_gb=add_gb_fr_tr, target_panel_type='marzban')
+            combined_handler.modify_user_on_all_panels(winner_main_uuid, add_gb=prize_plan.gb('volume_de'), target_panel_type='hiddify')
+            combined_handler.modify_user_on_all_panels(winner_main_uuid, add_gb=prize_plan.gb('volume_fr'), target_panel_type='marzban')
             
-            winner_message = f"🎉 *{escape_markdown('شما برنده قرعه‌کشی ماهانه شدید!')}* 🎉\n\n{escape_markdown(f'تبریک! جایزه شما (سرویس {prize_plan["name"]}) به صورت خودکار به اکانتتان اضافه شد.')}"
+            winner_message = f"🎉 *{escape_markdown('شما برنده قرعه‌کشی ماهانه شدید!')}* 🎉\n\n{escape_markdown(f'تبریک! جایزه شما (سرویس {prize_plan.name}) به صورت خودکار به اکانتتان اضافه شد.')}"
             send_warning_message(bot, winner_id, winner_message)
 
             admin_message = f"🏆 *{escape_markdown('نتیجه قرعه‌کشی ماهانه')}*\n\n{escape_markdown('برنده این ماه:')} *{winner_name}* (`{winner_id}`)\n{escape_markdown('جایزه با موفقیت به ایشان اهدا شد.')}"
@@ -0,0 +1,204 @@
+# bot/shared_cache.py
+"""
+حافظه موقت مشترک بین پروسس‌ها (ورکرهای gunicorn وب‌اپ و پروسس ربات) روی یک فایل SQLite جداگانه.
+داده‌هایی که ساختنشان گران است (لیست ترکیبی کاربران، خروجی لینک‌های اشتراک، آمار داشبورد ادمین)
+یک بار ساخته شده و همه پروسس‌ها از همان نسخه استفاده می‌کنند؛ بنابراین افزایش تعداد ورکرها
+بار درخواست به API پنل‌ها را چند برابر نمی‌کند.
+
+- هر مقدار با pickle ذخیره می‌شود و زمان انقضا دارد.
+- شمارنده نسخه (generation) برای باطل کردن یک دسته داده در همه پروسس‌ها استفاده می‌شود.
+- lease یک قفل کوتاه‌مدت بین پروسس‌هاست تا فقط یک پروسس داده را بسازد و بقیه منتظر نتیجه بمانند.
+هر خطای این لایه فقط لاگ شده و مثل نبودن داده در حافظه رفتار می‌کند؛ یعنی هیچ‌وقت مانع پاسخ نمی‌شود.
+"""
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid as uuid_lib
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from .config import SHARED_CACHE_PATH
+
+logger = logging.getLogger(__name__)
+
+# هر چند بار نوشتن، ردیف‌های منقضی شده پاک می‌شوند
+_PRUNE_EVERY_SETS = 200
+_POLL_INTERVAL = 0.1
+
+
+class SharedCache:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._token = uuid_lib.uuid4().hex
+        self._sets = 0
+        try:
+            conn = self._thread_conn()
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_cache_entries_expires ON cache_entries(expires_at);
+                CREATE TABLE IF NOT EXISTS cache_generations (
+                    name TEXT PRIMARY KEY,
+                    generation INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS cache_leases (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+            """)
+        except sqlite3.Error as e:
+            logger.error(f"SharedCache: Could not initialize '{path}': {e}")
+
+    def _thread_conn(self) -> sqlite3.Connection:
+        """اتصال ترد جاری (پس از fork ورکرها دوباره ساخته می‌شود)؛ در حالت autocommit."""
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is None or local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            local.conn, local.pid = conn, os.getpid()
+        return conn
+
+    def _owner(self) -> str:
+        # مالک lease یک ترد مشخص در یک پروسس مشخص است (ورکرهای fork شده pid متفاوتی دارند)
+        return f"{os.getpid()}:{threading.get_ident()}:{self._token}"
+
+    def get(self, key: str) -> Optional[Any]:
+        """مقدار ذخیره شده (یا None اگر وجود نداشته یا منقضی شده باشد)."""
+        try:
+            row = self._thread_conn().execute(
+                "SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+            return pickle.loads(row[0]) if row else None
+        except (sqlite3.Error, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            logger.warning(f"SharedCache: Read of '{key}' failed: {e}")
+            return None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            conn = self._thread_conn()
+            conn.execute(
+                "INSERT INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (key, blob, time.time() + ttl)
+            )
+            self._sets += 1
+            if self._sets % _PRUNE_EVERY_SETS == 0:
+                conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+        except (sqlite3.Error, pickle.PicklingError, TypeError) as e:
+            logger.warning(f"SharedCache: Write of '{key}' failed: {e}")
+
+    def delete(self, key: str) -> None:
+        try:
+            self._thread_conn().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logger.warning(f"SharedCache: Delete of '{key}' failed: {e}")
+
+    def delete_prefix(self, prefix: str) -> None:
+        try:
+            self._thread_conn().execute(
+                "DELETE FROM cache_entries WHERE key >= ? AND key < ?", (prefix, prefix + '\uffff')
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"SharedCache: Delete of '{prefix}*' failed: {e}")
+
+    def trim_prefix(self, prefix: str, max_entries: int) -> None:
+        """از کلیدهای این پیشوند فقط max_entries مورد با دیرترین انقضا (تازه‌ترین) نگه داشته می‌شوند."""
+        try:
+            self._thread_conn().execute(
+                "DELETE FROM cache_entries WHERE key IN ("
+                "  SELECT key FROM cache_entries WHERE key >= ? AND key < ? ORDER BY expires_at DESC LIMIT -1 OFFSET ?"
+                ")", (prefix, prefix + '\uffff', max_entries)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"SharedCache: Trim of '{prefix}*' failed: {e}")
+
+    def generation(self, name: str) -> int:
+        try:
+            row = self._thread_conn().execute(
+                "SELECT generation FROM cache_generations WHERE name = ?", (name,)
+            ).fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            logger.warning(f"SharedCache: Read of generation '{name}' failed: {e}")
+            return -1
+
+    def bump(self, name: str) -> None:
+        """نسخه یک دسته داده را در همه پروسس‌ها یک واحد بالا می‌برد (باطل کردن)."""
+        try:
+            self._thread_conn().execute(
+                "INSERT INTO cache_generations (name, generation) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET generation = generation + 1", (name,)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"SharedCache: Bump of generation '{name}' failed: {e}")
+
+    @contextmanager
+    def lease(self, name: str, ttl: float) -> Iterator[bool]:
+        """
+        قفل کوتاه‌مدت بین پروسس‌ها. True یعنی این پروسس مسئول ساخت داده است.
+        اگر پروسس صاحب قفل از بین برود، قفل پس از ttl ثانیه منقضی می‌شود.
+        """
+        acquired = False
+        try:
+            now = time.time()
+            cursor = self._thread_conn().execute(
+                "INSERT INTO cache_leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE cache_leases.expires_at <= ?", (name, self._owner(), now + ttl, now)
+            )
+            acquired = cursor.rowcount == 1
+        except sqlite3.Error as e:
+            logger.warning(f"SharedCache: Lease '{name}' failed: {e}")
+            # بدون قفل هم کار ادامه پیدا می‌کند؛ فقط ممکن است چند پروسس همزمان داده را بسازند
+            acquired = True
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    self._thread_conn().execute(
+                        "DELETE FROM cache_leases WHERE name = ? AND owner = ?", (name, self._owner())
+                    )
+                except sqlite3.Error as e:
+                    logger.warning(f"SharedCache: Releasing lease '{name}' failed: {e}")
+
+    def wait_for(self, key: str, timeout: float, accept: Callable[[Any], bool] = lambda value: True) -> Optional[Any]:
+        """تا timeout ثانیه منتظر مقداری برای key می‌ماند که accept آن را بپذیرد."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            value = self.get(key)
+            if value is not None and accept(value):
+                return value
+            time.sleep(_POLL_INTERVAL)
+        return None
+
+    def get_or_compute(self, key: str, ttl: float, compute: Callable[[], Any], wait_timeout: float) -> Any:
+        """
+        مقدار را از حافظه مشترک برمی‌گرداند یا (فقط در یک پروسس) می‌سازد و ذخیره می‌کند.
+        پروسس‌های دیگر حداکثر wait_timeout ثانیه منتظر نتیجه می‌مانند و سپس خودشان آن را می‌سازند.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self.lease(key, wait_timeout) as acquired:
+            if acquired:
+                value = compute()
+                if value is not None:
+                    self.set(key, value, ttl)
+                return value
+        value = self.wait_for(key, wait_timeout)
+        return value if value is not None else compute()
+
+
+shared_cache = SharedCache(SHARED_CACHE_PATH)
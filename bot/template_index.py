@@ -0,0 +1,69 @@
+# bot/template_index.py
+"""
+ایندکس حافظه‌ای قالب‌های کانفیگ فعال برای ساخت سریع لینک اشتراک.
+قالب‌ها بر اساس (server_type, is_special, is_random_pool) گروه‌بندی می‌شوند و دسترسی کاربر به صورت یک
+بیت‌ماسک محاسبه می‌شود؛ بنابراین تشخیص قالب‌های مجاز فقط یک اشتراک بیتی به ازای هر گروه است.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+# بیت دسترسی هر نوع سرور؛ نوع‌هایی که اینجا نیستند (مثل none) برای همه کاربران مجازند
+ACCESS_BITS = {
+    'ir': 1 << 0, 'de': 1 << 1, 'fr': 1 << 2, 'tr': 1 << 3, 'us': 1 << 4,
+    'al': 1 << 5, 'nl': 1 << 6, 'ro': 1 << 7, 'supp': 1 << 8,
+}
+VIP_BIT = 1 << 9
+
+# پرچم سرورهای مرزبان به ترتیب نمایش در کانفیگ اطلاعات
+MARZBAN_SERVER_FLAGS = [
+    ('ir', "🇮🇷"), ('fr', "🇫🇷"), ('tr', "🇹🇷"), ('us', "🇺🇸"),
+    ('al', "🇦🇱"), ('nl', "🇳🇱"), ('ro', "🇷🇴"), ('supp', "🇫🇮"),
+]
+
+_PLACEHOLDER_RE = re.compile(r"(\{new_uuid\}|\{name\})")
+
+
+def user_access_mask(user_record: dict) -> int:
+    """بیت‌ماسک دسترسی‌های یک رکورد user_uuids (به همراه VIP)."""
+    mask = VIP_BIT if user_record.get('is_vip') else 0
+    for server_type, bit in ACCESS_BITS.items():
+        if user_record.get(f'has_access_{server_type}'):
+            mask |= bit
+    return mask
+
+
+class IndexedTemplate:
+    """یک قالب که متن آن از قبل به تکه‌های ثابت و جای‌گذاری ({new_uuid} / {name}) شکسته شده است."""
+    __slots__ = ('id', 'template_str', 'segments')
+
+    def __init__(self, template_id: int, template_str: str):
+        self.id = template_id
+        self.template_str = template_str
+        self.segments = tuple(seg for seg in _PLACEHOLDER_RE.split(template_str) if seg)
+
+    def render(self, values: Dict[str, str]) -> str:
+        return "".join(values.get(seg, seg) for seg in self.segments)
+
+
+class TemplateIndex:
+    def __init__(self, templates: List[dict], version: Optional[int] = None):
+        self.version = version
+        groups: Dict[Tuple[str, bool, bool], List[IndexedTemplate]] = {}
+        for tpl in templates:
+            key = (tpl.get('server_type') or 'none', bool(tpl.get('is_special')), bool(tpl.get('is_random_pool')))
+            groups.setdefault(key, []).append(IndexedTemplate(tpl['id'], tpl['template_str']))
+
+        # هر گروه: (ماسک لازم، در استخر تصادفی است؟، قالب‌ها)
+        self._groups = []
+        for (server_type, is_special, is_random_pool), items in groups.items():
+            required = ACCESS_BITS.get(server_type, 0) | (VIP_BIT if is_special else 0)
+            self._groups.append((required, is_random_pool, items))
+
+    def eligible(self, mask: int) -> Tuple[List[IndexedTemplate], List[IndexedTemplate]]:
+        """قالب‌های مجاز برای این ماسک را به صورت (ثابت، استخر تصادفی) برمی‌گرداند."""
+        fixed, random_pool = [], []
+        for required, is_random_pool, items in self._groups:
+            if required & ~mask:
+                continue
+            (random_pool if is_random_pool else fixed).extend(items)
+        return fixed, random_pool
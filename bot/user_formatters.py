@@ -10,7 +10,7 @@ from .utils import (
     create_progress_bar,
     format_daily_usage, escape_markdown,
     to_shamsi, days_until_next_birthday,
-    parse_user_agent
+    user_agent_details
 )
 
 
@@ -89,7 +89,7 @@ def fmt_one(info: dict, daily_usage_dict: dict, lang_code: str) -> str:
             if user_agents:
                 report.append("📱 *دستگاه‌های شما*")
                 for agent in user_agents[:6]: 
-                    parsed = parse_user_agent(agent['user_agent'])
+                    parsed = user_agent_details(agent)
                     if parsed:
                         os_name_lower = (parsed.get('os') or '').lower()
                         icon = "❓" # Default icon
@@ -153,10 +153,11 @@ def quick_stats(uuid_rows: list, page: int, lang_code: str) -> tuple[str, dict]:
     
     return report_text, menu_data
 
-def fmt_user_report(user_infos: list, lang_code: str) -> str:
+def fmt_user_report(user_infos: list, lang_code: str, bundle=None) -> str:
     """
     (نسخه نهایی با لاگ‌های دیباگ)
     گزارش شبانه را با escape کردن تک تک متغیرها و ثبت لاگ‌های دقیق برای عیب‌یابی ایجاد می‌کند.
+    در صورت ارسال bundle (ReportBundle)، رکورد، دسترسی‌ها و مصرف امروز به جای دیتابیس از آن خوانده می‌شوند.
     """
     if not user_infos:
         return ""
@@ -168,9 +169,14 @@ def fmt_user_report(user_infos: list, lang_code: str) -> str:
 
     for info in user_infos:
         try:
-            user_record = db.get_user_uuid_record(info.get("uuid", ""))
-            user_id = user_record.get('user_id') if user_record else None
-            access_rights = db.get_user_access_rights(user_id) if user_id else {}
+            if bundle is not None:
+                user_record = bundle.user_record(info.get("uuid", ""))
+                user_id = user_record.get('user_id') if user_record else None
+                access_rights = bundle.access_rights(user_id) if user_id else {}
+            else:
+                user_record = db.get_user_uuid_record(info.get("uuid", ""))
+                user_id = user_record.get('user_id') if user_record else None
+                access_rights = db.get_user_access_rights(user_id) if user_id else {}
             name = info.get("name", get_string('unknown_user', lang_code))
             db_id = info.get('db_id', 'N/A')
 
@@ -179,7 +185,9 @@ def fmt_user_report(user_infos: list, lang_code: str) -> str:
             account_lines = [f"👤 اکانت : {escape_markdown(name)}"]
 
             daily_usage_dict = {}
-            if 'db_id' in info and info['db_id']:
+            if bundle is not None:
+                daily_usage_dict = bundle.usage_since_midnight(info.get("uuid", ""))
+            elif 'db_id' in info and info['db_id']:
                 daily_usage_dict = db.get_usage_since_midnight(info['db_id'])
                 logger.debug(f"fmt_user_report: Daily usage data for '{name}' (db_id: {db_id}): {daily_usage_dict}")
             else:
@@ -274,11 +282,12 @@ def fmt_user_report(user_infos: list, lang_code: str) -> str:
     return final_report
 
 
-def fmt_user_weekly_report(user_infos: list, lang_code: str) -> str:
+def fmt_user_weekly_report(user_infos: list, lang_code: str, bundle=None) -> str:
     """
     (نسخه نهایی و اصلاح شده)
     گزارش هفتگی را با تفکیک مصرف، مقایسه با هفته قبل و خلاصه‌ای هوشمند فرمت‌بندی می‌کند.
     این نسخه شامل سرور آمریکا بوده و پرانتزها را به درستی escape می‌کند.
+    در صورت ارسال bundle (ReportBundle)، رکورد، تاریخچه مصرف و دستاوردها از آن خوانده می‌شوند.
     """
     if not user_infos:
         return ""
@@ -292,15 +301,22 @@ def fmt_user_weekly_report(user_infos: list, lang_code: str) -> str:
         uuid = info.get("uuid")
         if not uuid: continue
 
-        uuid_id = db.get_uuid_id_by_uuid(uuid)
-        user_record = db.get_user_uuid_record(uuid)
+        if bundle is not None:
+            user_record = bundle.user_record(uuid)
+            uuid_id = user_record['id'] if user_record else None
+        else:
+            uuid_id = db.get_uuid_id_by_uuid(uuid)
+            user_record = db.get_user_uuid_record(uuid)
         if not uuid_id or not user_record: continue
 
         user_id = user_record.get('user_id')
         name = info.get("name", get_string('unknown_user', lang_code))
 
         # دریافت تاریخچه مصرف به تفکیک پنل‌ها
-        daily_history = db.get_user_daily_usage_history_by_panel(uuid_id, days=7)
+        if bundle is not None:
+            daily_history = bundle.daily_usage_history(uuid_id)
+        else:
+            daily_history = db.get_user_daily_usage_history_by_panel(uuid_id, days=7)
         current_week_usage = sum(item['total_usage'] for item in daily_history)
 
         account_lines = []
@@ -346,7 +362,11 @@ def fmt_user_weekly_report(user_infos: list, lang_code: str) -> str:
         
         # بخش دستاوردها
         week_start_utc = (datetime.now(tehran_tz) - timedelta(days=((jdatetime.datetime.now(tz=tehran_tz).weekday() + 1) % 7))).replace(hour=0, minute=0, second=0, microsecond=0).astimezone(pytz.utc)
-        weekly_achievements = db.get_user_achievements_in_range(user_id, week_start_utc) if user_id else []
+        if bundle is not None:
+            # بسته از قبل با همین شروع هفته (db.get_week_start_utc) بارگذاری شده است
+            weekly_achievements = bundle.achievements_for(user_id) if user_id else []
+        else:
+            weekly_achievements = db.get_user_achievements_in_range(user_id, week_start_utc) if user_id else []
         if weekly_achievements:
             account_lines.append(separator)
             account_lines.append(f"*{escape_markdown('🏆 دستاوردها و جوایز این هفته')}*")
@@ -757,7 +777,7 @@ def fmt_inline_result(info: dict) -> tuple[str, str]:
         if user_agents:
             lines.append("📱 *دستگاه‌های متصل:*")
             for agent in user_agents[:5]: 
-                parsed = parse_user_agent(agent['user_agent'])
+                parsed = user_agent_details(agent)
                 if parsed:
                     client_name = escape_markdown(parsed.get('client', 'Unknown'))
                     last_seen_time = escape_markdown(to_shamsi(agent['last_seen'], include_time=True))
@@ -3,6 +3,7 @@ from telebot import types
 from ..database import db
 from ..menu import menu
 from ..utils import escape_markdown, _safe_edit, load_service_plans, to_shamsi, parse_volume_string
+from ..catalog import get_plan_catalog
 from ..user_formatters import fmt_purchase_summary
 from ..admin_formatters import fmt_admin_purchase_notification
 from ..language import get_string
@@ -278,8 +279,8 @@ def confirm_purchase(call: types.CallbackQuery, plan_name: str, uuid_id: int):
     """(نسخه نهایی) پیش‌نمایش را با اعمال صحیح روزها فقط به پنل مربوطه، نمایش می‌دهد."""
     uid = call.from_user.id
     lang_code = db.get_user_language(uid)
-    plans = load_service_plans()
-    plan_to_buy = next((p for p in plans if p.get('name') == plan_name), None)
+    catalog_plan = get_plan_catalog().by_name.get(plan_name)
+    plan_to_buy = dict(catalog_plan.data) if catalog_plan else None
 
     if not plan_to_buy:
         bot.answer_callback_query(call.id, "خطا: پلن مورد نظر یافت نشد.", show_alert=True)
@@ -401,8 +402,8 @@ def execute_purchase(call: types.CallbackQuery, plan_name: str, uuid_id: int):
     except Exception as e:
         logger.error(f"Could not edit message to 'wait' status for user {uid}: {e}")
 
-    plans = load_service_plans()
-    plan_to_buy = next((p for p in plans if p.get('name') == plan_name), None)
+    catalog_plan = get_plan_catalog().by_name.get(plan_name)
+    plan_to_buy = dict(catalog_plan.data) if catalog_plan else None
 
     if not plan_to_buy:
         _safe_edit(uid, call.message.message_id, escape_markdown("خطا: پلن مورد نظر یافت نشد."))
@@ -735,8 +736,8 @@ def confirm_gift_purchase(call: types.CallbackQuery, plan_name: str):
         _safe_edit(uid, call.message.message_id, escape_markdown("خطا: کاربر دریافت‌کننده هدیه مشخص نیست."))
         return
 
-    plans = load_service_plans()
-    plan_to_buy = next((p for p in plans if p.get('name') == plan_name), None)
+    catalog_plan = get_plan_catalog().by_name.get(plan_name)
+    plan_to_buy = dict(catalog_plan.data) if catalog_plan else None
     if not plan_to_buy:
         bot.answer_callback_query(call.id, "خطا: پلن مورد نظر یافت نشد.", show_alert=True)
         return
@@ -859,8 +860,8 @@ def execute_gift_purchase(call: types.CallbackQuery, plan_name: str):
         _safe_edit(uid, call.message.message_id, escape_markdown("خطا: کاربر دریافت‌کننده هدیه مشخص نیست."))
         return
 
-    plans = load_service_plans()
-    plan_to_buy = next((p for p in plans if p.get('name') == plan_name), None)
+    catalog_plan = get_plan_catalog().by_name.get(plan_name)
+    plan_to_buy = dict(catalog_plan.data) if catalog_plan else None
     if not plan_to_buy:
         _safe_edit(uid, call.message.message_id, escape_markdown("خطا: پلن مورد نظر یافت نشد."))
         return
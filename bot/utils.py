@@ -1,7 +1,8 @@
 import re
+import copy
 import json
+import functools
 import logging
-import os
 from datetime import datetime, date, timedelta
 from typing import Union, Optional, Dict, Any
 import pytz
@@ -9,6 +10,7 @@ import jdatetime
 from .config import PROGRESS_COLORS
 import urllib.parse
 from .config import LOYALTY_REWARDS
+from .catalog import catalog_file, get_plan_catalog, parse_volume_string, service_plans
 
 
 logger = logging.getLogger(__name__)
@@ -101,37 +103,17 @@ def format_usage(usage_gb: float) -> str:
     return f"{usage_gb:.2f} GB"
 
 def load_json_file(file_name: str) -> dict | list:
-    """فایل جیسون را از مسیر مشخص شده بارگذاری می‌کند."""
-    try:
-        script_dir = os.path.dirname(__file__)
-        file_path = os.path.join(script_dir, file_name) # مسیردهی اصلاح شد
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        logger.warning(f"File not found: {file_name}")
-        return {}
-    except Exception as e:
-        logger.error(f"Failed to load or parse {file_name}: {e}")
-        return {}
+    """
+    فایل جیسون را از پوشه bot برمی‌گرداند؛ فایل فقط پس از تغییر (mtime) دوباره خوانده می‌شود.
+    خروجی یک کپی است و ویرایش آن روی نسخه کاتالوگ اثری ندارد.
+    """
+    if file_name == 'plans.json':
+        return load_service_plans()
+    return copy.deepcopy(catalog_file(file_name).get())
 
-# ==============================================================================
-# تابع اصلاح شده و هوشمند
-# ==============================================================================
 def load_service_plans():
-    try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        project_root = os.path.dirname(script_dir)
-        json_path = os.path.join(script_dir, 'plans.json')
-        
-        with open(json_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        logger.error(f"CRITICAL ERROR: 'plans.json' could not be found at the expected path: {json_path}")
-        return []
-    except Exception as e:
-        logger.error(f"CRITICAL ERROR: Failed to load or parse 'plans.json'. Error: {e}")
-        return []
-# ==============================================================================
+    """کپی قابل ویرایش لیست پلن‌ها (از کاتالوگ حافظه‌ای plans.json)."""
+    return get_plan_catalog().as_list()
 
 def validate_uuid(uuid_str: str) -> bool:
     return bool(_UUID_RE.match(uuid_str.strip())) if uuid_str else False
@@ -177,122 +159,85 @@ def load_custom_links():
             return json.load(f)
     except Exception: return {}
 
-def parse_volume_string(volume_str: str) -> int:
-    if not isinstance(volume_str, str):
-        return 0
-    numbers = re.findall(r'\d+', volume_str)
-    if numbers:
-        return int(numbers[0])
-    return 0
-
-def parse_user_agent(user_agent: str) -> Optional[Dict[str, Optional[str]]]:
-    if not user_agent or "TelegramBot" in user_agent:
-        return None
-
-    CLIENT_PATTERNS = [
-        {
-            "name": "Happ",
-            "regex": re.compile(r"^(Happ)/([\d.]+)(?:/(\w+))?"),
-            "extractor": lambda m: {
-                "client": "Happ",
-                "version": m.group(2),
-                "os": m.group(3).capitalize() if m.group(3) else "Unknown"
-            }
-        },
-        {
-            "name": "NekoBox",
-            "regex": re.compile(r"^(NekoBox)/(\w+)/([\d.]+)"),
-            "extractor": lambda m: {
-                "client": "NekoBox",
-                "version": m.group(3),
-                "os": m.group(2).upper()
-            }
-        },
-        {
-            "name": "V2Box Generic",
-            "regex": re.compile(r"^(v2box|V2Box)/([\d.]+)$"),
-            "extractor": lambda m: {
-                "client": "V2Box",
-                "version": m.group(2),
-                "os": "Unknown"
-            }
-        },
-        {
-            "name": "V2Box Android",
-            "regex": re.compile(r"^(V2Box)/([\d.]+)\s+\((Android)\s+([\d.]+)\)"),
-            "extractor": lambda m: {"client": "V2Box", "version": m.group(2), "os": f"Android {m.group(4)}"}
-        },
-        {
-            "name": "V2Box iOS",
-            "regex": re.compile(r"^(V2Box)\s+([\d.]+);(IOS)\s+([\d.]+)"),
-            "extractor": lambda m: {"client": m.group(1), "version": m.group(2), "os": f"iOS {m.group(4)}"}
-        },
-        {
-            "name": "Apple Clients",
-            "regex": re.compile(r"CFNetwork/.*? Darwin/([\d.]+)"),
-            "extractor": lambda m: _extract_apple_client_details(user_agent, m)
-        },
-        {
-            "name": "Hiddify",
-            "regex": re.compile(r'HiddifyNextX?/([\d.]+)\s+\((\w+)\)'),
-            "extractor": lambda m: {"client": "Hiddify", "version": m.group(1), "os": m.group(2).capitalize()}
-        },
-        {
-            "name": "v2rayNG",
-            "regex": re.compile(r"v2rayNG/([\d.]+)"),
-            "extractor": lambda m: {"client": "v2rayNG", "version": m.group(1), "os": "Android"}
-        },
-        {
-            "name": "v2rayN",
-            "regex": re.compile(r"v2rayN/([\d.]+)"),
-            "extractor": lambda m: {"client": "v2rayN", "version": m.group(1), "os": "Windows"}
-        },
-        {
-            "name": "NekoRay",
-            "regex": re.compile(r"nekoray/([\d.]+)"),
-            "extractor": lambda m: {"client": "NekoRay", "version": m.group(1), "os": "Linux"}
-        },
-        {
-            "name": "Throne",
-            "regex": re.compile(r'Throne/([\d.]+)\s+\((\w+);\s*(\w+)\)'),
-            "extractor": lambda m: {"client": "Throne", "version": m.group(1), "os": f"{m.group(2).capitalize()} {m.group(3)}"}
-        },
-        {
-            "name": "NapsternetV",
-            "regex": re.compile(r'NapsternetV/([\d.]+)'),
-            "extractor": lambda m: {
-                "client": "NapsternetV", "version": m.group(1),
-                "os": "Android" if 'android' in user_agent.lower() else "iOS" if 'ios' in user_agent.lower() else None
-            }
-        },
-        {
-            "name": "Browser",
-            "regex": re.compile(r"(Chrome|Firefox|Safari|OPR)/([\d.]+)"),
-            "extractor": lambda m: _extract_browser_details(user_agent, m)
-        }
-    ]
-
-    for pattern in CLIENT_PATTERNS:
-        match = pattern["regex"].search(user_agent)
+# --- تشخیص کلاینت از روی User-Agent ---
+# الگوها یک بار در سطح ماژول کامپایل می‌شوند و به همین ترتیب امتحان می‌شوند (ترتیب مهم است).
+# هر الگو چند کلمه کلیدی دارد؛ الگو فقط وقتی اجرا می‌شود که یکی از آن‌ها در رشته وجود داشته باشد.
+_USER_AGENT_PATTERNS = [
+    # (نام، کلمات کلیدی، الگو، استخراج‌کننده)
+    ("Happ", ("Happ",), re.compile(r"^(Happ)/([\d.]+)(?:/(\w+))?"),
+     lambda ua, m: {"client": "Happ", "version": m.group(2), "os": m.group(3).capitalize() if m.group(3) else "Unknown"}),
+    ("NekoBox", ("NekoBox",), re.compile(r"^(NekoBox)/(\w+)/([\d.]+)"),
+     lambda ua, m: {"client": "NekoBox", "version": m.group(3), "os": m.group(2).upper()}),
+    ("V2Box Generic", ("v2box", "V2Box"), re.compile(r"^(v2box|V2Box)/([\d.]+)$"),
+     lambda ua, m: {"client": "V2Box", "version": m.group(2), "os": "Unknown"}),
+    ("V2Box Android", ("V2Box",), re.compile(r"^(V2Box)/([\d.]+)\s+\((Android)\s+([\d.]+)\)"),
+     lambda ua, m: {"client": "V2Box", "version": m.group(2), "os": f"Android {m.group(4)}"}),
+    ("V2Box iOS", ("V2Box",), re.compile(r"^(V2Box)\s+([\d.]+);(IOS)\s+([\d.]+)"),
+     lambda ua, m: {"client": m.group(1), "version": m.group(2), "os": f"iOS {m.group(4)}"}),
+    ("Apple Clients", ("CFNetwork/",), re.compile(r"CFNetwork/.*? Darwin/([\d.]+)"),
+     lambda ua, m: _extract_apple_client_details(ua, m)),
+    ("Hiddify", ("HiddifyNext",), re.compile(r'HiddifyNextX?/([\d.]+)\s+\((\w+)\)'),
+     lambda ua, m: {"client": "Hiddify", "version": m.group(1), "os": m.group(2).capitalize()}),
+    ("v2rayNG", ("v2rayNG/",), re.compile(r"v2rayNG/([\d.]+)"),
+     lambda ua, m: {"client": "v2rayNG", "version": m.group(1), "os": "Android"}),
+    ("v2rayN", ("v2rayN/",), re.compile(r"v2rayN/([\d.]+)"),
+     lambda ua, m: {"client": "v2rayN", "version": m.group(1), "os": "Windows"}),
+    ("NekoRay", ("nekoray/",), re.compile(r"nekoray/([\d.]+)"),
+     lambda ua, m: {"client": "NekoRay", "version": m.group(1), "os": "Linux"}),
+    ("Throne", ("Throne/",), re.compile(r'Throne/([\d.]+)\s+\((\w+);\s*(\w+)\)'),
+     lambda ua, m: {"client": "Throne", "version": m.group(1), "os": f"{m.group(2).capitalize()} {m.group(3)}"}),
+    ("NapsternetV", ("NapsternetV/",), re.compile(r'NapsternetV/([\d.]+)'),
+     lambda ua, m: {"client": "NapsternetV", "version": m.group(1),
+                    "os": "Android" if 'android' in ua.lower() else "iOS" if 'ios' in ua.lower() else None}),
+    ("Browser", ("Chrome/", "Firefox/", "Safari/", "OPR/"), re.compile(r"(Chrome|Firefox|Safari|OPR)/([\d.]+)"),
+     lambda ua, m: _extract_browser_details(ua, m)),
+]
+
+
+@functools.lru_cache(maxsize=4096)
+def _classify_user_agent(user_agent: str) -> Optional[tuple]:
+    """نتیجه تشخیص به صورت (client, os, version)؛ برای هر رشته خام فقط یک بار محاسبه می‌شود."""
+    for _name, keywords, regex, extractor in _USER_AGENT_PATTERNS:
+        if not any(keyword in user_agent for keyword in keywords):
+            continue
+        match = regex.search(user_agent)
         if match:
-            result = pattern["extractor"](match)
+            result = extractor(user_agent, match)
             if result:
                 if result.get('client') == 'Unknown Apple Client':
                     logger.info(f"DEBUG_USER_AGENT: An Apple client was not fully identified. Raw UA: '{user_agent}' -> Parsed: {result}")
-                return result
+                return result.get('client'), result.get('os'), result.get('version')
 
     logger.info(f"DEBUG_USER_AGENT: No specific pattern matched. Raw UA: '{user_agent}'")
     generic_client = user_agent.split('/')[0].split(' ')[0]
-    return {"client": generic_client, "os": "Unknown", "version": None}
+    return generic_client, "Unknown", None
+
+
+def parse_user_agent(user_agent: str) -> Optional[Dict[str, Optional[str]]]:
+    if not user_agent or "TelegramBot" in user_agent:
+        return None
+    client, os_name, version = _classify_user_agent(user_agent)
+    # هر بار دیکشنری تازه برگردانده می‌شود چون فراخوان‌ها گاهی آن را تغییر می‌دهند
+    return {"client": client, "os": os_name, "version": version}
+
+def user_agent_details(agent: Dict[str, Any]) -> Optional[Dict[str, Optional[str]]]:
+    """جزئیات دستگاه یک رکورد client_user_agents؛ از ستون‌های ذخیره‌شده و در نبود آن‌ها با پارس رشته خام."""
+    if agent.get('client'):
+        return {"client": agent['client'], "os": agent.get('os') or None, "version": agent.get('version')}
+    return parse_user_agent(agent.get('user_agent'))
+
+_APPLE_CLIENT_VERSION_PATTERNS = [
+    (client, re.compile(r"^{}/([\d.]+)".format(re.escape(client))))
+    for client in ["Shadowrocket", "Stash", "Quantumult%20X", "Loon", "V2Box", "Streisand", "Fair%20VPN", "Happ"]
+]
 
 def _extract_apple_client_details(user_agent: str, darwin_match: re.Match) -> Dict[str, Optional[str]]:
     """تابع کمکی برای استخراج جزئیات از user-agent های پیچیده اپل."""
     client_name, client_version = "Unknown Apple Client", None
     
-    known_clients = ["Shadowrocket", "Stash", "Quantumult%20X", "Loon", "V2Box", "Streisand", "Fair%20VPN", "Happ"]
-    for client in known_clients:
+    for client, version_regex in _APPLE_CLIENT_VERSION_PATTERNS:
         if user_agent.startswith(client.replace('%20', ' ')):
-            match = re.search(r"^{}/([\d.]+)".format(re.escape(client)), user_agent.replace('%20', ' '))
+            match = version_regex.search(user_agent.replace('%20', ' '))
             if match:
                 client_name = client.replace('%20', ' ')
                 client_version = match.group(1)
@@ -395,28 +340,22 @@ def get_processed_user_data(uuid: str) -> Optional[dict]:
 
     return processed_info
 
-def create_info_config(user_uuid: str) -> Optional[str]:
+def create_info_config(user_uuid: str, info: Optional[dict] = None, user_record: Optional[dict] = None) -> Optional[str]:
+    """info و user_record در صورتی که فراخوان از قبل آن‌ها را گرفته باشد، دوباره دریافت نمی‌شوند."""
     from .database import db
     from . import combined_handler
+    from .template_index import ACCESS_BITS, MARZBAN_SERVER_FLAGS, user_access_mask
     import urllib.parse
 
-    info = combined_handler.get_combined_user_info(user_uuid)
+    info = info or combined_handler.get_combined_user_info(user_uuid)
     if not info:
         return None
 
-    user_record = db.get_user_uuid_record(user_uuid)
+    user_record = user_record or db.get_user_uuid_record(user_uuid)
     if not user_record:
         return None
 
-    has_access_ir = user_record.get('has_access_ir', False)
-    has_access_de = user_record.get('has_access_de', False)
-    has_access_fr = user_record.get('has_access_fr', False)
-    has_access_tr = user_record.get('has_access_tr', False)
-    has_access_us = user_record.get('has_access_us', False)
-    has_access_al = user_record.get('has_access_al', False)
-    has_access_nl = user_record.get('has_access_nl', False)
-    has_access_ro = user_record.get('has_access_ro', False)
-    has_access_supp = user_record.get('has_access_supp', False)
+    access_mask = user_access_mask(user_record)
 
     parts = []
     breakdown = info.get('breakdown', {})
@@ -424,31 +363,14 @@ def create_info_config(user_uuid: str) -> Optional[str]:
     hiddify_info = next((p['data'] for p in breakdown.values() if p.get('type') == 'hiddify'), None)
     marzban_info = next((p['data'] for p in breakdown.values() if p.get('type') == 'marzban'), None)
 
-    if (has_access_de) and hiddify_info:
+    if access_mask & ACCESS_BITS['de'] and hiddify_info:
         usage = hiddify_info.get('current_usage_GB', 0)
         limit = hiddify_info.get('usage_limit_GB', 0)
         limit_str = f"{limit:.0f}" if limit > 0 else '∞'
         parts.append(f"🇩🇪 {usage:.0f}/{limit_str}GB")
 
-    if (has_access_ir or has_access_fr or has_access_tr or has_access_us or has_access_al or has_access_nl or has_access_ro or has_access_supp) and marzban_info:
-        flags = []
-        if has_access_ir:
-            flags.append("🇮🇷")
-        if has_access_fr:
-            flags.append("🇫🇷")
-        if has_access_tr:
-            flags.append("🇹🇷")
-        if has_access_us:
-            flags.append("🇺🇸")
-        if has_access_al:
-            flags.append("🇦🇱")
-        if has_access_nl:
-            flags.append("🇳🇱")
-        if has_access_ro:
-            flags.append("🇷🇴")
-        if has_access_supp:
-            flags.append("🇫🇮")                    
-
+    flags = [flag for server_type, flag in MARZBAN_SERVER_FLAGS if access_mask & ACCESS_BITS[server_type]]
+    if flags and marzban_info:
         flag_str = "".join(flags)
         usage = marzban_info.get('current_usage_GB', 0)
         limit = marzban_info.get('usage_limit_GB', 0)
@@ -467,15 +389,16 @@ def create_info_config(user_uuid: str) -> Optional[str]:
     encoded_name = urllib.parse.quote(final_name_parts)
     return f"vless://00000000-0000-0000-0000-000000000000@1.1.1.1:443?type=ws&path=/&security=tls#{encoded_name}"
 
-def generate_user_subscription_configs(user_main_uuid: str, user_id: int) -> list[str]:
+def generate_user_subscription_configs(user_main_uuid: str, user_id: int, user_info: Optional[dict] = None, user_record: Optional[dict] = None) -> list[str]:
     from .database import db
     from . import combined_handler
+    from .template_index import user_access_mask
     import urllib.parse
     import random
     from .config import RANDOM_SERVERS_COUNT
 
-    user_info = combined_handler.get_combined_user_info(user_main_uuid)
-    user_record = db.get_user_uuid_record(user_main_uuid)
+    user_info = user_info or combined_handler.get_combined_user_info(user_main_uuid)
+    user_record = user_record or db.get_user_uuid_record(user_main_uuid)
     if not user_info or not user_record:
         logger.warning(f"Could not generate subscription for UUID {user_main_uuid}. User info or DB record not found.")
         return []
@@ -483,78 +406,30 @@ def generate_user_subscription_configs(user_main_uuid: str, user_id: int) -> lis
     user_settings = db.get_user_settings(user_id)
     show_info_conf = user_settings.get('show_info_config', True)
     
-    final_configs_to_process = []
+    final_configs = []
 
     if show_info_conf:
-        info_config = create_info_config(user_main_uuid)
+        info_config = create_info_config(user_main_uuid, info=user_info, user_record=user_record)
         if info_config:
-            final_configs_to_process.append(info_config)
-
-    has_access_ir = user_record.get('has_access_ir', False)
-    has_access_de = user_record.get('has_access_de', False)
-    has_access_fr = user_record.get('has_access_fr', False)
-    has_access_tr = user_record.get('has_access_tr', False)
-    has_access_us = user_record.get('has_access_us', False)
-    has_access_al = user_record.get('has_access_al', False)
-    has_access_nl = user_record.get('has_access_nl', False)
-    has_access_ro = user_record.get('has_access_ro', False)
-    has_access_supp = user_record.get('has_access_supp', False)
-    is_user_vip = user_record.get('is_vip', False)
-    user_name = user_record.get('name', 'کاربر')
-
-    # --- ✨ شروع منطق کاملاً جدید برای حفظ ترتیب ---
-    # ۱. دریافت تمام کانفیگ‌های فعال با حفظ ترتیب اصلی (بر اساس ID)
-    all_active_templates = db.get_active_config_templates()
-
-    # ۲. فیلتر کردن کانفیگ‌ها بر اساس دسترسی کاربر
-    eligible_templates = []
-    for tpl in all_active_templates:
-        is_special = tpl.get('is_special', False)
-        server_type = tpl.get('server_type', 'none')
-        
-        if (is_special and not is_user_vip) or \
-            (server_type == 'ir' and not has_access_ir) or \
-            (server_type == 'de' and not has_access_de) or \
-            (server_type == 'fr' and not has_access_fr) or \
-            (server_type == 'tr' and not has_access_tr) or \
-            (server_type == 'us' and not has_access_us) or \
-            (server_type == 'al' and not has_access_al) or \
-            (server_type == 'nl' and not has_access_nl) or \
-            (server_type == 'ro' and not has_access_ro) or \
-            (server_type == 'supp' and not has_access_supp):
-            continue
-        eligible_templates.append(tpl)
+            final_configs.append(info_config)
 
-    # ۳. جدا کردن کانفیگ‌های ثابت از کانفیگ‌های داخل استخر تصادفی
-    fixed_templates = [tpl for tpl in eligible_templates if not tpl.get('is_random_pool')]
-    random_pool_templates = [tpl for tpl in eligible_templates if tpl.get('is_random_pool')]
+    # ۱. قالب‌های مجاز کاربر از ایندکس حافظه‌ای (ثابت و داخل استخر تصادفی) با یک اشتراک بیتی
+    fixed_templates, random_pool_templates = db.get_template_index().eligible(user_access_mask(user_record))
 
-    # ۴. انتخاب تصادفی از استخر (در صورت نیاز)
-    chosen_random_templates = []
+    # ۲. انتخاب تصادفی از استخر (در صورت نیاز)؛ اگر تعداد کمتر بود، همه انتخاب می‌شوند
     if RANDOM_SERVERS_COUNT and RANDOM_SERVERS_COUNT > 0 and len(random_pool_templates) > RANDOM_SERVERS_COUNT:
         chosen_random_templates = random.sample(random_pool_templates, RANDOM_SERVERS_COUNT)
     else:
-        chosen_random_templates = random_pool_templates # اگر تعداد کمتر بود، همه را انتخاب کن
+        chosen_random_templates = random_pool_templates
 
-    # ۵. ترکیب کانفیگ‌های ثابت و کانفیگ‌های انتخاب شده از استخر
-    final_template_objects = fixed_templates + chosen_random_templates
-    
-    # ۶. مرتب‌سازی لیست نهایی بر اساس ID اصلی برای حفظ ترتیب اولیه
-    final_template_objects.sort(key=lambda x: x['id'], reverse=False)
-    
-    # ۷. استخراج رشته کانفیگ‌ها از آبجکت‌های مرتب شده
-    final_configs_to_process.extend([tpl['template_str'] for tpl in final_template_objects])
-    # --- ✨ پایان منطق جدید ---
+    # ۳. ترکیب و مرتب‌سازی بر اساس ID اصلی برای حفظ ترتیب اولیه
+    final_template_objects = sorted(fixed_templates + chosen_random_templates, key=lambda tpl: tpl.id)
 
-    processed_configs = []
-    for config_str in final_configs_to_process:
-        # جایگزینی متغیرها در تمام کانفیگ‌ها
-        if "{new_uuid}" in config_str or "{name}" in config_str:
-            config_str = config_str.replace("{new_uuid}", user_main_uuid)
-            config_str = config_str.replace("{name}", urllib.parse.quote(user_name))
-        processed_configs.append(config_str)
+    # ۴. جای‌گذاری متغیرها؛ متن قالب‌ها از قبل به تکه‌ها شکسته شده است
+    placeholder_values = {"{new_uuid}": user_main_uuid, "{name}": urllib.parse.quote(user_record.get('name', 'کاربر'))}
+    final_configs.extend(tpl.render(placeholder_values) for tpl in final_template_objects)
 
-    return processed_configs
+    return final_configs
 
 def set_template_server_type_service(template_id: int, server_type: str):
     from .database import db
@@ -569,17 +444,8 @@ def reset_all_templates():
     return True
 
 def save_service_plans(plans: list) -> bool:
-    """لیست پلن‌ها را در فایل plans.json ذخیره می‌کند."""
-    try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        json_path = os.path.join(script_dir, 'plans.json')
-        
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(plans, f, ensure_ascii=False, indent=4)
-        return True
-    except Exception as e:
-        logger.error(f"CRITICAL ERROR: Failed to save 'plans.json'. Error: {e}")
-        return False
+    """لیست پلن‌ها را به صورت اتمیک در plans.json ذخیره کرده و کاتالوگ پلن‌ها را به‌روز می‌کند."""
+    return service_plans.save(plans)
 
 
 def get_loyalty_progress_message(user_id: int) -> Optional[Dict[str, Any]]:
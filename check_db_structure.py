@@ -25,7 +25,10 @@ def inspect_database_structure():
             print("⚠️ هیچ جدولی در این دیتابیس یافت نشد.")
             return
 
-        print(f"✅ تعداد {len(tables)} جدول پیدا شد.\n")
+        print(f"✅ تعداد {len(tables)} جدول پیدا شد.")
+        # نسخه اسکیما توسط مهاجرت‌های bot/db/migrations.py در user_version ثبت می‌شود
+        cursor.execute("PRAGMA user_version;")
+        print(f"ℹ️ نسخه اسکیما (user_version): {cursor.fetchone()[0]}\n")
 
         # 2. پیمایش روی هر جدول و دریافت اطلاعات ستون‌ها
         for table in tables:
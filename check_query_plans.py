@@ -0,0 +1,147 @@
+# File: check_query_plans.py
+# بررسی ایندکس‌های کوئری‌های پرتکرار دیتابیس با EXPLAIN QUERY PLAN.
+# یک دیتابیس موقت با همه مهاجرت‌ها (bot/db/migrations.py) ساخته می‌شود و متدهای واقعی کلاس‌های دیتابیس روی آن
+# اجرا می‌شوند؛ SQL هر فراخوان با set_trace_callback گرفته شده و بررسی می‌شود که جدول‌های اصلی آن با ایندکس
+# جستجو شوند و به صورت کامل پیمایش (SCAN) نشوند. به این ترتیب تغییر کوئری یک متد خودبه‌خود بررسی می‌شود.
+# اجرا: python check_query_plans.py   (در صورت وجود کوئری بدون ایندکس، با کد خروج 1 پایان می‌یابد)
+import os
+import re
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from bot.database import Database
+from bot.db.migrations import LATEST_VERSION, schema_version
+
+USER_ID = 1
+UUID = "0b0d5b5e-1c1a-4c3e-9f5a-6a1b2c3d4e5f"
+
+# (بخش/متد، فراخوان متد روی دیتابیس موقت با شناسه UUID نمونه، جدول‌هایی که نباید کامل پیمایش شوند)
+HOT_CALLS = [
+    # --- UserDB ---
+    ("UserDB.user", lambda db, uuid_id: db.user(USER_ID), ["users"]),
+    ("UserDB.uuids", lambda db, uuid_id: db.uuids(USER_ID), ["user_uuids"]),
+    ("UserDB.get_uuid_id_by_uuid", lambda db, uuid_id: db.get_uuid_id_by_uuid(UUID), ["user_uuids"]),
+    ("UserDB.get_user_agents_for_uuid", lambda db, uuid_id: db.get_user_agents_for_uuid(uuid_id), ["client_user_agents"]),
+    ("UserDB.count_user_agents", lambda db, uuid_id: db.count_user_agents(uuid_id), ["client_user_agents"]),
+    # پیمایش users روی ایندکس جزئی idx_users_auto_renew فقط کاربران تمدید خودکار را می‌خواند
+    ("UserDB.get_auto_renew_candidates", lambda db, uuid_id: db.get_auto_renew_candidates(), ["user_uuids", "uu"]),
+    ("DatabaseManager._sync_user_cache", lambda db, uuid_id: db._sync_user_cache(force=True), ["user_cache_log"]),
+
+    # --- UsageDB ---
+    ("UsageDB.get_usage_since_midnight", lambda db, uuid_id: db.get_usage_since_midnight(uuid_id), ["usage_snapshots"]),
+    ("UsageDB.get_panel_usage_in_intervals",
+     lambda db, uuid_id: db.get_panel_usage_in_intervals(uuid_id, 'hiddify_usage_gb'), ["usage_snapshots"]),
+    ("UsageDB.get_daily_active_users_count", lambda db, uuid_id: db.get_daily_active_users_count(), ["usage_snapshots"]),
+    ("UsageDB.delete_old_snapshots", lambda db, uuid_id: db.delete_old_snapshots(), ["usage_snapshots"]),
+    ("UsageDB.get_user_daily_usage_history_by_panel",
+     lambda db, uuid_id: db.get_user_daily_usage_history_by_panel(uuid_id), ["daily_usage"]),
+
+    # --- WalletDB ---
+    ("WalletDB.get_wallet_history", lambda db, uuid_id: db.get_wallet_history(USER_ID), ["wallet_transactions"]),
+    ("WalletDB.get_wallet_transactions_paginated",
+     lambda db, uuid_id: db.get_wallet_transactions_paginated(USER_ID), ["wallet_transactions"]),
+    ("WalletDB.get_wallet_transactions_count", lambda db, uuid_id: db.get_wallet_transactions_count(USER_ID), ["wallet_transactions"]),
+    ("WalletDB.get_user_total_expenses", lambda db, uuid_id: db.get_user_total_expenses(USER_ID), ["wallet_transactions"]),
+    ("WalletDB.get_user_purchase_stats", lambda db, uuid_id: db.get_user_purchase_stats(USER_ID), ["wallet_transactions"]),
+    ("WalletDB.get_pending_charge_request", lambda db, uuid_id: db.get_pending_charge_request(USER_ID, 1), ["charge_requests"]),
+
+    # --- NotificationsDB ---
+    ("NotificationsDB.has_recent_warning", lambda db, uuid_id: db.has_recent_warning(uuid_id, 'expiry'), ["warning_log"]),
+    ("NotificationsDB.get_recent_warnings", lambda db, uuid_id: db.get_recent_warnings(24), ["warning_log"]),
+    ("NotificationsDB.get_sent_reports", lambda db, uuid_id: db.get_sent_reports(USER_ID), ["sent_reports"]),
+    ("NotificationsDB.get_old_reports_to_delete", lambda db, uuid_id: db.get_old_reports_to_delete(), ["sent_reports", "sr"]),
+    ("NotificationsDB.get_notifications_for_user", lambda db, uuid_id: db.get_notifications_for_user(USER_ID), ["notifications"]),
+    ("NotificationsDB.mark_all_notifications_as_read",
+     lambda db, uuid_id: db.mark_all_notifications_as_read(USER_ID), ["notifications"]),
+
+    # --- FinancialsDB / AchievementDB ---
+    ("FinancialsDB.get_user_payment_history", lambda db, uuid_id: db.get_user_payment_history(uuid_id), ["payments"]),
+    ("FinancialsDB.get_total_payments_in_range",
+     lambda db, uuid_id: db.get_total_payments_in_range(datetime.now() - timedelta(days=30), datetime.now()), ["payments"]),
+    ("AchievementDB.get_user_achievements", lambda db, uuid_id: db.get_user_achievements(USER_ID), ["user_achievements"]),
+    ("AchievementDB.get_all_achievements_in_range",
+     lambda db, uuid_id: db.get_all_achievements_in_range(datetime.now() - timedelta(days=7)), ["user_achievements"]),
+]
+
+# دستوراتی که پلن اجرایی ندارند؛ خطوطی که با -- شروع می‌شوند دستورات داخل تریگرها هستند
+_SKIPPED_STATEMENTS = re.compile(r"\s*(--|BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE|PRAGMA)", re.IGNORECASE)
+
+
+def _seed(db: Database) -> int:
+    """برای هر جدول بررسی‌شده حداقل یک ردیف می‌سازد و شناسه UUID نمونه را برمی‌گرداند."""
+    db.add_or_update_user(USER_ID, "user", "First", "Last")
+    db.add_uuid(USER_ID, UUID, "config")
+    uuid_id = db.get_uuid_id_by_uuid(UUID)
+    db.update_auto_renew_setting(USER_ID, True)
+    db.add_usage_snapshot(uuid_id, 1.0, 1.0)
+    db.update_wallet_balance(USER_ID, 1000, 'deposit', "seed")
+    db.create_charge_request(USER_ID, 1000, 1)
+    db.log_warning(uuid_id, 'expiry')
+    db.add_sent_report(USER_ID, 1)
+    db.create_notification(USER_ID, "title", "message")
+    db.add_payment_record(uuid_id)
+    db.add_achievement(USER_ID, 'veteran')
+    return uuid_id
+
+
+def _full_scans(plan_details: list[str], tables: list[str]) -> list[str]:
+    """ردیف‌هایی از پلن که یکی از جدول‌ها را بدون ایندکس (یا با پیمایش کامل ایندکس) می‌خوانند."""
+    scans = []
+    for detail in plan_details:
+        for table in tables:
+            if re.match(rf"SCAN (TABLE )?{table}\b", detail):
+                scans.append(detail)
+    return scans
+
+
+def _traced_statements(db: Database, call, uuid_id: int) -> list[str]:
+    """متد را روی اتصال ترد جاری اجرا کرده و دستورات SQL اجرا شده (با مقادیر جایگذاری شده) را برمی‌گرداند."""
+    statements = []
+    # حافظه کاربران خالی می‌شود تا متدهای کش‌دار هم به دیتابیس مراجعه کنند
+    db._user_cache.clear()
+    with db._conn() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            call(db, uuid_id)
+        finally:
+            conn.set_trace_callback(None)
+    return [sql for sql in statements if not _SKIPPED_STATEMENTS.match(sql)]
+
+
+def main() -> int:
+    tmp_dir = tempfile.mkdtemp(prefix="query_plans_")
+    try:
+        db = Database(os.path.join(tmp_dir, "bot_data.db"))
+        uuid_id = _seed(db)
+        with db._conn() as conn:
+            version = schema_version(conn)
+        print(f"Schema version: {version} (latest: {LATEST_VERSION})")
+        print("-" * 100)
+
+        failures = 0
+        for label, call, tables in HOT_CALLS:
+            statements = _traced_statements(db, call, uuid_id)
+            if not statements:
+                failures += 1
+                print(f"[FAIL] {label:<45} no SQL was executed")
+                continue
+            with db._conn() as conn:
+                plans = [[row['detail'] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")] for sql in statements]
+            scans = [scan for details in plans for scan in _full_scans(details, tables)]
+            status = "FAIL" if scans else "ok"
+            if scans:
+                failures += 1
+            print(f"[{status:>4}] {label:<45} {' || '.join(' | '.join(details) for details in plans if details)}")
+        print("-" * 100)
+        print(f"{len(HOT_CALLS) - failures}/{len(HOT_CALLS)} hot queries use an index.")
+        return 1 if failures or version != LATEST_VERSION else 0
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
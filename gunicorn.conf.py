@@ -0,0 +1,29 @@
+# File: gunicorn.conf.py
+# تنظیمات اجرای وب‌اپ در حالت production:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# تعداد ورکرها و تردها از متغیرهای محیطی WEBAPP_WORKERS / WEBAPP_THREADS (فایل .env) خوانده می‌شود.
+# داده‌های گران (لیست ترکیبی کاربران، خروجی اشتراک‌ها، آمار داشبورد) در shared_cache بین ورکرها مشترک است،
+# پس افزایش ورکرها تعداد درخواست به API پنل‌ها را زیاد نمی‌کند.
+from bot.config import WEBAPP_BIND, WEBAPP_WORKERS, WEBAPP_THREADS, WEBAPP_TIMEOUT
+
+bind = WEBAPP_BIND
+workers = WEBAPP_WORKERS
+threads = WEBAPP_THREADS
+worker_class = "gthread"
+timeout = WEBAPP_TIMEOUT
+graceful_timeout = 30
+# هر ورکر اپلیکیشن را خودش بارگذاری می‌کند تا اتصال‌های دیتابیس، سشن‌های HTTP پنل‌ها و تردهای پس‌زمینه
+# در پروسس master ساخته نشوند و بعد از fork بین ورکرها مشترک نمانند
+preload_app = False
+# ورکرها پس از این تعداد درخواست (با کمی پراکندگی) بازسازی می‌شوند تا نشت حافظه احتمالی انباشته نشود
+max_requests = 5000
+max_requests_jitter = 500
+accesslog = "-"
+errorlog = "-"
+loglevel = "info"
+
+
+def worker_exit(server, worker):
+    # دستگاه‌های ثبت شده در صف نوشتن تأخیری پیش از خروج ورکر ذخیره می‌شوند
+    from bot.database import db
+    db.flush_user_agents()
@@ -0,0 +1,34 @@
+# File: rebuild_daily_usage.py
+import sys
+import os
+import logging
+from datetime import date
+
+# --- این بخش برای دسترسی به ماژول‌های ربات ضروری است ---
+# اطمینان حاصل کنید که این اسکریپت در پوشه اصلی پروژه (کنار run_bot.py) قرار دارد
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+# ----------------------------------------------------
+
+from bot.database import db
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def rebuild(since=None):
+    """
+    جدول خلاصه مصرف روزانه (daily_usage) را از روی اسنپ‌شات‌های موجود از نو می‌سازد.
+    فقط روزهایی بازسازی می‌شوند که اسنپ‌شاتی پیش از آن‌ها باقی مانده است؛ اسنپ‌شات‌ها فقط ۳۲ روز نگه داشته
+    می‌شوند، پس ردیف‌های روزهای قدیمی‌تر دست نخورده می‌مانند.
+    پس از تغییر دستی اسنپ‌شات‌ها یا برای اولین مقداردهی این جدول اجرا شود.
+    اجرا: python rebuild_daily_usage.py [YYYY-MM-DD]   (تاریخ اختیاری تهران برای محدود کردن بازسازی به روزهای بعد از آن)
+    """
+    try:
+        logging.info("Rebuilding daily_usage from usage_snapshots...")
+        total_rows = db.rebuild_daily_usage(since)
+        logging.info(f"✅ Done. {total_rows} daily usage rows written.")
+    except Exception as e:
+        logging.error(f"An error occurred while rebuilding daily_usage: {e}", exc_info=True)
+
+
+if __name__ == "__main__":
+    rebuild(date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None)
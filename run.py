@@ -4,4 +4,5 @@ import os
 app = create_app()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8001, debug=True)
\ No newline at end of file
+    # فقط برای توسعه؛ در production از gunicorn (wsgi.py و gunicorn.conf.py) استفاده کنید
+    app.run(host='0.0.0.0', port=8001, debug=os.getenv("FLASK_DEBUG") == "1")
@@ -1,4 +1,4 @@
-from flask import Flask
+from flask import Flask, g
 import logging
 import os
 from bot.utils import to_shamsi
@@ -25,6 +25,17 @@ def create_app():
     app.register_blueprint(user_bp)
     app.register_blueprint(admin_bp)
 
+    # هر درخواست یک محدوده استعلام دارد تا اطلاعات یک کاربر در طول آن فقط یک بار از پنل‌ها گرفته شود
+    from bot import combined_handler
+
+    @app.before_request
+    def open_lookup_scope():
+        g.lookup_scope_token = combined_handler.begin_lookup_scope()
+
+    @app.teardown_request
+    def close_lookup_scope(exc):
+        combined_handler.end_lookup_scope(g.pop('lookup_scope_token', None))
+
     # --- START OF FIX ---
     @app.context_processor
     def inject_global_variables():
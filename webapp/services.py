@@ -2,12 +2,13 @@ from markupsafe import escape
 from datetime import datetime, timedelta
 import pytz
 from bot.database import db
-from bot.hiddify_api_handler import HiddifyAPIHandler  
-from bot.marzban_api_handler import MarzbanAPIHandler 
-from bot.combined_handler import get_all_users_combined, get_combined_user_info, search_user
+from bot.db.panel_users import panel_user_key
+from bot.combined_handler import get_all_users_combined, get_combined_user_info, search_user, _get_handler_for_panel, invalidate_combined_users_cache
 from bot.utils import to_shamsi, format_relative_time, format_usage, days_until_next_birthday
 import logging
-from bot.config import DAILY_REPORT_TIME, USAGE_WARNING_CHECK_HOURS
+from bot.config import DAILY_REPORT_TIME, USAGE_WARNING_CHECK_HOURS, DASHBOARD_CACHE_TTL, PANEL_FETCH_DEADLINE_SECONDS
+from bot.shared_cache import shared_cache
+from .user_service import invalidate_subscription_cache
 from html import unescape
 from html import escape as html_escape
 
@@ -19,8 +20,8 @@ try:
     hiddify_panel_config = next((p for p in active_panels if p['panel_type'] == 'hiddify'), None)
     marzban_panel_config = next((p for p in active_panels if p['panel_type'] == 'marzban'), None)
 
-    hiddify_handler = HiddifyAPIHandler(hiddify_panel_config) if hiddify_panel_config else None
-    marzban_handler = MarzbanAPIHandler(marzban_panel_config) if marzban_panel_config else None
+    hiddify_handler = _get_handler_for_panel(hiddify_panel_config) if hiddify_panel_config else None
+    marzban_handler = _get_handler_for_panel(marzban_panel_config) if marzban_panel_config else None
     
     if hiddify_handler:
         logger.info(f"WebApp services initialized default Hiddify handler for panel: {hiddify_panel_config.get('name')}")
@@ -128,6 +129,14 @@ def _process_user_data(all_users_data):
 # == تابع اصلی سرویس داشبورد (نسخه نهایی و اصلاح شده) ==
 # ===================================================================
 def get_dashboard_data():
+    """
+    داده‌های داشبورد ادمین را از حافظه مشترک برمی‌گرداند. در هر DASHBOARD_CACHE_TTL ثانیه فقط یک ورکر
+    آن را می‌سازد (بررسی سلامت پنل‌ها و تجمیع کل کاربران) و بقیه ورکرها از همان نتیجه استفاده می‌کنند.
+    """
+    return shared_cache.get_or_compute('dashboard', DASHBOARD_CACHE_TTL, _build_dashboard_data,
+                                       wait_timeout=PANEL_FETCH_DEADLINE_SECONDS + 10)
+
+def _build_dashboard_data():
     """
     داده‌های کامل و پردازش‌شده را برای داشبورد ادمین جمع‌آوری می‌کند.
     """
@@ -417,13 +426,29 @@ def get_all_payments_for_admin():
         logger.error(f"Failed to get all payments for admin: {e}", exc_info=True)
         return []
 
+def _decorate_user_for_admin_list(user: dict) -> None:
+    """فیلدهای نمایشی (ایمن برای JSON) یک کاربر در لیست کاربران پنل ادمین را اضافه می‌کند."""
+    user['name'] = escape(user.get('name', 'کاربر ناشناس'))
+    user['last_online_relative'] = escape(format_relative_time(user.get('last_online')))
+
+    expire_days = user.get('expire')
+    if expire_days is not None and expire_days >= 0:
+        user['expire_shamsi'] = to_shamsi(datetime.now() + timedelta(days=expire_days))
+    else:
+        user['expire_shamsi'] = "نامحدود" if expire_days is None else "منقضی"
+    user['expire_shamsi'] = escape(user['expire_shamsi'])
+    user['total_daily_usage_formatted'] = escape(format_usage(user.get('total_daily_usage_gb', 0)))
+
+
 def get_paginated_users(args):
     """
     Fetches and prepares a paginated list of users for the admin panel,
     ensuring all data is sanitized for safe JSON rendering.
+    Filtering, search, sorting and paging run in SQLite against the panel_users directory;
+    until the first directory sync, the live combined list is used instead.
     """
     try:
-        page = int(args.get('page', 1))
+        page = max(1, int(args.get('page', 1)))
     except (ValueError, TypeError):
         page = 1
     
@@ -432,28 +457,63 @@ def get_paginated_users(args):
     panel_filter = args.get('panel', 'all')
     main_filter = args.get('filter', 'all')
 
+    if not db.has_panel_users():
+        return _get_paginated_users_live(page, per_page, search_query, panel_filter, main_filter)
+
+    panel_type = None if panel_filter == 'all' else ('hiddify' if panel_filter == 'de' else 'marzban')
+    paginated_users, total = db.get_panel_users_page(
+        search=search_query, panel=panel_type, status_filter=main_filter,
+        limit=per_page, offset=(page - 1) * per_page,
+        online_identifiers=_online_user_keys() if main_filter == 'online' else None
+    )
+    for user in paginated_users:
+        # مصرف امروز فقط برای ۱۵ کاربر همین صفحه محاسبه می‌شود
+        user['total_daily_usage_gb'] = sum(db.get_usage_since_midnight(user['uuid_id']).values()) if user['uuid_id'] else 0
+        _decorate_user_for_admin_list(user)
+
+    return {
+        'users': paginated_users,
+        'pagination': {
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'total_pages': (total + per_page - 1) // per_page
+        }
+    }
+
+
+def _online_user_keys():
+    """
+    کلید panel_users کاربرانی که در سه دقیقه اخیر آنلاین بوده‌اند، از اسنپ‌شات زنده؛
+    last_online خود جدول فقط هر USER_DIRECTORY_SYNC_MINUTES یک بار به‌روز می‌شود.
+    """
+    online_deadline = datetime.now(pytz.utc) - timedelta(minutes=3)
+    keys = []
+    for user in get_all_users_combined():
+        last_online = user.get('last_online')
+        if isinstance(last_online, datetime):
+            last_online = last_online if last_online.tzinfo else pytz.utc.localize(last_online)
+            key = panel_user_key(user)
+            if key and last_online > online_deadline:
+                keys.append(key)
+    return keys
+
+
+def _get_paginated_users_live(page, per_page, search_query, panel_filter, main_filter):
+    """مسیر قدیمی: دریافت کل کاربران از پنل‌ها، فیلتر و صفحه‌بندی در حافظه (تا پیش از اولین همگام‌سازی panel_users)."""
     if search_query:
         all_users = search_user(search_query)
     else:
         all_users = get_all_users_combined()
+    all_daily_usages = db.get_all_daily_usage_since_midnight()
 
     for user in all_users:
-        user['name'] = escape(user.get('name', 'کاربر ناشناس'))
-        user['last_online_relative'] = escape(format_relative_time(user.get('last_online')))
-        
-        expire_days = user.get('expire')
-        if expire_days is not None and expire_days >= 0:
-            user['expire_shamsi'] = to_shamsi(datetime.now() + timedelta(days=expire_days))
-        else:
-            user['expire_shamsi'] = "نامحدود" if expire_days is None else "منقضی"
-        user['expire_shamsi'] = escape(user['expire_shamsi'])
-
         uuid = user.get('uuid')
         if uuid:
             uuid_record = db.get_user_uuid_record(uuid)
             if uuid_record:
                 uuid_id = uuid_record['id']
-                user['total_daily_usage_gb'] = sum(db.get_usage_since_midnight(uuid_id).values())
+                user['total_daily_usage_gb'] = sum(all_daily_usages.get(uuid, {}).values())
                 user['payment_count'] = len(db.get_user_payment_history(uuid_id))
                 user['is_vip'] = uuid_record.get('is_vip', False)
             else:
@@ -461,7 +521,7 @@ def get_paginated_users(args):
         else:
             user.update({'total_daily_usage_gb': 0, 'payment_count': 0, 'is_vip': False})
         
-        user['total_daily_usage_formatted'] = escape(format_usage(user.get('total_daily_usage_gb', 0)))
+        _decorate_user_for_admin_list(user)
         
         breakdown = user.get('breakdown', {})
         user['on_hiddify'] = any(p.get('type') == 'hiddify' for p in breakdown.values())
@@ -500,6 +560,17 @@ def get_paginated_users(args):
 # ===================================================================
 # == سرویس مدیریت کاربران (نسخه اصلاح شده نهایی) ==
 # ===================================================================
+def _refresh_user_directory_entry(identifier: str) -> None:
+    """ردیف یک کاربر را در panel_users پس از تغییر از پنل ادمین به‌روز می‌کند تا تا همگام‌سازی بعدی منتظر نماند."""
+    try:
+        user_info = get_combined_user_info(identifier)
+        if user_info:
+            db.upsert_panel_user(user_info)
+        else:
+            db.delete_panel_user(identifier)
+    except Exception as e:
+        logger.warning(f"Could not refresh user directory entry for '{identifier}': {e}")
+
 def create_user_in_panel(data: dict):
     panel = data.get('panel')
     if 'name' in data:
@@ -523,6 +594,8 @@ def create_user_in_panel(data: dict):
         raise Exception(error_detail)
 
     logger.info(f"Successfully created user in '{panel}'. Result: {result}")
+    invalidate_combined_users_cache()
+    _refresh_user_directory_entry(result.get('uuid') or result.get('username'))
     return result
 
 def update_user_in_panels(data: dict):
@@ -554,6 +627,9 @@ def update_user_in_panels(data: dict):
         if uuid_record:
             db.update_config_name(uuid_record['id'], data['common_name'])
 
+    invalidate_combined_users_cache()
+    invalidate_subscription_cache(uuid)
+    _refresh_user_directory_entry(uuid)
     logger.info(f"Update process finished for user UUID: {uuid}")
     return True
 
@@ -578,6 +654,9 @@ def delete_user_from_panels(uuid: str):
 
     logger.info(f"Deleting user record for UUID '{uuid}' from the local database.")
     db.delete_user_by_uuid(uuid)
+    db.delete_panel_user(uuid)
+    invalidate_combined_users_cache()
+    invalidate_subscription_cache(uuid)
     logger.info(f"Deletion process for UUID '{uuid}' completed successfully.")
     return True
 # ===================================================================
@@ -1,13 +1,11 @@
 from flask import Blueprint, render_template, abort, request, Response, url_for, flash, redirect, session, jsonify
 from bot.utils import load_json_file, generate_user_subscription_configs, to_shamsi
+from bot.catalog import serverless_config
 from bot.database import db
 from .user_service import user_service
-import base64
 import urllib.parse
 import logging
-from datetime import datetime, timedelta
 from bot.config import ADMIN_SUPPORT_CONTACT
-import os
 import json
 from bot.user_handlers import wallet as user_wallet_handlers
 import math
@@ -30,51 +28,15 @@ def user_dashboard(uuid):
     return render_template('user_dashboard.html', user=user_data)
 
 
-@user_bp.route('/sub/<string:uuid>')
-def serve_normal_subscription(uuid):
-    from bot import combined_handler
-    user_record = db.get_user_uuid_record(uuid)
-    if not user_record or not user_record.get('user_id'):
-        abort(404, "کاربر یا شناسه کاربری یافت نشد")
-        
-    user_id = user_record['user_id']
-    configs = generate_user_subscription_configs(uuid, user_id)
-    if not configs:
-        abort(404, "کانفیگ یافت نشد")
-    
-    subscription_content = "\n".join(configs)
-    
-    response = Response(subscription_content, mimetype='text/plain; charset=utf-8')
-    
-    user_info = combined_handler.get_combined_user_info(uuid)
-
-    if user_record and user_info:
-        profile_title = request.args.get('name', user_record.get('name', 'CloudVibe'))
-        
-        response.headers['Profile-Title'] = profile_title.encode('utf-8').decode('latin-1')
-        response.headers['Profile-Update-Interval'] = '24'
-        
-        usage = user_info.get('usage', {})
-        total_usage_bytes = int(usage.get('total_usage_GB', 0) * (1024**3))
-        data_limit_bytes = int(usage.get('data_limit_GB', 0) * (1024**3))
-        expire_days = user_info.get('expire')
-        expire_timestamp = 0
-        if expire_days is not None:
-            expire_timestamp = int((datetime.now() + timedelta(days=expire_days)).timestamp())
-
-        userinfo_header = f"upload={total_usage_bytes}; download=0; total={data_limit_bytes}; expire={expire_timestamp}"
-        response.headers['Subscription-Userinfo'] = userinfo_header
-
+def _record_subscription_user_agent(uuid, user_record):
     user_agent_str = request.headers.get('User-Agent')
-    # logger.info(f"Normal subscription link accessed for UUID: {uuid}")
-    # logger.info(f"Received User-Agent: {user_agent_str}")
 
     if user_record and user_agent_str:
         try:
             uuid_id = user_record.get('id')
             if uuid_id:
+                # فقط در صف قرار می‌گیرد؛ ذخیره در دیتابیس در پس‌زمینه و به صورت دسته‌ای انجام می‌شود
                 db.record_user_agent(uuid_id, user_agent_str)
-                logger.info(f"Successfully recorded User-Agent for uuid_id: {uuid_id}")
             else:
                 logger.warning(f"Could not find uuid_id in user_record for UUID {uuid}")
         except Exception as e:
@@ -82,62 +44,40 @@ def serve_normal_subscription(uuid):
     elif not user_agent_str:
         logger.warning(f"No User-Agent header received for UUID {uuid}.")
 
-    return response
 
-@user_bp.route('/sub/b64/<string:uuid>')
-def serve_base64_subscription(uuid):
-    from bot import combined_handler
-    user_record = db.get_user_uuid_record(uuid)
+def _subscription_response(uuid, encode_base64: bool):
+    """
+    پاسخ مشترک دو مسیر اشتراک. خروجی از کش اشتراک خوانده می‌شود و با ETag ارسال می‌گردد؛
+    کلاینتی که همان ETag را در If-None-Match بفرستد پاسخ 304 بدون بدنه دریافت می‌کند.
+    """
+    user_record, subscription = user_service.get_rendered_subscription(uuid)
     if not user_record or not user_record.get('user_id'):
         abort(404, "کاربر یا شناسه کاربری یافت نشد")
-
-    user_id = user_record['user_id']
-    configs = generate_user_subscription_configs(uuid, user_id)
-    if not configs:
+    if not subscription:
         abort(404, "کانفیگ یافت نشد")
-        
-    subscription_content = "\n".join(configs)
-    encoded_content = base64.b64encode(subscription_content.encode('utf-8')).decode('utf-8')
 
-    response = Response(encoded_content, mimetype='text/plain; charset=utf-8')
-    
-    user_info = combined_handler.get_combined_user_info(uuid)
+    content = subscription['content_b64'] if encode_base64 else subscription['content']
+    response = Response(content, mimetype='text/plain; charset=utf-8')
 
-    if user_record and user_info:
-        profile_title = request.args.get('name', user_record.get('name', 'CloudVibe'))
+    profile_title = request.args.get('name', user_record.get('name', 'CloudVibe'))
+    response.headers['Profile-Title'] = profile_title.encode('utf-8').decode('latin-1')
+    response.headers['Profile-Update-Interval'] = '24'
+    response.headers['Subscription-Userinfo'] = subscription['userinfo']
+    response.headers['Cache-Control'] = 'no-cache'
+    response.set_etag(subscription['etag'] + ('-b64' if encode_base64 else ''))
 
-        response.headers['Profile-Title'] = profile_title.encode('utf-8').decode('latin-1')
-        response.headers['Profile-Update-Interval'] = '24'
-        
-        usage = user_info.get('usage', {})
-        total_usage_bytes = int(usage.get('total_usage_GB', 0) * (1024**3))
-        data_limit_bytes = int(usage.get('data_limit_GB', 0) * (1024**3))
-        expire_days = user_info.get('expire')
-        expire_timestamp = 0
-        if expire_days is not None:
-            expire_timestamp = int((datetime.now() + timedelta(days=expire_days)).timestamp())
+    _record_subscription_user_agent(uuid, user_record)
 
-        userinfo_header = f"upload={total_usage_bytes}; download=0; total={data_limit_bytes}; expire={expire_timestamp}"
-        response.headers['Subscription-Userinfo'] = userinfo_header
+    return response.make_conditional(request)
 
-    user_agent_str = request.headers.get('User-Agent')
-    # logger.info(f"Base64 subscription link accessed for UUID: {uuid}")
-    # logger.info(f"Received User-Agent: {user_agent_str}")
 
-    if user_record and user_agent_str:
-        try:
-            uuid_id = user_record.get('id')
-            if uuid_id:
-                db.record_user_agent(uuid_id, user_agent_str)
-                logger.info(f"Successfully recorded User-Agent for uuid_id: {uuid_id}")
-            else:
-                logger.warning(f"Could not find uuid_id in user_record for UUID {uuid}")
-        except Exception as e:
-            logger.error(f"DATABASE ERROR: Could not log user agent for UUID {uuid}. Error: {e}", exc_info=True)
-    elif not user_agent_str:
-        logger.warning(f"No User-Agent header received for UUID {uuid}.")
+@user_bp.route('/sub/<string:uuid>')
+def serve_normal_subscription(uuid):
+    return _subscription_response(uuid, encode_base64=False)
 
-    return response
+@user_bp.route('/sub/b64/<string:uuid>')
+def serve_base64_subscription(uuid):
+    return _subscription_response(uuid, encode_base64=True)
 
 @user_bp.route('/<string:uuid>/links')
 def subscription_links_page(uuid):
@@ -283,10 +223,10 @@ def serve_serverless_config(uuid):
         abort(404, "کاربر یافت نشد یا غیرفعال است")
 
     try:
-        # خواندن فایل قالب
-        template_path = os.path.join(os.path.dirname(__file__), '..', 'bot', 'serverless_config.json')
-        with open(template_path, 'r', encoding='utf-8') as f:
-            config_template_str = f.read()
+        # قالب از کاتالوگ حافظه‌ای خوانده می‌شود (فقط پس از تغییر فایل دوباره از دیسک بارگذاری می‌شود)
+        config_template_str = serverless_config.get()
+        if not config_template_str:
+            raise FileNotFoundError('serverless_config.json')
 
         # جایگذاری UUID و نام کاربر
         user_name = user_record.get('name', 'Serverless')
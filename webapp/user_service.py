@@ -5,12 +5,39 @@ from datetime import datetime, timedelta
 import pytz
 from bot.database import db
 from bot.combined_handler import get_combined_user_info
-from bot.utils import to_shamsi, days_until_next_birthday, load_service_plans, parse_volume_string, get_loyalty_progress_message
+from bot.utils import to_shamsi, days_until_next_birthday, get_loyalty_progress_message, generate_user_subscription_configs
+from bot.catalog import get_plan_catalog
+from bot.config import SUBSCRIPTION_CACHE_TTL, SUBSCRIPTION_CACHE_MAX_ENTRIES
+from bot.shared_cache import shared_cache
+import base64
+import hashlib
 import jdatetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+# --- کش خروجی لینک اشتراک ---
+# خروجی هر UUID تا زمانی معتبر است که هیچ‌کدام از این مقادیر (دسترسی‌ها، VIP، نام، تنظیم کانفیگ اطلاعات،
+# نسخه قالب‌ها و آخرین اسنپ‌شات مصرف) تغییر نکرده باشد. همه با یک کوئری از get_subscription_state خوانده می‌شوند،
+# پس تغییراتی که ربات در پروسس دیگری ثبت می‌کند هم بلافاصله دیده می‌شود.
+# خروجی‌ها در حافظه مشترک (shared_cache) نگه داشته می‌شوند تا همه ورکرهای وب‌اپ از یک نسخه استفاده کنند.
+_SUBSCRIPTION_FINGERPRINT_FIELDS = (
+    'user_id', 'name', 'is_vip', 'has_access_ir', 'has_access_de', 'has_access_fr', 'has_access_tr', 'has_access_us',
+    'has_access_al', 'has_access_nl', 'has_access_ro', 'has_access_supp', 'show_info_config', 'templates_version', 'last_snapshot_id'
+)
+_SUBSCRIPTION_KEY_PREFIX = 'sub:'
+# هر چند بار ذخیره، تعداد خروجی‌های ذخیره شده به SUBSCRIPTION_CACHE_MAX_ENTRIES محدود می‌شود
+_SUBSCRIPTION_TRIM_EVERY = 100
+_subscription_writes = 0
+
+
+def invalidate_subscription_cache(uuid: str | None = None) -> None:
+    """خروجی کش‌شده اشتراک یک UUID (یا همه، در صورت None) را در همه ورکرها حذف می‌کند."""
+    if uuid is None:
+        shared_cache.delete_prefix(_SUBSCRIPTION_KEY_PREFIX)
+    else:
+        shared_cache.delete(_SUBSCRIPTION_KEY_PREFIX + uuid)
+
 class UserService:
     @staticmethod
     def get_user_usage_stats(uuid_id):
@@ -45,21 +72,21 @@ class UserService:
         if current_usage_gb < 1:
             return None, 0
 
-        all_plans = load_service_plans()
+        plans = get_plan_catalog().plans
         best_plan = None
         smallest_diff = float('inf')
 
-        for plan in all_plans:
-            total_volume_gb = parse_volume_string(plan.get('total_volume') or plan.get('volume_de') or plan.get('volume_fr') or plan.get('volume_tr') or '0')
-            if total_volume_gb > current_usage_gb:
-                diff = total_volume_gb - current_usage_gb
+        for plan in plans:
+            if plan.total_gb > current_usage_gb:
+                diff = plan.total_gb - current_usage_gb
                 if diff < smallest_diff:
                     smallest_diff = diff
                     best_plan = plan
         
-        if not best_plan and all_plans:
-            best_plan = max(all_plans, key=lambda p: parse_volume_string(p.get('total_volume') or p.get('volume_de') or p.get('volume_fr') or p.get('volume_tr') or '0'))
+        if not best_plan and plans:
+            best_plan = max(plans, key=lambda p: p.total_gb)
 
+        best_plan = dict(best_plan.data) if best_plan else None
         return best_plan, current_usage_gb
     
     @staticmethod
@@ -153,6 +180,61 @@ class UserService:
             "busiest_period": busiest_period_name
         }
 
+    @staticmethod
+    def _render_subscription(uuid, state):
+        user_info = get_combined_user_info(uuid)
+        configs = generate_user_subscription_configs(uuid, state['user_id'], user_info=user_info, user_record=state)
+        if not configs:
+            return None
+
+        content = "\n".join(configs)
+        usage = user_info.get('usage', {})
+        total_usage_bytes = int(usage.get('total_usage_GB', 0) * (1024**3))
+        data_limit_bytes = int(usage.get('data_limit_GB', 0) * (1024**3))
+        expire_days = user_info.get('expire')
+        expire_timestamp = 0
+        if expire_days is not None:
+            expire_timestamp = int((datetime.now() + timedelta(days=expire_days)).timestamp())
+        userinfo_header = f"upload={total_usage_bytes}; download=0; total={data_limit_bytes}; expire={expire_timestamp}"
+
+        return {
+            'content': content,
+            'content_b64': base64.b64encode(content.encode('utf-8')).decode('utf-8'),
+            'userinfo': userinfo_header,
+            'etag': hashlib.sha1(f"{content}\n{userinfo_header}".encode('utf-8')).hexdigest(),
+        }
+
+    @staticmethod
+    def get_rendered_subscription(uuid):
+        """
+        خروجی آماده لینک اشتراک را برمی‌گرداند: (state, entry).
+        state رکورد UUID است (None اگر کاربر وجود نداشته باشد) و entry شامل متن ساده، متن base64،
+        هدر Subscription-Userinfo و ETag است (None اگر کانفیگی برای کاربر وجود نداشته باشد).
+        تنها در صورت تغییر داده‌های وابسته یا گذشت SUBSCRIPTION_CACHE_TTL از پنل‌ها استعلام می‌شود.
+        """
+        global _subscription_writes
+        state = db.get_subscription_state(uuid)
+        if not state or not state.get('user_id'):
+            return state, None
+
+        fingerprint = tuple(state.get(field) for field in _SUBSCRIPTION_FINGERPRINT_FIELDS)
+        key = _SUBSCRIPTION_KEY_PREFIX + uuid
+        entry = shared_cache.get(key)
+        if entry and entry['fingerprint'] == fingerprint:
+            return state, entry
+
+        entry = UserService._render_subscription(uuid, state)
+        if entry is None:
+            invalidate_subscription_cache(uuid)
+            return state, None
+
+        entry['fingerprint'] = fingerprint
+        shared_cache.set(key, entry, SUBSCRIPTION_CACHE_TTL)
+        _subscription_writes += 1
+        if _subscription_writes % _SUBSCRIPTION_TRIM_EVERY == 0:
+            shared_cache.trim_prefix(_SUBSCRIPTION_KEY_PREFIX, SUBSCRIPTION_CACHE_MAX_ENTRIES)
+        return state, entry
+
     @staticmethod
     def get_processed_user_data(uuid):
         try:
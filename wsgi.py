@@ -1,4 +1,6 @@
+# نقطه ورود WSGI وب‌اپ برای اجرا در production:
+#   gunicorn -c gunicorn.conf.py wsgi:app
 from dotenv import load_dotenv
 load_dotenv()
 from webapp import create_app
-app = create_app()
\ No newline at end of file
+app = create_app()